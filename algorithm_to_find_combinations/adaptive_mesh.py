@@ -0,0 +1,138 @@
+"""Smoothed surfaces evaluated on a mesh that follows the rectangle tree.
+
+``split_rectangle`` subdivides cells where trials concentrate, which is near
+the difficulty boundary. Instead of a uniform grid, every cell here gets an
+evenly spaced ``(SUBDIVISIONS + 1)**2`` block of nodes, so the node spacing
+shrinks with the cell and the boundary gets the resolution of the deepest
+cells. The nodes of all cells, shared along common edges, are triangulated
+(Delaunay, which also closes the T-junctions between cells of different
+depth) and contours are extracted from the triangles.
+
+Node positions are integers on the lattice of the deepest cell's subdivision,
+so nodes shared by neighbouring cells coincide exactly.
+"""
+
+import matplotlib.tri as mtri
+import numpy as np
+
+from .plotting import (
+    normalized_points,
+    sample_arrays,
+    soft_brush_at,
+    soft_brush_radii,
+)
+from .quadtree import deinterleave
+
+# Node intervals along each side of a cell; a power of two keeps the nodes of
+# a cell on the lattice of its children
+SUBDIVISIONS = 4
+# Mesh nodes evaluated at once, bounding the (nodes x samples) distance matrix
+EVALUATION_CHUNK = 4096
+
+
+class AdaptiveMesh:
+    """Triangulated nodes in data coordinates, with the surface at each node"""
+
+    def __init__(self, points, triangles, Z=None):
+        self.points = points  # (nodes, 2) triangle size, saturation
+        self.triangles = triangles  # (triangles, 3) node indices
+        self.Z = Z  # (nodes,) or None until evaluated
+
+    def __len__(self):
+        return len(self.points)
+
+
+def rectangle_mesh(
+    cells, triangle_size_bounds, saturation_bounds, subdivisions=SUBDIVISIONS
+):
+    """Mesh of the quadtree ``cells``, an iterable of ``(depth, morton)``"""
+    cells = np.array(list(cells), dtype=np.uint64).reshape(-1, 2)
+    if not len(cells):
+        cells = np.zeros((1, 2), dtype=np.uint64)  # the root covers everything
+    depths = cells[:, 0].astype(np.int64)
+    columns, rows = deinterleave(cells[:, 1])
+    max_depth = int(depths.max())
+
+    # Lattice units per cell side, and the node offsets inside a cell
+    cell_units = (subdivisions << (max_depth - depths)).astype(np.int64)
+    steps = np.arange(subdivisions + 1)
+    offsets_i, offsets_j = np.meshgrid(steps, steps)
+    node_i = (
+        columns.astype(np.int64)[:, None] * cell_units[:, None]
+        + offsets_i.ravel()[None, :] * (cell_units // subdivisions)[:, None]
+    )
+    node_j = (
+        rows.astype(np.int64)[:, None] * cell_units[:, None]
+        + offsets_j.ravel()[None, :] * (cell_units // subdivisions)[:, None]
+    )
+    nodes = np.unique(np.column_stack([node_i.ravel(), node_j.ravel()]), axis=0)
+
+    lattice = subdivisions << max_depth
+    (ts_lo, ts_hi), (sat_lo, sat_hi) = triangle_size_bounds, saturation_bounds
+    points = np.column_stack(
+        [
+            ts_lo + nodes[:, 0] * ((ts_hi - ts_lo) / lattice),
+            sat_lo + nodes[:, 1] * ((sat_hi - sat_lo) / lattice),
+        ]
+    )
+    # Triangulate the unit square so both axes weigh the same
+    triangulation = mtri.Triangulation(nodes[:, 0] / lattice, nodes[:, 1] / lattice)
+    return AdaptiveMesh(points, triangulation.triangles)
+
+
+def soft_brush_mesh(
+    samples,
+    cells,
+    triangle_size_bounds,
+    saturation_bounds,
+    params=None,
+    subdivisions=SUBDIVISIONS,
+):
+    """Soft brush surface on the mesh of ``cells``"""
+    mesh = rectangle_mesh(cells, triangle_size_bounds, saturation_bounds, subdivisions)
+    points, values = sample_arrays(samples)
+    points_normalized = normalized_points(
+        points, triangle_size_bounds, saturation_bounds
+    )
+    nodes_normalized = normalized_points(
+        mesh.points, triangle_size_bounds, saturation_bounds
+    )
+    radii = soft_brush_radii(triangle_size_bounds, saturation_bounds, params or {})
+    mesh.Z = np.concatenate(
+        [
+            soft_brush_at(
+                nodes_normalized[start : start + EVALUATION_CHUNK],
+                points_normalized,
+                values,
+                *radii,
+            )
+            for start in range(0, len(mesh), EVALUATION_CHUNK)
+        ]
+    )
+    return mesh
+
+
+def contour_segments(mesh, level):
+    """Segments of the ``level`` line as a ``(segments, 2, 2)`` array.
+
+    Each triangle the line crosses contributes the segment between the two
+    edges it crosses, interpolated linearly; triangles with a NaN node are
+    skipped.
+    """
+    z = mesh.Z[mesh.triangles]
+    xy = mesh.points[mesh.triangles]
+    above = z >= level
+    crossed = ~np.isnan(z).any(axis=1) & (above.any(axis=1) != above.all(axis=1))
+    z, xy, above = z[crossed], xy[crossed], above[crossed]
+
+    edge_points = np.empty((len(z), 3, 2))
+    edge_crossed = np.empty((len(z), 3), dtype=bool)
+    for edge, (a, b) in enumerate(((0, 1), (1, 2), (2, 0))):
+        edge_crossed[:, edge] = above[:, a] != above[:, b]
+        # Edges the line does not cross divide by zero; their points are unused
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = (level - z[:, a]) / (z[:, b] - z[:, a])
+            edge_points[:, edge] = xy[:, a] + t[:, None] * (xy[:, b] - xy[:, a])
+    # The two crossed edges of each triangle, in edge order
+    first_two = np.argsort(~edge_crossed, axis=1, kind="stable")[:, :2]
+    return np.take_along_axis(edge_points, first_two[:, :, None], axis=1)
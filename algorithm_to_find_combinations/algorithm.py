@@ -2,6 +2,7 @@ import random
 import colorsys
 from tqdm import tqdm
 from .ground_truth import test_combination
+from .quadtree import child_code, locate
 
 # Remove hardcoded bounds and just keep orientations
 orientations = ["N", "S", "E", "W"]
@@ -41,6 +42,8 @@ def split_rectangle(rect):
             new_rects.append(
                 {
                     "bounds": new_bounds,
+                    "depth": rect["depth"] + 1,
+                    "morton": child_code(rect["morton"], i, j),
                     "area": rect["area"] / 4,
                     "true_samples": 0,
                     "false_samples": 0,
@@ -50,11 +53,18 @@ def split_rectangle(rect):
 
 
 class AlgorithmState:
-    def __init__(self, triangle_size_bounds, saturation_bounds, rectangles=None):
+    def __init__(
+        self, triangle_size_bounds, saturation_bounds, rectangles=None, trial_count=0
+    ):
         self.triangle_size_bounds = triangle_size_bounds
         self.saturation_bounds = saturation_bounds
+        # Results applied with update_state so far
+        self.trial_count = trial_count
         self.new_rectangles = []
         self.removed_rectangles = []
+        # (depth, morton) -> rectangle, built on first use by find_rectangle
+        self.cells = None
+        self.max_depth = 0
         if rectangles is None or len(rectangles) == 0:
             # Initialize with a single rectangle covering the entire space
             self.rectangles = [
@@ -63,6 +73,8 @@ class AlgorithmState:
                         "triangle_size": triangle_size_bounds,
                         "saturation": saturation_bounds,
                     },
+                    "depth": 0,
+                    "morton": 0,
                     "area": 1.0,
                     "true_samples": 0,
                     "false_samples": 0,
@@ -73,19 +85,22 @@ class AlgorithmState:
             self.rectangles = rectangles
 
 
-def get_next_combination(state: AlgorithmState):
-    """Get the next combination to test based on current state"""
+def get_next_combination(state: AlgorithmState, rng=random):
+    """Get the next combination to test based on current state.
+
+    ``rng`` is the ``random`` module or a ``random.Random`` to draw from.
+    """
     probabilities = [selection_probability(r) for r in state.rectangles]
     total_prob = sum(probabilities)
     if total_prob == 0:
         return None, None
 
     probabilities = [p / total_prob for p in probabilities]
-    selected_rect = random.choices(state.rectangles, weights=probabilities, k=1)[0]
+    selected_rect = rng.choices(state.rectangles, weights=probabilities, k=1)[0]
     bounds = selected_rect["bounds"]
 
-    triangle_size = random.uniform(*bounds["triangle_size"])
-    saturation = random.uniform(*bounds["saturation"])
+    triangle_size = rng.uniform(*bounds["triangle_size"])
+    saturation = rng.uniform(*bounds["saturation"])
 
     return {
         "triangle_size": triangle_size,
@@ -102,6 +117,7 @@ def update_state(
     total_samples_threshold=5,
 ):
     """Update algorithm state based on test result"""
+    state.trial_count += 1
     if success:
         selected_rect["true_samples"] += 1
     else:
@@ -125,6 +141,49 @@ def update_state(
         state.removed_rectangles.append(selected_rect)
         state.new_rectangles.extend(new_rects)
 
+        if state.cells is not None:
+            del state.cells[(selected_rect["depth"], selected_rect["morton"])]
+            for rect in new_rects:
+                state.cells[(rect["depth"], rect["morton"])] = rect
+            state.max_depth = max(state.max_depth, selected_rect["depth"] + 1)
+
+    return state
+
+
+def find_rectangle(state: AlgorithmState, triangle_size, saturation):
+    """The rectangle of the state containing the point, or None"""
+    if state.cells is None:
+        state.cells = {(r["depth"], r["morton"]): r for r in state.rectangles}
+        state.max_depth = max(depth for depth, _ in state.cells)
+    return locate(
+        state.cells,
+        triangle_size,
+        saturation,
+        state.triangle_size_bounds,
+        state.saturation_bounds,
+        state.max_depth,
+    )
+
+
+def replay_results(state: AlgorithmState, results):
+    """Apply recorded (triangle_size, saturation, success) results in order.
+
+    Each result updates the rectangle that contains it at that point of the
+    replay, as the live trial loop would have.
+    """
+    for triangle_size, saturation, success in results:
+        selected_rect = find_rectangle(state, triangle_size, saturation)
+        if selected_rect:
+            state = update_state(
+                state,
+                selected_rect,
+                {"triangle_size": triangle_size, "saturation": saturation},
+                bool(success),
+            )
+        else:
+            # Outside the current bounds; still counted so trial counts
+            # match positions in the recorded history
+            state.trial_count += 1
     return state
 
 
@@ -136,13 +195,20 @@ def run_base_algorithm(
     success_rate_threshold=0.85,
     total_samples_threshold=5,
     test_combination=test_combination,
+    show_progress=True,
+    rng=random,
 ):
-    """Keep original function working by using the new stateful version internally"""
+    """Keep original function working by using the new stateful version internally.
+
+    The combinations and the simulated observer both draw from ``rng``.
+    """
     state = AlgorithmState(triangle_size_bounds, saturation_bounds)
     combinations = []
 
-    for _ in tqdm(range(iterations), desc="Sampling Iterations"):
-        combination, selected_rect = get_next_combination(state)
+    for _ in tqdm(
+        range(iterations), desc="Sampling Iterations", disable=not show_progress
+    ):
+        combination, selected_rect = get_next_combination(state, rng)
         if not combination:
             break
 
@@ -150,6 +216,7 @@ def run_base_algorithm(
             combination["triangle_size"],
             combination["saturation"],
             bounds=(triangle_size_bounds, saturation_bounds),
+            rng=rng,
         )
 
         state = update_state(
@@ -1,15 +1,13 @@
+import os
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
-from algorithm import run_base_algorithm
-from plotting import (
+from .algorithm import run_base_algorithm
+from .plotting import (
     create_single_smooth_plot,
-    compute_knn_smooth,
-    compute_soft_brush_smooth,
-    compute_error,
-    ground_truth_probability,
     uniform_levels,
 )
+from .search_engine import run_search, successive_halving_search
 from tqdm import tqdm
 import random
 from math import ceil
@@ -25,6 +23,20 @@ n_random_trials = 300
 knn_k_range = (5, 200)
 soft_brush_inner_range = (5, 50)
 soft_brush_outer_range = (30, 100)
+# Next to this module, where algorithm_to_find_combinations/.gitignore covers it
+search_results_path = os.path.join(
+    os.path.dirname(__file__), "hyperparameter_search_results.jsonl"
+)
+search_workers = None  # None uses every CPU
+
+# Parameters for successive halving over split thresholds and radii
+halving_configurations = 81
+halving_min_iterations = 100
+halving_max_iterations = 1000
+halving_eta = 3
+halving_results_path = os.path.join(
+    os.path.dirname(__file__), "successive_halving_results.jsonl"
+)
 
 # Bounds (same as in main.py)
 triangle_size_bounds = (50, 300)
@@ -71,56 +83,18 @@ def run_hyperparameter_test_visual():
 
 
 def random_hyperparameter_search(combinations):
-    # Create theoretical model for error computation
-    grid_x = np.linspace(triangle_size_bounds[0], triangle_size_bounds[1], 100)
-    grid_y = np.linspace(saturation_bounds[0], saturation_bounds[1], 100)
-    X, Y = np.meshgrid(grid_x, grid_y)
-    Z_model = np.vectorize(
-        lambda x, y: ground_truth_probability(
-            x, y, (triangle_size_bounds, saturation_bounds)
-        )
-    )(X, Y)
-
-    # Initialize best results
-    best_knn = {"error": float("inf"), "params": None, "result": None}
-    best_soft = {"error": float("inf"), "params": None, "result": None}
-
-    print("Running random hyperparameter search...")
-    for _ in tqdm(range(n_random_trials)):
-        # Random KNN
-        k = random.randint(knn_k_range[0], knn_k_range[1])
-        X_knn, Y_knn, Z_knn, _ = compute_knn_smooth(
-            combinations, triangle_size_bounds, saturation_bounds, k=k
-        )
-        error_knn = compute_error(Z_knn, Z_model)
-
-        if error_knn < best_knn["error"]:
-            best_knn = {
-                "error": error_knn,
-                "params": {"k": k},
-                "result": (X_knn, Y_knn, Z_knn),
-            }
-
-        # Random Soft Brush
-        inner_r = random.uniform(soft_brush_inner_range[0], soft_brush_inner_range[1])
-        outer_r = random.uniform(
-            max(inner_r + 10, soft_brush_outer_range[0]), soft_brush_outer_range[1]
-        )
-        params = {"inner_radius": inner_r, "outer_radius": outer_r}
-
-        X_soft, Y_soft, Z_soft = compute_soft_brush_smooth(
-            combinations, triangle_size_bounds, saturation_bounds, params
-        )
-        error_soft = compute_error(Z_soft, Z_model)
-
-        if error_soft < best_soft["error"]:
-            best_soft = {
-                "error": error_soft,
-                "params": params,
-                "result": (X_soft, Y_soft, Z_soft),
-            }
-
-    return best_knn, best_soft
+    # Trials run in parallel and are persisted, so an interrupted search resumes
+    return run_search(
+        combinations,
+        triangle_size_bounds,
+        saturation_bounds,
+        n_trials=n_random_trials,
+        knn_k_range=knn_k_range,
+        soft_brush_inner_range=soft_brush_inner_range,
+        soft_brush_outer_range=soft_brush_outer_range,
+        results_path=search_results_path,
+        workers=search_workers,
+    )
 
 
 def plot_best_results(combinations, best_knn, best_soft):
@@ -211,6 +185,39 @@ def run_hyperparameter_test_computational():
     )
 
 
+def run_parameter_optimization():
+    best, history = successive_halving_search(
+        triangle_size_bounds,
+        saturation_bounds,
+        n_configurations=halving_configurations,
+        min_iterations=halving_min_iterations,
+        max_iterations=halving_max_iterations,
+        eta=halving_eta,
+        results_path=halving_results_path,
+        workers=search_workers,
+    )
+    simulated = sum(r["iterations"] for r in history)
+    exhaustive = halving_configurations * halving_max_iterations
+    print("\nBest configuration found:")
+    for name, value in best["params"].items():
+        print(f"{name}: {value}")
+    print(f"Error: {best['error']:.4f}")
+    print(
+        f"Simulated {simulated} iterations "
+        f"({simulated / exhaustive:.0%} of evaluating every configuration in full)"
+    )
+
+    # Show the winner next to the hand-picked combinations
+    return {
+        "name": "Successive halving",
+        "success_rate": best["params"]["success_rate_threshold"],
+        "total_samples": best["params"]["total_samples_threshold"],
+        "inner_radius": best["params"]["inner_radius"],
+        "outer_radius": best["params"]["outer_radius"],
+        "iterations": best["iterations"],
+    }
+
+
 def calculate_grid_layout(n_plots):
     """Calculate optimal grid layout with maximum 3 columns."""
     cols = min(3, n_plots)
@@ -363,3 +370,4 @@ def main():
 if __name__ == "__main__":
     main()
     # run_hyperparameter_test_visual()
+    # test_specific_parameters([run_parameter_optimization()])
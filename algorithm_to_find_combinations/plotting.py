@@ -1,12 +1,105 @@
+import functools
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.spatial import cKDTree
 from .ground_truth import ground_truth_probability, get_scaled_radii
+from .rectangle_aggregate import paint_rectangles, posterior_means
 import matplotlib.patches as patches  # Ensure this import is present
 
 # Define uniform levels
 uniform_levels = np.linspace(0.3, 1.0, 200)
+# Grid points per side of the smoothed surfaces
+GRID_RESOLUTION = 100
+# Share of blur weight a rectangle-aggregate grid point needs from painted points
+MIN_AGGREGATE_COVERAGE = 0.1
+
+_allocation_stats = {}
+_allocation_stats_lock = threading.Lock()
+# Measurements of the process-wide tracemalloc peak in progress
+_peak_measurements = 0
+
+
+@contextmanager
+def peak_measurement():
+    """Mark a block whose tracemalloc peak is being measured.
+
+    ``tracemalloc.reset_peak`` is process wide, so while any such block runs
+    ``track_allocations`` leaves the peak alone rather than wipe the block's.
+    """
+    global _peak_measurements
+    with _allocation_stats_lock:
+        _peak_measurements += 1
+    try:
+        yield
+    finally:
+        with _allocation_stats_lock:
+            _peak_measurements -= 1
+
+
+def track_allocations(func):
+    """Record the peak memory each call allocates while tracemalloc is tracing.
+
+    The peak is process wide, so calls overlapping with other allocating work
+    (such as concurrent requests) report an upper bound. Inside a
+    ``peak_measurement`` the peak is not reset, and the bound then includes
+    the block's peak before the call.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not tracemalloc.is_tracing():
+            return func(*args, **kwargs)
+        start, _ = tracemalloc.get_traced_memory()
+        with _allocation_stats_lock:
+            measured = _peak_measurements > 0
+        if not measured:
+            tracemalloc.reset_peak()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            with _allocation_stats_lock:
+                stats = _allocation_stats.setdefault(
+                    func.__name__,
+                    {"calls": 0, "last_peak_bytes": 0, "max_peak_bytes": 0},
+                )
+                stats["calls"] += 1
+                stats["last_peak_bytes"] = max(peak - start, 0)
+                stats["max_peak_bytes"] = max(
+                    stats["max_peak_bytes"], stats["last_peak_bytes"]
+                )
+
+    return wrapper
+
+
+def allocation_stats():
+    """Peak allocations of the tracked functions, by function name"""
+    with _allocation_stats_lock:
+        return {name: dict(stats) for name, stats in _allocation_stats.items()}
+
+
+def sample_arrays(samples):
+    """``(points, success)`` float arrays of the samples to smooth.
+
+    ``samples`` is either such a pair already, as
+    ``crud.combinations.combination_arrays`` loads it, or a DataFrame or list
+    of combination dicts with ``triangle_size``, ``saturation`` and ``success``
+    (or ``success_float``).
+    """
+    if isinstance(samples, tuple):
+        return samples
+    if not isinstance(samples, pd.DataFrame):
+        samples = pd.DataFrame(samples)
+    points = samples[["triangle_size", "saturation"]].to_numpy(dtype=np.float64)
+    success = samples[
+        "success_float" if "success_float" in samples else "success"
+    ].to_numpy(dtype=np.float64)
+    return points, success
 
 
 def scaled_values(triangle_size, saturation, bounds):
@@ -84,44 +177,67 @@ def plot_theoretical(ax, X, Y, Z_model):
     return contour_model
 
 
-def compute_knn_smooth(df, triangle_size_bounds, saturation_bounds, k=None):
-    values = df["success_float"].values
-
-    # Normalize coordinates for KDTree
-    df["triangle_size_norm"] = (df["triangle_size"] - df["triangle_size"].min()) / (
-        df["triangle_size"].max() - df["triangle_size"].min()
-    )
-    df["saturation_norm"] = (df["saturation"] - df["saturation"].min()) / (
-        df["saturation"].max() - df["saturation"].min()
-    )
+def knn_neighbours(
+    samples, triangle_size_bounds, saturation_bounds, k, resolution=GRID_RESOLUTION
+):
+    """Query the k nearest samples of every grid point, nearest first.
 
-    normalized_points = df[["triangle_size_norm", "saturation_norm"]].values
-    tree = cKDTree(normalized_points)
+    Coordinates are normalized to the range of the sampled data. Returns the
+    grid ``X, Y`` and ``(grid points, k)`` arrays of distances and sample indices.
+    """
+    points, _ = sample_arrays(samples)
 
-    # Determine k if not provided
-    n_samples = len(df)
-    if k is None:
-        k = max(5, int(0.1 * n_samples))
-        k = min(k, n_samples)
+    # Normalize coordinates for KDTree
+    data_min = points.min(axis=0)
+    data_range = points.max(axis=0) - data_min
+    tree = cKDTree((points - data_min) / data_range)
 
     # Create grid
-    grid_x = np.linspace(triangle_size_bounds[0], triangle_size_bounds[1], 100)
-    grid_y = np.linspace(saturation_bounds[0], saturation_bounds[1], 100)
+    grid_x = np.linspace(triangle_size_bounds[0], triangle_size_bounds[1], resolution)
+    grid_y = np.linspace(saturation_bounds[0], saturation_bounds[1], resolution)
     X, Y = np.meshgrid(grid_x, grid_y)
 
     # Normalize grid points and compute k-NN
-    X_norm = (X - df["triangle_size"].min()) / (
-        df["triangle_size"].max() - df["triangle_size"].min()
-    )
-    Y_norm = (Y - df["saturation"].min()) / (
-        df["saturation"].max() - df["saturation"].min()
-    )
-    grid_points_norm = np.column_stack([X_norm.ravel(), Y_norm.ravel()])
+    grid_points_norm = (np.column_stack([X.ravel(), Y.ravel()]) - data_min) / data_range
 
     dists, idxs = tree.query(grid_points_norm, k=k)
     if k == 1:
         dists = dists[:, np.newaxis]
         idxs = idxs[:, np.newaxis]
+    return X, Y, dists, idxs
+
+
+def knn_cumulative_weights(dists, neighbour_values):
+    """Running inverse-distance weight sums along the sorted neighbour axis.
+
+    Column ``k - 1`` of the two returned arrays holds the total weight and the
+    weighted success of the k nearest neighbours, so the k-NN estimate for any
+    k up to the queried one is a single division.
+    """
+    weights = 1 / (dists + 1e-6)
+    return np.cumsum(weights, axis=1), np.cumsum(weights * neighbour_values, axis=1)
+
+
+@track_allocations
+def compute_knn_smooth(
+    samples,
+    triangle_size_bounds,
+    saturation_bounds,
+    k=None,
+    resolution=GRID_RESOLUTION,
+):
+    samples = sample_arrays(samples)
+    values = samples[1]
+
+    # Determine k if not provided
+    n_samples = len(values)
+    if k is None:
+        k = max(5, int(0.1 * n_samples))
+        k = min(k, n_samples)
+
+    X, Y, dists, idxs = knn_neighbours(
+        samples, triangle_size_bounds, saturation_bounds, k, resolution
+    )
 
     weights = 1 / (dists + 1e-6)
     weights /= weights.sum(axis=1, keepdims=True)
@@ -131,22 +247,35 @@ def compute_knn_smooth(df, triangle_size_bounds, saturation_bounds, k=None):
     return X, Y, Z_knn, k
 
 
-def compute_soft_brush_smooth(df, triangle_size_bounds, saturation_bounds, params):
-    values = df["success_float"].values
-    points = df[["triangle_size", "saturation"]].values
+@track_allocations
+def compute_knn_smooth_multi(
+    samples, triangle_size_bounds, saturation_bounds, ks, resolution=GRID_RESOLUTION
+):
+    """k-NN surfaces for several k from a single tree query with max(ks).
 
-    inner_radius, outer_radius = get_scaled_radii(
-        (triangle_size_bounds, saturation_bounds)
+    Returns ``X, Y`` and a dict mapping each k (capped at the number of
+    samples) to its smoothed surface.
+    """
+    samples = sample_arrays(samples)
+    values = samples[1]
+    ks = sorted({min(k, len(values)) for k in ks})
+
+    X, Y, dists, idxs = knn_neighbours(
+        samples, triangle_size_bounds, saturation_bounds, ks[-1], resolution
     )
+    cum_weights, cum_weighted_values = knn_cumulative_weights(dists, values[idxs])
 
-    # Use the scaled radii instead of fixed values
-    inner_radius = params.get("inner_radius", inner_radius)
-    outer_radius = params.get("outer_radius", outer_radius)
+    surfaces = {
+        k: (cum_weighted_values[:, k - 1] / cum_weights[:, k - 1]).reshape(X.shape)
+        for k in ks
+    }
+    return X, Y, surfaces
 
-    # Normalize both the data points and grid points to [0,1] range for each dimension
+
+def normalized_points(points, triangle_size_bounds, saturation_bounds):
+    """Points scaled so the test bounds become the unit square"""
     triangle_min, triangle_max = triangle_size_bounds
     saturation_min, saturation_max = saturation_bounds
-
     points_normalized = np.empty_like(points, dtype=np.float64)
     points_normalized[:, 0] = (points[:, 0] - triangle_min) / (
         triangle_max - triangle_min
@@ -154,33 +283,42 @@ def compute_soft_brush_smooth(df, triangle_size_bounds, saturation_bounds, param
     points_normalized[:, 1] = (points[:, 1] - saturation_min) / (
         saturation_max - saturation_min
     )
+    return points_normalized
 
-    # Create grid in original space
-    grid_x = np.linspace(triangle_min, triangle_max, 100)
-    grid_y = np.linspace(saturation_min, saturation_max, 100)
-    X, Y = np.meshgrid(grid_x, grid_y)
-    grid_points = np.column_stack([X.ravel(), Y.ravel()])
 
-    # Normalize grid points
-    grid_points_normalized = np.empty_like(grid_points, dtype=np.float64)
-    grid_points_normalized[:, 0] = (grid_points[:, 0] - triangle_min) / (
-        triangle_max - triangle_min
-    )
-    grid_points_normalized[:, 1] = (grid_points[:, 1] - saturation_min) / (
-        saturation_max - saturation_min
+def soft_brush_radii(triangle_size_bounds, saturation_bounds, params):
+    """Inner and outer brush radii in normalized coordinates"""
+    inner_radius, outer_radius = get_scaled_radii(
+        (triangle_size_bounds, saturation_bounds)
     )
 
+    # Use the scaled radii instead of fixed values
+    inner_radius = params.get("inner_radius", inner_radius)
+    outer_radius = params.get("outer_radius", outer_radius)
+
     # Normalize radii based on the maximum range to maintain aspect ratio
+    triangle_min, triangle_max = triangle_size_bounds
+    saturation_min, saturation_max = saturation_bounds
     max_range = max(triangle_max - triangle_min, saturation_max - saturation_min)
-    inner_radius_norm = inner_radius / max_range
-    outer_radius_norm = outer_radius / max_range
+    return inner_radius / max_range, outer_radius / max_range
 
+
+def soft_brush_at(
+    grid_points_normalized,
+    points_normalized,
+    values,
+    inner_radius_norm,
+    outer_radius_norm,
+):
+    """Soft brush estimate at each grid point, NaN where no sample reaches"""
     # Compute squared radii for efficiency
     inner_radius_sq = inner_radius_norm**2
     outer_radius_sq = outer_radius_norm**2
 
     # Initialize Z with NaNs
     Z = np.full(grid_points_normalized.shape[0], np.nan)
+    if not len(points_normalized):
+        return Z
 
     # Vectorized distance calculation
     from sklearn.metrics import pairwise_distances
@@ -205,11 +343,86 @@ def compute_soft_brush_smooth(df, triangle_size_bounds, saturation_bounds, param
     total_weights = np.sum(weights, axis=1)
     valid = total_weights > 0
     Z[valid] = np.sum(weights[valid] * values, axis=1) / total_weights[valid]
+    return Z
+
+
+@track_allocations
+def compute_soft_brush_smooth(
+    samples,
+    triangle_size_bounds,
+    saturation_bounds,
+    params,
+    resolution=GRID_RESOLUTION,
+):
+    points, values = sample_arrays(samples)
 
+    # Normalize both the data points and grid points to [0,1] range for each dimension
+    points_normalized = normalized_points(
+        points, triangle_size_bounds, saturation_bounds
+    )
+
+    # Create grid in original space
+    grid_x = np.linspace(*triangle_size_bounds, resolution)
+    grid_y = np.linspace(*saturation_bounds, resolution)
+    X, Y = np.meshgrid(grid_x, grid_y)
+    grid_points_normalized = normalized_points(
+        np.column_stack([X.ravel(), Y.ravel()]),
+        triangle_size_bounds,
+        saturation_bounds,
+    )
+
+    Z = soft_brush_at(
+        grid_points_normalized,
+        points_normalized,
+        values,
+        *soft_brush_radii(triangle_size_bounds, saturation_bounds, params),
+    )
     Z = Z.reshape(X.shape)
     return X, Y, Z
 
 
+@track_allocations
+def compute_rectangle_aggregate_smooth(
+    rectangles,
+    triangle_size_bounds,
+    saturation_bounds,
+    params=None,
+    resolution=GRID_RESOLUTION,
+):
+    """Surface of the rectangles' pooled Beta posterior means.
+
+    ``rectangles`` need ``depth``, ``morton``, ``true_samples`` and
+    ``false_samples``. The means are painted over the grid and blurred with a
+    Gaussian of ``params["sigma"]`` (in units of the test bounds) weighted by
+    the painted points, so steps between rectangles are smoothed and holes
+    narrower than the blur are filled. Grid points left with less than
+    ``MIN_AGGREGATE_COVERAGE`` of valid weight are NaN, as for the soft brush.
+    """
+    from scipy.ndimage import gaussian_filter
+
+    params = params or {}
+    grid_x = np.linspace(*triangle_size_bounds, resolution)
+    grid_y = np.linspace(*saturation_bounds, resolution)
+    X, Y = np.meshgrid(grid_x, grid_y)
+    Z = paint_rectangles(
+        rectangles,
+        posterior_means(rectangles, params),
+        grid_x,
+        grid_y,
+        triangle_size_bounds,
+        saturation_bounds,
+    )
+
+    sigma = params.get("sigma", 0.02) * (resolution - 1)
+    if sigma > 0:
+        valid = ~np.isnan(Z)
+        filled = gaussian_filter(np.where(valid, Z, 0.0), sigma, mode="nearest")
+        weight = gaussian_filter(valid.astype(np.float64), sigma, mode="nearest")
+        with np.errstate(invalid="ignore", divide="ignore"):
+            Z = np.where(weight >= MIN_AGGREGATE_COVERAGE, filled / weight, np.nan)
+    return X, Y, Z
+
+
 def create_single_smooth_plot(
     combinations,
     triangle_size_bounds,
@@ -219,82 +432,102 @@ def create_single_smooth_plot(
     ax=None,
     rectangles=None,  # Add rectangles parameter
     threshold=0.75,
+    show_rectangles=True,
 ):
-    df = pd.DataFrame(combinations)
-    df["success_float"] = df["success"].astype(float)
-
-    if smoothing_params is None:
-        # Get default normalized parameters if none provided
-        inner_radius, outer_radius = get_scaled_radii(
-            (triangle_size_bounds, saturation_bounds)
-        )
-        smoothing_params = {"inner_radius": inner_radius, "outer_radius": outer_radius}
+    """Draw the smoothed surface of ``combinations`` on ``ax``.
+
+    ``combinations`` is anything ``sample_arrays`` accepts; pass the arrays of
+    ``crud.combinations.combination_arrays`` to skip building a DataFrame.
+    The ``rectangle_aggregate`` method estimates the surface from the counts on
+    ``rectangles`` instead, without looking at the combinations, which are then
+    only drawn (and may be None). ``show_rectangles`` outlines the rectangles.
+    """
+    if combinations is None:
+        points, success = np.empty((0, 2)), np.empty(0)
+    else:
+        points, success = sample_arrays(combinations)
 
     if smoothing_method == "soft_brush":
+        if smoothing_params is None:
+            # Get default normalized parameters if none provided
+            inner_radius, outer_radius = get_scaled_radii(
+                (triangle_size_bounds, saturation_bounds)
+            )
+            smoothing_params = {
+                "inner_radius": inner_radius,
+                "outer_radius": outer_radius,
+            }
         X_smooth, Y_smooth, Z_smooth = compute_soft_brush_smooth(
-            df, triangle_size_bounds, saturation_bounds, smoothing_params
+            (points, success), triangle_size_bounds, saturation_bounds, smoothing_params
         )
-        contour_smooth = ax.contourf(
-            X_smooth,
-            Y_smooth,
-            Z_smooth,
-            levels=uniform_levels,
-            cmap="RdYlGn",
-            alpha=0.9,
-            vmin=0.6,
-            vmax=1.0,
+    elif smoothing_method == "rectangle_aggregate":
+        if rectangles is None:
+            raise ValueError("rectangle_aggregate smoothing needs the rectangles")
+        X_smooth, Y_smooth, Z_smooth = compute_rectangle_aggregate_smooth(
+            rectangles, triangle_size_bounds, saturation_bounds, smoothing_params
         )
-        ax.contour(
-            X_smooth,
-            Y_smooth,
-            Z_smooth,
-            levels=[threshold],
-            colors="black",
-            linewidths=2,
-        )
-
-        # Add rectangle visualization if provided
-        if rectangles is not None:
-            for rect in rectangles:
-                bounds = rect["bounds"]
-                x_min, x_max = bounds["triangle_size"]
-                y_min, y_max = bounds["saturation"]
-                rect_patch = patches.Rectangle(
-                    (x_min, y_min),
-                    x_max - x_min,
-                    y_max - y_min,
-                    linewidth=1,
-                    edgecolor="blue",
-                    facecolor="none",
-                    linestyle="--",
-                    alpha=0.5,
-                )
-                ax.add_patch(rect_patch)
-
-        # Filter points within the bounds
-        within_bounds = (
-            (df["triangle_size"] >= triangle_size_bounds[0])
-            & (df["triangle_size"] <= triangle_size_bounds[1])
-            & (df["saturation"] >= saturation_bounds[0])
-            & (df["saturation"] <= saturation_bounds[1])
-        )
-        df_within_bounds = df[within_bounds]
-
-        ax.scatter(
-            df_within_bounds["triangle_size"],
-            df_within_bounds["saturation"],
-            c=df_within_bounds["success_float"],
-            cmap="RdYlGn",
-            vmin=0.6,
-            vmax=1.0,  # Fixed color map limits
-            edgecolor="k",
-            alpha=0.5,
-        )
-        ax.set_xlabel("Triangle Size")
-        ax.set_ylabel("Saturation")
-        plt.colorbar(contour_smooth, ax=ax, label="Success Rate")
     else:
         raise ValueError(f"Unknown smoothing method: {smoothing_method}")
+
+    contour_smooth = ax.contourf(
+        X_smooth,
+        Y_smooth,
+        Z_smooth,
+        levels=uniform_levels,
+        cmap="RdYlGn",
+        alpha=0.9,
+        vmin=0.6,
+        vmax=1.0,
+    )
+    ax.contour(
+        X_smooth,
+        Y_smooth,
+        Z_smooth,
+        levels=[threshold],
+        colors="black",
+        linewidths=2,
+    )
+
+    # Add rectangle visualization if provided
+    if rectangles is not None and show_rectangles:
+        for rect in rectangles:
+            bounds = rect["bounds"]
+            x_min, x_max = bounds["triangle_size"]
+            y_min, y_max = bounds["saturation"]
+            rect_patch = patches.Rectangle(
+                (x_min, y_min),
+                x_max - x_min,
+                y_max - y_min,
+                linewidth=1,
+                edgecolor="blue",
+                facecolor="none",
+                linestyle="--",
+                alpha=0.5,
+            )
+            ax.add_patch(rect_patch)
+
+    # Filter points within the bounds
+    triangle_size, saturation = points[:, 0], points[:, 1]
+    within_bounds = (
+        (triangle_size >= triangle_size_bounds[0])
+        & (triangle_size <= triangle_size_bounds[1])
+        & (saturation >= saturation_bounds[0])
+        & (saturation <= saturation_bounds[1])
+    )
+
+    ax.scatter(
+        triangle_size[within_bounds],
+        saturation[within_bounds],
+        c=success[within_bounds],
+        cmap="RdYlGn",
+        vmin=0.6,
+        vmax=1.0,  # Fixed color map limits
+        edgecolor="k",
+        alpha=0.5,
+    )
+    ax.set_xlabel("Triangle Size")
+    ax.set_ylabel("Saturation")
+    plt.colorbar(contour_smooth, ax=ax, label="Success Rate")
     return X_smooth, Y_smooth, Z_smooth
 
 
@@ -317,6 +550,7 @@ def create_plots(
     ax_model=None,
     ground_truth_func=ground_truth_probability,
     model_name="",
+    resolution=GRID_RESOLUTION,
 ):
     df = pd.DataFrame(combinations)
     df["success_float"] = df["success"].astype(float)
@@ -329,8 +563,8 @@ def create_plots(
         smoothing_params = {"inner_radius": inner_radius, "outer_radius": outer_radius}
 
     # Create grid for theoretical model
-    grid_x = np.linspace(triangle_size_bounds[0], triangle_size_bounds[1], 100)
-    grid_y = np.linspace(saturation_bounds[0], saturation_bounds[1], 100)
+    grid_x = np.linspace(triangle_size_bounds[0], triangle_size_bounds[1], resolution)
+    grid_y = np.linspace(saturation_bounds[0], saturation_bounds[1], resolution)
     X, Y = np.meshgrid(grid_x, grid_y)
 
     # Compute theoretical model using the provided function
@@ -341,12 +575,16 @@ def create_plots(
     # Compute smoothing
     if smoothing_method == "knn":
         X_smooth, Y_smooth, Z_smooth, k = compute_knn_smooth(
-            df, triangle_size_bounds, saturation_bounds, k=smoothing_params.get("k")
+            df,
+            triangle_size_bounds,
+            saturation_bounds,
+            k=smoothing_params.get("k"),
+            resolution=resolution,
         )
         smooth_title = f"k-NN Smoothed (k={k})"
     elif smoothing_method == "soft_brush":
         X_smooth, Y_smooth, Z_smooth = compute_soft_brush_smooth(
-            df, triangle_size_bounds, saturation_bounds, smoothing_params
+            df, triangle_size_bounds, saturation_bounds, smoothing_params, resolution
         )
         smooth_title = "Soft Brush Smoothing"
     else:
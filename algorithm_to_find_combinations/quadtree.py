@@ -0,0 +1,124 @@
+"""Cell arithmetic for the adaptive grid.
+
+``split_rectangle`` always cuts a rectangle into its four quadrants, so every
+rectangle is a cell of a quadtree over the test bounds, identified by its
+depth and the Morton (Z-order) code of its position at that depth. Bit 2k of
+the code is bit k of the column along triangle size, bit 2k+1 bit k of the row
+along saturation. A child's code is its parent's shifted left by two with the
+quadrant in the low bits, so parents, children and the cell containing a point
+are all bit operations, and bounds are derived from the test bounds on demand.
+
+The functions work on Python ints and on numpy uint64 arrays alike.
+"""
+
+# Codes of deeper cells would not fit in a signed 64-bit database column
+MAX_DEPTH = 31
+
+
+def _spread_bits(v):
+    """Move bit k of a 32-bit value to bit 2k"""
+    v = v & 0xFFFFFFFF
+    v = (v | (v << 16)) & 0x0000FFFF0000FFFF
+    v = (v | (v << 8)) & 0x00FF00FF00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v << 2)) & 0x3333333333333333
+    v = (v | (v << 1)) & 0x5555555555555555
+    return v
+
+
+def _compact_bits(v):
+    """Inverse of _spread_bits: move bit 2k to bit k, dropping odd bits"""
+    v = v & 0x5555555555555555
+    v = (v | (v >> 1)) & 0x3333333333333333
+    v = (v | (v >> 2)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v >> 4)) & 0x00FF00FF00FF00FF
+    v = (v | (v >> 8)) & 0x0000FFFF0000FFFF
+    v = (v | (v >> 16)) & 0x00000000FFFFFFFF
+    return v
+
+
+def interleave(column, row):
+    return _spread_bits(column) | (_spread_bits(row) << 1)
+
+
+def deinterleave(morton):
+    """(column, row) of a cell from its Morton code"""
+    return _compact_bits(morton), _compact_bits(morton >> 1)
+
+
+def child_code(morton, i, j):
+    """Code of the child in column half ``i`` and row half ``j`` (0 or 1)"""
+    return (morton << 2) | (j << 1) | i
+
+
+def parent(depth, morton):
+    return depth - 1, morton >> 2
+
+
+def cell_area(depth):
+    """Area of a cell as a fraction of the test bounds"""
+    return 0.25**depth
+
+
+def _edges(index, lo, hi, depth):
+    scale = (hi - lo) / (1 << depth)
+    return lo + index * scale, lo + (index + 1) * scale
+
+
+def cell_bounds(depth, morton, triangle_size_bounds, saturation_bounds):
+    column, row = deinterleave(morton)
+    return {
+        "triangle_size": _edges(column, *triangle_size_bounds, depth),
+        "saturation": _edges(row, *saturation_bounds, depth),
+    }
+
+
+def _index(value, lo, hi, depth):
+    n = 1 << depth
+    # The upper bound belongs to the last cell
+    return min(int((value - lo) / (hi - lo) * n), n - 1)
+
+
+def point_code(
+    triangle_size, saturation, depth, triangle_size_bounds, saturation_bounds
+):
+    """Code of the cell at ``depth`` containing the point, or None if outside"""
+    if not (
+        triangle_size_bounds[0] <= triangle_size <= triangle_size_bounds[1]
+        and saturation_bounds[0] <= saturation <= saturation_bounds[1]
+    ):
+        return None
+    return interleave(
+        _index(triangle_size, *triangle_size_bounds, depth),
+        _index(saturation, *saturation_bounds, depth),
+    )
+
+
+def locate(
+    cells,
+    triangle_size,
+    saturation,
+    triangle_size_bounds,
+    saturation_bounds,
+    max_depth=None,
+):
+    """Value of the cell of ``cells`` containing the point, or None.
+
+    ``cells`` maps (depth, morton) to anything, such as a rectangle or its
+    row id, and must not contain overlapping cells. Pass the deepest depth in
+    ``cells`` as ``max_depth`` when locating many points.
+    """
+    if max_depth is None:
+        max_depth = max((depth for depth, _ in cells), default=None)
+        if max_depth is None:
+            return None
+    deepest = point_code(
+        triangle_size, saturation, max_depth, triangle_size_bounds, saturation_bounds
+    )
+    if deepest is None:
+        return None
+    for depth in range(max_depth, -1, -1):
+        found = cells.get((depth, deepest >> (2 * (max_depth - depth))))
+        if found is not None:
+            return found
+    return None
@@ -0,0 +1,279 @@
+"""Raster rendering of smoothed success surfaces.
+
+``create_single_smooth_plot`` fills 200 contour levels and draws every sample
+as a vector marker before a 300 dpi save. Here the Z grid is resampled to the
+image size and mapped through a precomputed RdYlGn lookup table straight into
+an RGBA array, which Pillow encodes. Rectangles, samples and the threshold line
+are only drawn when asked for, as pixels. ``FigureTemplate`` frames such a
+raster with axes and a colorbar in a matplotlib figure built once and reused,
+so a framed render is one Agg draw of a single image.
+"""
+
+import io
+import threading
+
+import contourpy
+import matplotlib
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.cm import ScalarMappable
+from matplotlib.colors import Normalize
+from matplotlib.figure import Figure
+from PIL import Image, ImageDraw
+
+from observability.memory import ByteBudgetCache
+
+from .plotting import uniform_levels
+
+# Colour limits and lowest filled level of the contourf plot
+VMIN, VMAX = 0.6, 1.0
+LOWEST_LEVEL = uniform_levels[0]
+RASTER_SIZE = (600, 480)  # width, height in pixels
+FORMATS = {"png": "image/png", "webp": "image/webp"}
+# Cached figure frames, about 2 MB of RGBA each at the default size
+FRAME_CACHE_BYTES = 32 * 1024 * 1024
+
+
+# Rows of the lookup table: 255 colours from VMIN to VMAX, then transparent
+COLORS = 255
+TRANSPARENT = COLORS
+
+
+def _build_lut(alpha=0.9):
+    """RdYlGn as RGBA rows, blended onto white like the contourf fill"""
+    colors = matplotlib.colormaps["RdYlGn"](np.linspace(0, 1, COLORS))[:, :3]
+    lut = np.zeros((COLORS + 1, 4), dtype=np.uint8)
+    lut[:COLORS, :3] = np.round((alpha * colors + (1 - alpha)) * 255)
+    lut[:COLORS, 3] = 255
+    return lut
+
+
+LUT = _build_lut()
+# The same table with each row as one 32-bit word, to look up whole pixels
+LUT_WORDS = LUT.view(np.uint32)[:, 0]
+
+
+def color_index(values):
+    """Row of the lookup table for each value, clipped to [VMIN, VMAX]"""
+    index = (np.asarray(values, dtype=np.float32) - VMIN) * (
+        (COLORS - 1) / (VMAX - VMIN)
+    )
+    return np.rint(np.clip(index, 0, COLORS - 1)).astype(np.uint8)
+
+
+def _resample(Z, size):
+    """Bilinear resize of Z to ``size``, flipped so saturation grows upwards.
+
+    NaNs (grid points no sample reached) stay NaN; their neighbours are
+    interpolated from the valid points only.
+    """
+    valid = ~np.isnan(Z)
+    filled = Image.fromarray(np.where(valid, Z, 0).astype(np.float32))
+    weight = Image.fromarray(valid.astype(np.float32))
+    filled = np.asarray(filled.resize(size, Image.BILINEAR))
+    weight = np.asarray(weight.resize(size, Image.BILINEAR))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        resampled = np.where(weight >= 0.5, filled / weight, np.nan)
+    return resampled[::-1]
+
+
+def surface_rgba(Z, size=RASTER_SIZE):
+    """RGBA array of the surface; unreached and sub-0.3 points are transparent"""
+    Z = _resample(np.asarray(Z, dtype=np.float32), size)
+    index = color_index(np.nan_to_num(Z, nan=VMIN))
+    index[~(Z >= LOWEST_LEVEL)] = TRANSPARENT
+    return LUT_WORDS[index].view(np.uint8).reshape(*index.shape, 4)
+
+
+def threshold_lines(X, Y, Z, level):
+    """Polylines of the ``level`` contour in data coordinates"""
+    generator = contourpy.contour_generator(
+        X, Y, np.ma.masked_invalid(Z), line_type="Separate"
+    )
+    return generator.lines(level)
+
+
+class _PixelMap:
+    def __init__(self, triangle_size_bounds, saturation_bounds, size):
+        (self.x0, x1), (self.y0, y1) = triangle_size_bounds, saturation_bounds
+        self.sx = size[0] / (x1 - self.x0)
+        self.sy = size[1] / (y1 - self.y0)
+        self.height = size[1]
+
+    def __call__(self, triangle_size, saturation):
+        return (
+            (np.asarray(triangle_size) - self.x0) * self.sx,
+            self.height - (np.asarray(saturation) - self.y0) * self.sy,
+        )
+
+
+def draw_overlays(
+    rgba,
+    triangle_size_bounds,
+    saturation_bounds,
+    rectangles=None,
+    samples=None,
+    lines=None,
+):
+    """Draw rectangle outlines, sample dots and contour lines onto ``rgba``.
+
+    ``samples`` is a ``(points, success)`` pair, ``lines`` polylines as
+    ``threshold_lines`` returns them. Returns a Pillow image.
+    """
+    image = Image.fromarray(rgba)
+    draw = ImageDraw.Draw(image)
+    to_pixels = _PixelMap(triangle_size_bounds, saturation_bounds, image.size)
+    for rect in rectangles or ():
+        xs, ys = to_pixels(
+            rect["bounds"]["triangle_size"], rect["bounds"]["saturation"]
+        )
+        draw.rectangle(
+            (xs[0], ys[1], xs[1], ys[0]), outline=(110, 110, 255, 255), width=1
+        )
+    if samples is not None:
+        points, success = samples
+        xs, ys = to_pixels(points[:, 0], points[:, 1])
+        colors = LUT[color_index(success)]
+        for x, y, color in zip(xs.tolist(), ys.tolist(), colors.tolist()):
+            draw.ellipse(
+                (x - 3, y - 3, x + 3, y + 3), fill=tuple(color), outline="black"
+            )
+    for line in () if lines is None else lines:
+        xs, ys = to_pixels(line[:, 0], line[:, 1])
+        draw.line(list(zip(xs.tolist(), ys.tolist())), fill="black", width=2)
+    return image
+
+
+def encode_image(image, image_format="png"):
+    """Encode quickly rather than small: fast zlib level, fast WebP method"""
+    buf = io.BytesIO()
+    if image_format == "png":
+        image.save(buf, format="PNG", compress_level=1)
+    elif image_format == "webp":
+        image.save(buf, format="WEBP", quality=90, method=0)
+    else:
+        raise ValueError(f"Unknown image format: {image_format}")
+    return buf.getvalue()
+
+
+def _image_bytes(image):
+    return image.width * image.height * len(image.getbands())
+
+
+class FigureTemplate:
+    """Axes, labels and colorbar drawn once per pair of bounds and reused.
+
+    The frame is drawn with a transparent background and kept in a
+    ``ByteBudgetCache``; a render pastes the raster into the axes area and
+    composites the frame on top, so no matplotlib drawing happens once the
+    bounds have been seen.
+    """
+
+    def __init__(
+        self,
+        figsize=(10, 8),
+        dpi=80,
+        name="figure-frames",
+        max_frame_bytes=FRAME_CACHE_BYTES,
+    ):
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        self.figure.patch.set_alpha(0)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+        self.ax.patch.set_alpha(0)
+        self.ax.set_xlabel("Triangle Size")
+        self.ax.set_ylabel("Saturation")
+        self.figure.colorbar(
+            ScalarMappable(norm=Normalize(VMIN, VMAX), cmap="RdYlGn"),
+            ax=self.ax,
+            label="Success Rate",
+        )
+        self.figure.tight_layout()
+        bbox = self.ax.get_window_extent()
+        height = self.canvas.get_width_height()[1]
+        # Pixel box of the axes area, top-left origin
+        self.box = (
+            int(round(bbox.x0)),
+            int(round(height - bbox.y1)),
+            int(round(bbox.x1)),
+            int(round(height - bbox.y0)),
+        )
+        self._frames = ByteBudgetCache(name, max_frame_bytes, sizeof=_image_bytes)
+        # The figure is shared, so frames are drawn one at a time
+        self._lock = threading.Lock()
+
+    def axes_size(self):
+        """Pixel size of the axes, the raster size that needs no rescaling"""
+        return self.box[2] - self.box[0], self.box[3] - self.box[1]
+
+    def _frame(self, triangle_size_bounds, saturation_bounds):
+        key = (tuple(triangle_size_bounds), tuple(saturation_bounds))
+        frame = self._frames.get(key)
+        if frame is None:
+            with self._lock:
+                # Another request may have drawn it while this one waited
+                frame = self._frames.peek(key)
+                if frame is None:
+                    self.ax.set_xlim(*triangle_size_bounds)
+                    self.ax.set_ylim(*saturation_bounds)
+                    self.canvas.draw()
+                    frame = Image.fromarray(np.array(self.canvas.buffer_rgba()))
+                    self._frames.put(key, frame)
+        return frame
+
+    def render(self, image, triangle_size_bounds, saturation_bounds):
+        """The framed figure as a Pillow image"""
+        frame = self._frame(triangle_size_bounds, saturation_bounds)
+        figure = Image.new("RGBA", frame.size, "white")
+        figure.alpha_composite(image.resize(self.axes_size()), self.box[:2])
+        figure.alpha_composite(frame)
+        # Opaque, and RGB encodes faster
+        return figure.convert("RGB")
+
+
+_template = None
+_template_lock = threading.Lock()
+
+
+def figure_template():
+    global _template
+    if _template is None:
+        with _template_lock:
+            if _template is None:
+                _template = FigureTemplate()
+    return _template
+
+
+def render_surface(
+    X,
+    Y,
+    Z,
+    triangle_size_bounds,
+    saturation_bounds,
+    image_format="png",
+    framed=True,
+    rectangles=None,
+    samples=None,
+    threshold=None,
+    lines=None,
+):
+    """Encoded image of a smoothed surface with the requested overlays.
+
+    ``framed`` adds axes and a colorbar through the shared ``FigureTemplate``;
+    otherwise the image is the bare surface of ``RASTER_SIZE``. The threshold
+    line is drawn when ``threshold`` is given, from the grid, or from ``lines``
+    (such as the segments of ``adaptive_mesh.contour_segments``) if passed.
+    """
+    template = figure_template() if framed else None
+    size = template.axes_size() if framed else RASTER_SIZE
+    rgba = surface_rgba(Z, size)
+    if threshold is None:
+        lines = None
+    elif lines is None:
+        lines = threshold_lines(X, Y, Z, threshold)
+    image = draw_overlays(
+        rgba, triangle_size_bounds, saturation_bounds, rectangles, samples, lines
+    )
+    if framed:
+        image = template.render(image, triangle_size_bounds, saturation_bounds)
+    return encode_image(image, image_format)
@@ -0,0 +1,129 @@
+"""Success estimates from the rectangles' sample counts alone.
+
+``update_state`` keeps ``true_samples`` and ``false_samples`` on every
+rectangle, so the counts already summarize the trials without revisiting them.
+Each rectangle gets a Beta posterior: a weak prior centred on the overall
+success rate, plus its own counts, plus the counts of the rectangles sharing
+an edge with it, scaled by ``neighbour_weight`` and by the share of its side
+they cover. A freshly split rectangle starts with no counts of its own, so the
+pooling is what keeps it from falling back to the prior.
+
+Finding the neighbours costs a dictionary lookup per ancestor of each
+rectangle and the rest is vectorised over rectangles, so the estimates cost
+O(rectangles) whatever the number of trials.
+"""
+
+import numpy as np
+
+from .quadtree import cell_bounds, deinterleave, interleave
+
+# Pseudo-trials of the prior, centred on the overall success rate
+PRIOR_STRENGTH = 2.0
+# Weight of an edge neighbour's counts covering a whole side
+NEIGHBOUR_WEIGHT = 0.5
+_DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+
+def rectangle_counts(rectangles):
+    """``(successes, failures)`` float arrays of the rectangles"""
+    counts = np.array(
+        [(r["true_samples"] or 0, r["false_samples"] or 0) for r in rectangles],
+        dtype=np.float64,
+    ).reshape(-1, 2)
+    return counts[:, 0], counts[:, 1]
+
+
+def neighbour_pairs(rectangles):
+    """Edge neighbours as ``(receivers, givers, shares)`` arrays.
+
+    Every rectangle looks for the rectangle across each of its sides at its
+    own depth or above, so a pair is found from the side of its smaller
+    rectangle. ``shares`` is the fraction of the receiver's side the giver
+    covers: 1 for the smaller rectangle of a pair, ``2**-k`` for the larger
+    one when the other is ``k`` levels deeper.
+    """
+    cells = {(r["depth"], r["morton"]): i for i, r in enumerate(rectangles)}
+    pairs = {}
+    for i, r in enumerate(rectangles):
+        depth = r["depth"]
+        column, row = deinterleave(r["morton"])
+        side = 1 << depth
+        for d_column, d_row in _DIRECTIONS:
+            c, w = column + d_column, row + d_row
+            if not (0 <= c < side and 0 <= w < side):
+                continue
+            code = interleave(c, w)
+            for up in range(depth + 1):
+                j = cells.get((depth - up, code >> (2 * up)))
+                if j is not None:
+                    pairs[i, j] = 1.0
+                    pairs[j, i] = 0.5**up
+                    break
+    if not pairs:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0)
+    receivers, givers = np.array(list(pairs), dtype=np.intp).T
+    return receivers, givers, np.fromiter(pairs.values(), dtype=np.float64)
+
+
+def beta_posteriors(
+    rectangles, prior_strength=PRIOR_STRENGTH, neighbour_weight=NEIGHBOUR_WEIGHT
+):
+    """Beta ``(alpha, beta, evidence)`` of every rectangle.
+
+    ``evidence`` is the number of (pooled) trials behind the posterior, zero
+    where neither the rectangle nor its neighbours have any.
+    """
+    successes, failures = rectangle_counts(rectangles)
+    rate = (successes.sum() + 1) / (successes.sum() + failures.sum() + 2)
+    receivers, givers, shares = neighbour_pairs(rectangles)
+    weights = neighbour_weight * shares
+    n = len(successes)
+    pooled_successes = successes + np.bincount(
+        receivers, weights=weights * successes[givers], minlength=n
+    )
+    pooled_failures = failures + np.bincount(
+        receivers, weights=weights * failures[givers], minlength=n
+    )
+    return (
+        prior_strength * rate + pooled_successes,
+        prior_strength * (1 - rate) + pooled_failures,
+        pooled_successes + pooled_failures,
+    )
+
+
+def posterior_means(rectangles, params=None):
+    """Posterior mean success of every rectangle, NaN where it has no evidence"""
+    params = params or {}
+    alpha, beta, evidence = beta_posteriors(
+        rectangles,
+        params.get("prior_strength", PRIOR_STRENGTH),
+        params.get("neighbour_weight", NEIGHBOUR_WEIGHT),
+    )
+    return np.where(evidence > 0, alpha / (alpha + beta), np.nan)
+
+
+def paint_rectangles(
+    rectangles, values, grid_x, grid_y, triangle_size_bounds, saturation_bounds
+):
+    """Grid of ``values``, one per rectangle, over the points each covers.
+
+    Rows follow ``grid_y`` like the other surfaces. A grid point on a shared
+    edge belongs to the rectangle above it; the upper bounds belong to the last
+    rectangles.
+    """
+    Z = np.full((len(grid_y), len(grid_x)), np.nan)
+    for rect, value in zip(rectangles, values):
+        bounds = cell_bounds(
+            rect["depth"], rect["morton"], triangle_size_bounds, saturation_bounds
+        )
+        (x0, x1), (y0, y1) = bounds["triangle_size"], bounds["saturation"]
+        columns = slice(
+            np.searchsorted(grid_x, x0),
+            len(grid_x) if x1 >= grid_x[-1] else np.searchsorted(grid_x, x1),
+        )
+        rows = slice(
+            np.searchsorted(grid_y, y0),
+            len(grid_y) if y1 >= grid_y[-1] else np.searchsorted(grid_y, y1),
+        )
+        Z[rows, columns] = value
+    return Z
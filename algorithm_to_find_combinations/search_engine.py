@@ -0,0 +1,628 @@
+import hashlib
+import json
+import math
+import os
+import random
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from .algorithm import run_base_algorithm
+from .ground_truth import ground_truth_probability, test_combination
+from .plotting import (
+    compute_error,
+    compute_knn_smooth,
+    compute_soft_brush_smooth,
+    knn_cumulative_weights,
+    knn_neighbours,
+    soft_brush_at,
+)
+
+GRID_SIZE = 100
+TRIALS_PER_TASK = 10
+# Grid-by-sample entries up to which the soft brush distances are sorted up
+# front. The sorted matrices take about 56 bytes per entry, so the cap (about
+# 1700 samples on the 100x100 grid) bounds them near 900 MB; larger datasets
+# evaluate each trial directly, SOFT_BRUSH_CHUNK_ENTRIES distances at a time.
+MAX_SORTED_ENTRIES = 2**24
+SOFT_BRUSH_CHUNK_ENTRIES = 2**22
+
+# Ranges explored by successive_halving_search; integer bounds are sampled as ints
+DEFAULT_PARAMETER_SPACE = {
+    "success_rate_threshold": (0.6, 0.95),
+    "total_samples_threshold": (3, 20),
+    "inner_radius": (5.0, 50.0),
+    "outer_radius": (30.0, 100.0),
+}
+
+# Arrays attached by a worker process (or by the parent for inline runs)
+_worker_arrays = {}
+_worker_blocks = []
+
+
+class SharedArrays:
+    """Numpy arrays copied once into named shared memory blocks.
+
+    Workers attach to the blocks by name and wrap them in ndarrays without
+    copying, so every trial reads the same precomputed dataset.
+    """
+
+    def __init__(self):
+        self.specs = {}
+        self._blocks = []
+
+    def put(self, name, array):
+        array = np.ascontiguousarray(array)
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        self._blocks.append(shm)
+        self.specs[name] = (shm.name, array.shape, array.dtype.str)
+
+    def close(self):
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _attach_shared_arrays(specs):
+    """Pool initializer: map the parent's shared blocks into this process"""
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        # The parent owns the block; keep the tracker from unlinking it on exit
+        resource_tracker.unregister(shm._name, "shared_memory")
+        _worker_blocks.append(shm)
+        _worker_arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def prepare_dataset(
+    df,
+    triangle_size_bounds,
+    saturation_bounds,
+    k_max,
+    ground_truth_func=ground_truth_probability,
+    max_sorted_entries=MAX_SORTED_ENTRIES,
+):
+    """Compute everything a trial needs that does not depend on its parameters.
+
+    Returns a dict of arrays: the flattened theoretical model, the per-row sorted
+    grid-to-sample distances and prefix sums used by the soft brush, and the
+    cumulative inverse-distance sums of the k_max nearest neighbours used by k-NN.
+    When the grid times the samples exceeds ``max_sorted_entries``, only the
+    normalized grid and sample points are kept for the soft brush instead.
+    """
+    points = df[["triangle_size", "saturation"]].to_numpy(dtype=np.float64)
+    values = df["success"].to_numpy(dtype=np.float64)
+    triangle_min, triangle_max = triangle_size_bounds
+    saturation_min, saturation_max = saturation_bounds
+
+    grid_x = np.linspace(triangle_min, triangle_max, GRID_SIZE)
+    grid_y = np.linspace(saturation_min, saturation_max, GRID_SIZE)
+    X, Y = np.meshgrid(grid_x, grid_y)
+
+    Z_model = np.vectorize(
+        lambda x, y: ground_truth_func(x, y, (triangle_size_bounds, saturation_bounds))
+    )(X, Y)
+
+    # Soft brush: distances in bounds-normalized space, as in compute_soft_brush_smooth
+    points_normalized = np.column_stack(
+        [
+            (points[:, 0] - triangle_min) / (triangle_max - triangle_min),
+            (points[:, 1] - saturation_min) / (saturation_max - saturation_min),
+        ]
+    )
+    grid_normalized = np.column_stack(
+        [
+            (X.ravel() - triangle_min) / (triangle_max - triangle_min),
+            (Y.ravel() - saturation_min) / (saturation_max - saturation_min),
+        ]
+    )
+    arrays = _soft_brush_arrays(
+        grid_normalized, points_normalized, values, max_sorted_entries
+    )
+
+    # k-NN: every k of the search reads a prefix of one k_max query
+    k_max = min(k_max, len(points))
+    _, _, knn_dists, knn_idxs = knn_neighbours(
+        df, triangle_size_bounds, saturation_bounds, k_max
+    )
+    knn_cum_weights, knn_cum_weighted_values = knn_cumulative_weights(
+        knn_dists, values[knn_idxs]
+    )
+
+    arrays.update(
+        {
+            "values": values,
+            "z_model": Z_model.ravel(),
+            "knn_cum_weights": knn_cum_weights,
+            "knn_cum_weighted_values": knn_cum_weighted_values,
+            "max_range": np.array(
+                [max(triangle_max - triangle_min, saturation_max - saturation_min)]
+            ),
+        }
+    )
+    return arrays
+
+
+def _soft_brush_arrays(grid_normalized, points_normalized, values, max_entries):
+    if len(grid_normalized) * len(points_normalized) > max_entries:
+        return {"soft_grid": grid_normalized, "soft_points": points_normalized}
+
+    distances = np.sqrt(
+        np.maximum(
+            (grid_normalized**2).sum(axis=1)[:, np.newaxis]
+            - 2 * grid_normalized @ points_normalized.T
+            + (points_normalized**2).sum(axis=1)[np.newaxis, :],
+            0.0,
+        )
+    )
+    # Sorting each grid row by distance turns a trial's weighted sums into two
+    # binary searches per row plus prefix-sum differences. Rows are offset so the
+    # whole matrix is one sorted array that a single searchsorted call can use.
+    order = np.argsort(distances, axis=1)
+    sorted_distances = np.take_along_axis(distances, order, axis=1)
+    sorted_values = values[order]
+    row_offset = np.ceil(sorted_distances.max()) + 1.0
+
+    def prefix_sum(a):
+        return np.concatenate([np.zeros((a.shape[0], 1)), np.cumsum(a, axis=1)], axis=1)
+
+    return {
+        "soft_sorted_distances": (
+            sorted_distances
+            + row_offset * np.arange(sorted_distances.shape[0])[:, np.newaxis]
+        ).ravel(),
+        "soft_row_offset": np.array([row_offset]),
+        "soft_cum_values": prefix_sum(sorted_values),
+        "soft_cum_distances": prefix_sum(sorted_distances),
+        "soft_cum_distance_values": prefix_sum(sorted_distances * sorted_values),
+    }
+
+
+def dataset_fingerprint(df, triangle_size_bounds, saturation_bounds, search_space=None):
+    """Identify a dataset so persisted results are only resumed against the same data.
+
+    ``search_space`` is anything with a stable ``repr`` that determines what
+    the trial indices mean (parameter ranges, trial count, seed, methods), so
+    results of a differently drawn search are not resumed either.
+    """
+    digest = hashlib.sha1()
+    digest.update(
+        df[["triangle_size", "saturation", "success"]].to_numpy(float).tobytes()
+    )
+    digest.update(repr((triangle_size_bounds, saturation_bounds)).encode())
+    if search_space is not None:
+        digest.update(repr(search_space).encode())
+    return digest.hexdigest()
+
+
+def _evaluate_trial(arrays, method, params):
+    if method == "knn":
+        k = min(params["k"], arrays["knn_cum_weights"].shape[1])
+        Z = (
+            arrays["knn_cum_weighted_values"][:, k - 1]
+            / arrays["knn_cum_weights"][:, k - 1]
+        )
+    elif method == "soft_brush" and "soft_grid" in arrays:
+        max_range = arrays["max_range"][0]
+        grid, points = arrays["soft_grid"], arrays["soft_points"]
+        rows = max(1, SOFT_BRUSH_CHUNK_ENTRIES // max(len(points), 1))
+        Z = np.concatenate(
+            [
+                soft_brush_at(
+                    grid[start : start + rows],
+                    points,
+                    arrays["values"],
+                    params["inner_radius"] / max_range,
+                    params["outer_radius"] / max_range,
+                )
+                for start in range(0, len(grid), rows)
+            ]
+        )
+    elif method == "soft_brush":
+        max_range = arrays["max_range"][0]
+        inner = params["inner_radius"] / max_range
+        outer = params["outer_radius"] / max_range
+        cum_values = arrays["soft_cum_values"]
+        cum_distances = arrays["soft_cum_distances"]
+        cum_distance_values = arrays["soft_cum_distance_values"]
+        n_rows, n_cols = cum_values.shape
+        rows = np.arange(n_rows)
+        offsets = rows * arrays["soft_row_offset"][0]
+        sorted_distances = arrays["soft_sorted_distances"]
+        # Number of samples within each radius, per grid row
+        n_samples = n_cols - 1
+        n_inner = (
+            np.searchsorted(sorted_distances, offsets + inner, side="right")
+            - rows * n_samples
+        )
+        n_outer = (
+            np.searchsorted(sorted_distances, offsets + outer, side="right")
+            - rows * n_samples
+        )
+
+        def ring(cum):
+            return cum[rows, n_outer] - cum[rows, n_inner]
+
+        # Weight 1 inside the inner radius, (outer - d) / (outer - inner) in the ring
+        total_weights = n_inner + (
+            outer * (n_outer - n_inner) - ring(cum_distances)
+        ) / (outer - inner)
+        weighted_values = cum_values[rows, n_inner] + (
+            outer * ring(cum_values) - ring(cum_distance_values)
+        ) / (outer - inner)
+        Z = np.full(n_rows, np.nan)
+        valid = total_weights > 0
+        Z[valid] = weighted_values[valid] / total_weights[valid]
+    else:
+        raise ValueError(f"Unknown smoothing method: {method}")
+    return compute_error(Z, arrays["z_model"])
+
+
+def _evaluate_trials(trials):
+    """Worker entry point: evaluate a batch of (trial, method, params) tuples"""
+    return [
+        (trial, method, params, _evaluate_trial(_worker_arrays, method, params))
+        for trial, method, params in trials
+    ]
+
+
+def generate_trials(
+    n_trials, knn_k_range, soft_brush_inner_range, soft_brush_outer_range, seed=0
+):
+    """Draw the parameters of every trial up front so a run can be resumed"""
+    rng = random.Random(seed)
+    trials = []
+    for trial in range(n_trials):
+        k = rng.randint(knn_k_range[0], knn_k_range[1])
+        inner_r = rng.uniform(soft_brush_inner_range[0], soft_brush_inner_range[1])
+        outer_r = rng.uniform(
+            max(inner_r + 10, soft_brush_outer_range[0]), soft_brush_outer_range[1]
+        )
+        trials.append((trial, "knn", {"k": k}))
+        trials.append(
+            (trial, "soft_brush", {"inner_radius": inner_r, "outer_radius": outer_r})
+        )
+    return trials
+
+
+def load_results(results_path, fingerprint):
+    """Read previously persisted trial results for this dataset"""
+    results = []
+    if results_path is None or not os.path.exists(results_path):
+        return results
+    with open(results_path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get("dataset") == fingerprint:
+                results.append(record)
+    return results
+
+
+def best_result(results, method):
+    candidates = [r for r in results if r["method"] == method]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda r: r["error"])
+
+
+def run_search(
+    combinations,
+    triangle_size_bounds,
+    saturation_bounds,
+    n_trials=300,
+    knn_k_range=(5, 200),
+    soft_brush_inner_range=(5, 50),
+    soft_brush_outer_range=(30, 100),
+    results_path=None,
+    workers=None,
+    seed=0,
+    ground_truth_func=ground_truth_probability,
+):
+    """Random search over k-NN and soft brush parameters.
+
+    Trials are spread over a process pool that shares the precomputed dataset
+    through shared memory. Each result is appended to ``results_path`` (JSON
+    lines) as soon as it is known; rerunning with the same path skips the
+    trials that are already recorded.
+
+    Returns ``(best_knn, best_soft)`` dicts with ``error``, ``params`` and the
+    ``result`` surface ``(X, Y, Z)`` of the best parameters.
+    """
+    df = pd.DataFrame(combinations)
+    fingerprint = dataset_fingerprint(
+        df,
+        triangle_size_bounds,
+        saturation_bounds,
+        (
+            ("knn", "soft_brush"),
+            n_trials,
+            tuple(knn_k_range),
+            tuple(soft_brush_inner_range),
+            tuple(soft_brush_outer_range),
+            seed,
+            ground_truth_func.__name__,
+        ),
+    )
+    results = load_results(results_path, fingerprint)
+    done = {(r["trial"], r["method"]) for r in results}
+
+    trials = generate_trials(
+        n_trials, knn_k_range, soft_brush_inner_range, soft_brush_outer_range, seed
+    )
+    pending = [t for t in trials if (t[0], t[1]) not in done]
+
+    if pending:
+        arrays = prepare_dataset(
+            df,
+            triangle_size_bounds,
+            saturation_bounds,
+            knn_k_range[1],
+            ground_truth_func,
+        )
+        batches = [
+            pending[i : i + TRIALS_PER_TASK]
+            for i in range(0, len(pending), TRIALS_PER_TASK)
+        ]
+        out = open(results_path, "a") if results_path else None
+        try:
+            for batch_results in _run_batches(arrays, batches, workers):
+                for trial, method, params, error in batch_results:
+                    record = {
+                        "dataset": fingerprint,
+                        "trial": trial,
+                        "method": method,
+                        "params": params,
+                        "error": error,
+                    }
+                    results.append(record)
+                    if out:
+                        out.write(json.dumps(record) + "\n")
+                if out:
+                    out.flush()
+        finally:
+            if out:
+                out.close()
+
+    best_knn = best_result(results, "knn")
+    best_soft = best_result(results, "soft_brush")
+    return (
+        _with_surface(df, best_knn, triangle_size_bounds, saturation_bounds),
+        _with_surface(df, best_soft, triangle_size_bounds, saturation_bounds),
+    )
+
+
+def _run_batches(arrays, batches, workers):
+    """Yield batch results, in completion order, from a pool or inline"""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        _worker_arrays.update(arrays)
+        try:
+            for batch in tqdm(batches, desc="Search batches"):
+                yield _evaluate_trials(batch)
+        finally:
+            _worker_arrays.clear()
+        return
+
+    with SharedArrays() as shared:
+        for name, array in arrays.items():
+            shared.put(name, array)
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_attach_shared_arrays,
+            initargs=(shared.specs,),
+        ) as pool:
+            futures = [pool.submit(_evaluate_trials, batch) for batch in batches]
+            for future in tqdm(
+                as_completed(futures), total=len(futures), desc="Search batches"
+            ):
+                yield future.result()
+
+
+def _with_surface(df, best, triangle_size_bounds, saturation_bounds):
+    if best is None:
+        return {"error": float("inf"), "params": None, "result": None}
+    df = df.assign(success_float=df["success"].astype(float))
+    if best["method"] == "knn":
+        X, Y, Z, _ = compute_knn_smooth(
+            df, triangle_size_bounds, saturation_bounds, k=best["params"]["k"]
+        )
+    else:
+        X, Y, Z = compute_soft_brush_smooth(
+            df, triangle_size_bounds, saturation_bounds, best["params"]
+        )
+    return {"error": best["error"], "params": best["params"], "result": (X, Y, Z)}
+
+
+def sample_configurations(n_configurations, space=DEFAULT_PARAMETER_SPACE, seed=0):
+    """Draw algorithm and smoothing configurations uniformly from ``space``"""
+    rng = random.Random(seed)
+    configurations = []
+    for _ in range(n_configurations):
+        config = {}
+        for name, (low, high) in space.items():
+            if isinstance(low, int) and isinstance(high, int):
+                config[name] = rng.randint(low, high)
+            else:
+                config[name] = rng.uniform(low, high)
+        # Keep the soft brush ring at least as wide as in the random search
+        if "inner_radius" in config and "outer_radius" in config:
+            config["outer_radius"] = max(
+                config["outer_radius"], config["inner_radius"] + 10
+            )
+        configurations.append(config)
+    return configurations
+
+
+def halving_budgets(min_iterations, max_iterations, eta):
+    """Iteration budget of every rung, smallest first, ending at max_iterations"""
+    n_rungs = int(math.floor(math.log(max_iterations / min_iterations, eta))) + 1
+    return [int(round(max_iterations / eta**rung)) for rung in reversed(range(n_rungs))]
+
+
+@lru_cache(maxsize=None)
+def _model_surface(triangle_size_bounds, saturation_bounds, ground_truth_func):
+    grid_x = np.linspace(triangle_size_bounds[0], triangle_size_bounds[1], GRID_SIZE)
+    grid_y = np.linspace(saturation_bounds[0], saturation_bounds[1], GRID_SIZE)
+    X, Y = np.meshgrid(grid_x, grid_y)
+    return np.vectorize(
+        lambda x, y: ground_truth_func(x, y, (triangle_size_bounds, saturation_bounds))
+    )(X, Y)
+
+
+def _evaluate_configuration(
+    config,
+    iterations,
+    seed,
+    triangle_size_bounds,
+    saturation_bounds,
+    test_combination_func,
+    ground_truth_func,
+):
+    """Simulate a session with ``config`` and score its smoothed surface"""
+    # Every configuration of a rung sees the same observer randomness, drawn
+    # from its own generator so the global one is left alone
+    combinations, _ = run_base_algorithm(
+        triangle_size_bounds,
+        saturation_bounds,
+        None,
+        iterations=iterations,
+        success_rate_threshold=config["success_rate_threshold"],
+        total_samples_threshold=config["total_samples_threshold"],
+        test_combination=test_combination_func,
+        show_progress=False,
+        rng=random.Random(seed),
+    )
+    df = pd.DataFrame(combinations)
+    df["success_float"] = df["success"].astype(float)
+    _, _, Z = compute_soft_brush_smooth(
+        df,
+        triangle_size_bounds,
+        saturation_bounds,
+        {
+            "inner_radius": config["inner_radius"],
+            "outer_radius": config["outer_radius"],
+        },
+    )
+    # Cheap rungs can leave grid cells without samples; score them at the mean
+    Z = np.where(np.isnan(Z), df["success_float"].mean(), Z)
+    Z_model = _model_surface(triangle_size_bounds, saturation_bounds, ground_truth_func)
+    return compute_error(Z, Z_model)
+
+
+def successive_halving_search(
+    triangle_size_bounds,
+    saturation_bounds,
+    n_configurations=27,
+    min_iterations=100,
+    max_iterations=1000,
+    eta=3,
+    space=DEFAULT_PARAMETER_SPACE,
+    results_path=None,
+    workers=None,
+    seed=0,
+    test_combination_func=test_combination,
+    ground_truth_func=ground_truth_probability,
+):
+    """Budget-aware search over split thresholds and soft brush radii.
+
+    All configurations are first scored on cheap ``run_base_algorithm`` runs;
+    only the best ``1 / eta`` of each rung is promoted to the next, ``eta``
+    times larger, iteration budget until the survivors run at
+    ``max_iterations``. Results are persisted and resumed like ``run_search``.
+
+    Returns ``(best, history)`` where ``best`` holds the ``params``, ``error``
+    and ``iterations`` of the winning configuration and ``history`` every
+    evaluation record.
+    """
+    budgets = halving_budgets(min_iterations, max_iterations, eta)
+    configurations = sample_configurations(n_configurations, space, seed)
+    fingerprint = hashlib.sha1(
+        repr(
+            (
+                triangle_size_bounds,
+                saturation_bounds,
+                configurations,
+                budgets,
+                seed,
+                test_combination_func.__name__,
+                ground_truth_func.__name__,
+            )
+        ).encode()
+    ).hexdigest()
+    history = load_results(results_path, fingerprint)
+    done = {(r["rung"], r["config"]): r for r in history}
+
+    workers = workers or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    out = open(results_path, "a") if results_path else None
+    try:
+        survivors = list(range(len(configurations)))
+        for rung, iterations in enumerate(budgets):
+            pending = [i for i in survivors if (rung, i) not in done]
+            args = [
+                (
+                    configurations[i],
+                    iterations,
+                    seed + rung,
+                    triangle_size_bounds,
+                    saturation_bounds,
+                    test_combination_func,
+                    ground_truth_func,
+                )
+                for i in pending
+            ]
+            if pool:
+                errors = pool.map(_evaluate_configuration, *zip(*args)) if args else []
+            else:
+                errors = (_evaluate_configuration(*a) for a in args)
+            for i, error in tqdm(
+                zip(pending, errors),
+                total=len(pending),
+                desc=f"Rung {rung} ({iterations} iterations)",
+            ):
+                record = {
+                    "dataset": fingerprint,
+                    "rung": rung,
+                    "iterations": iterations,
+                    "config": i,
+                    "params": configurations[i],
+                    "error": error,
+                }
+                done[(rung, i)] = record
+                history.append(record)
+                if out:
+                    out.write(json.dumps(record) + "\n")
+                    out.flush()
+
+            survivors.sort(key=lambda i: done[(rung, i)]["error"])
+            if rung < len(budgets) - 1:
+                survivors = survivors[: max(1, len(survivors) // eta)]
+    finally:
+        if out:
+            out.close()
+        if pool:
+            pool.shutdown()
+
+    best = done[(len(budgets) - 1, survivors[0])]
+    return (
+        {
+            "params": best["params"],
+            "error": best["error"],
+            "iterations": best["iterations"],
+        },
+        history,
+    )
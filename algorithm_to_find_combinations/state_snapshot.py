@@ -0,0 +1,116 @@
+"""Compact binary snapshots of an AlgorithmState's rectangles.
+
+A snapshot is a small header followed by one packed record per cell, so a
+state can be stored in a single column and decoded with ``np.frombuffer``
+without parsing. The header carries a format version and the state's trial
+count; snapshots of an unknown version decode to None and callers fall back to
+the rectangle rows. Cells are stored by quadtree depth and Morton code; bounds
+and areas are derived from them when decoding. Cells without a database id
+(states rebuilt by replay) are stored with id -1.
+"""
+
+import struct
+
+import numpy as np
+
+from .algorithm import AlgorithmState
+from .quadtree import cell_area, deinterleave
+
+MAGIC = b"TVSS"
+FORMAT_VERSION = 3
+HEADER = struct.Struct("<4sHIq")  # magic, format version, cells, trial count
+NO_ID = -1
+
+CELL_DTYPE = np.dtype(
+    [
+        ("id", "<i8"),
+        ("depth", "u1"),
+        ("morton", "<u8"),
+        ("true_samples", "<i4"),
+        ("false_samples", "<i4"),
+    ]
+)
+
+
+def encode_state(state: AlgorithmState) -> bytes:
+    """Pack the state's rectangles and trial count"""
+    cells = np.empty(len(state.rectangles), dtype=CELL_DTYPE)
+    for i, rect in enumerate(state.rectangles):
+        cells[i] = (
+            rect.get("id", NO_ID),
+            rect["depth"],
+            rect["morton"],
+            rect["true_samples"],
+            rect["false_samples"],
+        )
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(cells), state.trial_count)
+    return header + cells.tobytes()
+
+
+def _read_header(blob):
+    if blob is None or len(blob) < HEADER.size:
+        return None
+    magic, version, count, trial_count = HEADER.unpack_from(blob)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        return None
+    return count, trial_count
+
+
+def decode_cells(blob):
+    """Structured array of the snapshot's cells viewing ``blob``, or None"""
+    header = _read_header(blob)
+    if header is None:
+        return None
+    return np.frombuffer(blob, dtype=CELL_DTYPE, count=header[0], offset=HEADER.size)
+
+
+def decode_state(blob, triangle_size_bounds, saturation_bounds):
+    """Rebuild an AlgorithmState from a snapshot, or return None"""
+    header = _read_header(blob)
+    if header is None or header[0] == 0:
+        return None
+    cells = decode_cells(blob)
+    depth = cells["depth"].astype(np.uint64)
+    column, row = deinterleave(cells["morton"])
+    # Cell edges for all cells at once, as in quadtree.cell_bounds
+    t_scale = (triangle_size_bounds[1] - triangle_size_bounds[0]) / (
+        np.uint64(1) << depth
+    )
+    s_scale = (saturation_bounds[1] - saturation_bounds[0]) / (np.uint64(1) << depth)
+    t_min = triangle_size_bounds[0] + column * t_scale
+    t_max = triangle_size_bounds[0] + (column + 1) * t_scale
+    s_min = saturation_bounds[0] + row * s_scale
+    s_max = saturation_bounds[0] + (row + 1) * s_scale
+    rectangles = []
+    # Column-wise tolist() converts to Python scalars in one pass per field
+    for (
+        rect_id,
+        rect_depth,
+        morton,
+        true_samples,
+        false_samples,
+        *bounds,
+    ) in zip(
+        *(cells[name].tolist() for name in CELL_DTYPE.names),
+        t_min.tolist(),
+        t_max.tolist(),
+        s_min.tolist(),
+        s_max.tolist(),
+    ):
+        rect = {
+            "bounds": {
+                "triangle_size": (bounds[0], bounds[1]),
+                "saturation": (bounds[2], bounds[3]),
+            },
+            "depth": rect_depth,
+            "morton": morton,
+            "area": cell_area(rect_depth),
+            "true_samples": true_samples,
+            "false_samples": false_samples,
+        }
+        if rect_id != NO_ID:
+            rect["id"] = rect_id
+        rectangles.append(rect)
+    return AlgorithmState(
+        triangle_size_bounds, saturation_bounds, rectangles, trial_count=header[1]
+    )
@@ -0,0 +1,176 @@
+"""Compact binary payload of a smoothed surface for client-side rendering.
+
+The payload is a fixed header followed by packed little-endian arrays, each
+starting at an offset aligned for its type so a browser can view it with a
+typed array without copying:
+
+* the grid axes ``x`` (triangle size) and ``y`` (saturation) as float32,
+* sample points as uint16 pairs and rectangles as uint16 quadruples
+  (x0, x1, y0, y1), both scaled to the test bounds (0 to 65535),
+* Z row by row (one row per saturation), quantized to uint8 (Z * 255) or
+  stored as float16,
+* a bit mask of the grid points that have a value (NaN in Z), and one bit per
+  sample for its success, both packed most significant bit first.
+
+Unreached grid points are 0 in a uint8 Z and NaN in a float16 Z.
+"""
+
+import struct
+
+import numpy as np
+
+MAGIC = b"TVSF"
+FORMAT_VERSION = 1
+# magic, format version, Z encoding, grid width and height, samples,
+# rectangles, then the triangle size and saturation bounds
+HEADER = struct.Struct("<4sHHIIII4d")
+Z_ENCODINGS = {"u8": (1, np.dtype("u1")), "f16": (2, np.dtype("<f2"))}
+SCALE = 65535
+MEDIA_TYPE = "application/vnd.triangle-vision.surface"
+
+
+def _scaled(values, lo, hi):
+    scaled = np.rint((np.asarray(values, dtype=np.float64) - lo) / (hi - lo) * SCALE)
+    return np.clip(scaled, 0, SCALE).astype("<u2")
+
+
+def _unscaled(values, lo, hi):
+    return lo + values.astype(np.float64) * ((hi - lo) / SCALE)
+
+
+def _pad(parts, size):
+    """Pad the payload so the next array starts at a multiple of ``size``"""
+    length = sum(len(part) for part in parts)
+    parts.append(b"\0" * (-length % size))
+
+
+def encode_surface(
+    X,
+    Y,
+    Z,
+    triangle_size_bounds,
+    saturation_bounds,
+    samples=None,
+    rectangles=None,
+    encoding="u8",
+):
+    """Pack a surface as ``compute_soft_brush_smooth`` returns it.
+
+    ``samples`` is a ``(points, success)`` pair and ``rectangles`` a list of
+    dicts with ``bounds``, as for the plot.
+    """
+    code, z_dtype = Z_ENCODINGS[encoding]
+    x_axis = np.asarray(X, dtype="<f4")[0]
+    y_axis = np.asarray(Y, dtype="<f4")[:, 0]
+    Z = np.asarray(Z, dtype=np.float64)
+    valid = ~np.isnan(Z)
+    if encoding == "u8":
+        z_values = np.rint(np.clip(np.where(valid, Z, 0), 0, 1) * 255).astype(z_dtype)
+    else:
+        z_values = Z.astype(z_dtype)
+
+    (ts_lo, ts_hi), (sat_lo, sat_hi) = triangle_size_bounds, saturation_bounds
+    if samples is None:
+        points, success = np.empty((0, 2)), np.empty(0)
+    else:
+        points, success = samples
+    sample_values = np.empty((len(points), 2), dtype="<u2")
+    sample_values[:, 0] = _scaled(points[:, 0], ts_lo, ts_hi)
+    sample_values[:, 1] = _scaled(points[:, 1], sat_lo, sat_hi)
+    rect_values = np.empty((len(rectangles or ()), 4), dtype="<u2")
+    for i, rect in enumerate(rectangles or ()):
+        rect_values[i, :2] = _scaled(rect["bounds"]["triangle_size"], ts_lo, ts_hi)
+        rect_values[i, 2:] = _scaled(rect["bounds"]["saturation"], sat_lo, sat_hi)
+
+    parts = [
+        HEADER.pack(
+            MAGIC,
+            FORMAT_VERSION,
+            code,
+            len(x_axis),
+            len(y_axis),
+            len(sample_values),
+            len(rect_values),
+            ts_lo,
+            ts_hi,
+            sat_lo,
+            sat_hi,
+        ),
+        x_axis.tobytes(),
+        y_axis.tobytes(),
+        sample_values.tobytes(),
+        rect_values.tobytes(),
+    ]
+    _pad(parts, z_dtype.itemsize)
+    parts.append(z_values.tobytes())
+    parts.append(np.packbits(valid).tobytes())
+    parts.append(np.packbits(np.asarray(success) > 0).tobytes())
+    return b"".join(parts)
+
+
+def decode_surface(data):
+    """Dict of the payload's arrays; Z is float64 with NaN where unreached"""
+    (
+        magic,
+        version,
+        code,
+        width,
+        height,
+        n_samples,
+        n_rects,
+        ts_lo,
+        ts_hi,
+        sat_lo,
+        sat_hi,
+    ) = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("Not a surface payload of a known version")
+    encoding = next(name for name, (c, _) in Z_ENCODINGS.items() if c == code)
+    z_dtype = Z_ENCODINGS[encoding][1]
+
+    offset = HEADER.size
+
+    def take(dtype, count):
+        nonlocal offset
+        array = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        offset += array.nbytes
+        return array
+
+    x_axis = take("<f4", width)
+    y_axis = take("<f4", height)
+    sample_values = take("<u2", n_samples * 2).reshape(-1, 2)
+    rect_values = take("<u2", n_rects * 4).reshape(-1, 4)
+    offset += -offset % z_dtype.itemsize
+    z_values = take(z_dtype, width * height).reshape(height, width)
+    valid = np.unpackbits(take("u1", (width * height + 7) // 8))[: width * height]
+    success = np.unpackbits(take("u1", (n_samples + 7) // 8))[:n_samples]
+
+    Z = z_values.astype(np.float64)
+    if encoding == "u8":
+        Z /= 255
+    Z[valid.reshape(height, width) == 0] = np.nan
+    points = np.column_stack(
+        [
+            _unscaled(sample_values[:, 0], ts_lo, ts_hi),
+            _unscaled(sample_values[:, 1], sat_lo, sat_hi),
+        ]
+    )
+    rectangles = [
+        {
+            "bounds": {
+                "triangle_size": tuple(_unscaled(r[:2], ts_lo, ts_hi)),
+                "saturation": tuple(_unscaled(r[2:], sat_lo, sat_hi)),
+            }
+        }
+        for r in rect_values
+    ]
+    return {
+        "encoding": encoding,
+        "triangle_size_bounds": (ts_lo, ts_hi),
+        "saturation_bounds": (sat_lo, sat_hi),
+        "x": x_axis,
+        "y": y_axis,
+        "Z": Z,
+        "samples": (points, success.astype(np.float64)),
+        "rectangles": rectangles,
+    }
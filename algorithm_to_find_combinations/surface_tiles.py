@@ -0,0 +1,115 @@
+"""Tiles of a multi-resolution soft brush surface.
+
+Level ``L`` splits the test bounds into ``2**L`` by ``2**L`` tiles of
+``TILE_SIZE`` by ``TILE_SIZE`` grid points, so each level doubles the
+resolution of the one above. Tile ``(column, row)`` counts from the lowest
+triangle size and saturation. Grid points sit at the centres of their cells,
+so neighbouring tiles fit together without repeating an edge.
+
+Only the samples within the brush's outer radius of a tile take part in it,
+so a tile costs ``TILE_SIZE**2`` times the samples near it at any level rather
+than growing with the total resolution. ``normalized_samples`` sorts the
+samples by triangle size once, after which finding those near a tile is a
+binary search; keep its result to compute many tiles of the same samples.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from .plotting import (
+    normalized_points,
+    sample_arrays,
+    soft_brush_at,
+    soft_brush_radii,
+)
+
+TILE_SIZE = 64
+MAX_LEVEL = 8
+
+# Samples in normalized coordinates, sorted by triangle size
+NormalizedSamples = namedtuple("NormalizedSamples", ["points", "values"])
+
+
+def normalized_samples(samples, triangle_size_bounds, saturation_bounds):
+    """``NormalizedSamples`` of anything ``sample_arrays`` accepts"""
+    points, values = sample_arrays(samples)
+    points = normalized_points(points, triangle_size_bounds, saturation_bounds)
+    order = np.argsort(points[:, 0], kind="stable")
+    return NormalizedSamples(points[order], values[order])
+
+
+def tile_bounds(level, column, row, triangle_size_bounds, saturation_bounds):
+    """Triangle size and saturation bounds covered by a tile"""
+    n = 1 << level
+    (ts_lo, ts_hi), (sat_lo, sat_hi) = triangle_size_bounds, saturation_bounds
+    ts_step = (ts_hi - ts_lo) / n
+    sat_step = (sat_hi - sat_lo) / n
+    return (
+        (ts_lo + column * ts_step, ts_lo + (column + 1) * ts_step),
+        (sat_lo + row * sat_step, sat_lo + (row + 1) * sat_step),
+    )
+
+
+def _centres(lo, hi, size):
+    return lo + (np.arange(size) + 0.5) * ((hi - lo) / size)
+
+
+def tile_grid(
+    level, column, row, triangle_size_bounds, saturation_bounds, size=TILE_SIZE
+):
+    """``X, Y`` grid of a tile's points"""
+    tile_ts, tile_sat = tile_bounds(
+        level, column, row, triangle_size_bounds, saturation_bounds
+    )
+    return np.meshgrid(_centres(*tile_ts, size), _centres(*tile_sat, size))
+
+
+def compute_tile(
+    samples,
+    triangle_size_bounds,
+    saturation_bounds,
+    level,
+    column,
+    row,
+    params=None,
+    size=TILE_SIZE,
+):
+    """``X, Y, Z`` of one tile, Z with one row per saturation like the full grid.
+
+    ``samples`` is anything ``sample_arrays`` accepts, or ``NormalizedSamples``
+    of the same bounds.
+    """
+    n = 1 << level
+    if not (0 <= level <= MAX_LEVEL and 0 <= column < n and 0 <= row < n):
+        raise ValueError(f"No tile {column}, {row} at level {level}")
+    if not isinstance(samples, NormalizedSamples):
+        samples = normalized_samples(samples, triangle_size_bounds, saturation_bounds)
+    X, Y = tile_grid(level, column, row, triangle_size_bounds, saturation_bounds, size)
+
+    inner_radius_norm, outer_radius_norm = soft_brush_radii(
+        triangle_size_bounds, saturation_bounds, params or {}
+    )
+    # Samples further than the outer radius from the tile along either axis
+    # have no weight anywhere in it
+    lo = np.array([column, row]) / n - outer_radius_norm
+    hi = np.array([column + 1, row + 1]) / n + outer_radius_norm
+    start = np.searchsorted(samples.points[:, 0], lo[0], side="left")
+    stop = np.searchsorted(samples.points[:, 0], hi[0], side="right")
+    points_normalized = samples.points[start:stop]
+    values = samples.values[start:stop]
+    near = (points_normalized[:, 1] >= lo[1]) & (points_normalized[:, 1] <= hi[1])
+
+    grid_points_normalized = normalized_points(
+        np.column_stack([X.ravel(), Y.ravel()]),
+        triangle_size_bounds,
+        saturation_bounds,
+    )
+    Z = soft_brush_at(
+        grid_points_normalized,
+        points_normalized[near],
+        values[near],
+        inner_radius_norm,
+        outer_radius_norm,
+    )
+    return X, Y, Z.reshape(X.shape)
@@ -0,0 +1,151 @@
+"""Combinations drawn ahead of time for the tests being played.
+
+After each recorded result the test's state is handed to ``TrialQueues``,
+and a background thread tops its queue up with combinations drawn from it, so
+``next`` only has to pop one. Entries remember the rectangle they were drawn
+from: a split drops just the entries of the rectangles it removed, and a
+bounds change drops the whole queue.
+
+Queues live in one process. Each is tagged with the ``state_version`` of the
+test it was drawn for, and a pop for any other version (another worker or a
+trial session changed the state) discards the queue instead. The queues and
+the states they draw from are held in a ``ByteBudgetCache``, so the least
+recently played tests are dropped once they exceed its budget.
+"""
+
+import os
+import queue
+import threading
+from collections import deque
+
+from observability.memory import ByteBudgetCache, sizeof
+
+from .algorithm import get_next_combination
+
+QUEUE_DEPTH_ENV = "TRIANGLE_VISION_TRIAL_QUEUE_DEPTH"
+CACHE_BYTES = 32 * 1024 * 1024
+_ENTRY_BYTES = sizeof({"rectangle_id": 1, "triangle_size": 0.0, "saturation": 0.0})
+
+
+def queue_depth():
+    """Combinations kept ready per test; 0 disables the queues"""
+    return int(os.environ.get(QUEUE_DEPTH_ENV, 8))
+
+
+class _TestQueue:
+    def __init__(self, state, version):
+        self.state = state
+        self.version = version
+        self.entries = deque()
+
+
+def _queue_size(test_queue):
+    """Estimated bytes of a queue at full depth and of the state it draws from.
+
+    Sized from one rectangle, since ``refresh`` runs after every result.
+    """
+    rectangles = test_queue.state.rectangles
+    rectangle_bytes = sizeof(rectangles[0]) if rectangles else 0
+    return (
+        sizeof(test_queue)
+        + len(rectangles) * rectangle_bytes
+        + max(queue_depth(), len(test_queue.entries)) * _ENTRY_BYTES
+    )
+
+
+class TrialQueues:
+    def __init__(self, name="trial-queues", max_bytes=CACHE_BYTES):
+        # test id -> _TestQueue
+        self._queues = ByteBudgetCache(name, max_bytes, sizeof=_queue_size)
+        self._lock = threading.Lock()
+        self._work = queue.Queue()
+        self._producer = None
+
+    def pop(self, test_id, version):
+        """A ready combination for the test at ``version``, or None"""
+        with self._lock:
+            test_queue = self._queues.get(test_id)
+            if test_queue is None:
+                return None
+            if test_queue.version != version:
+                self._queues.pop(test_id)
+                return None
+            entry = test_queue.entries.popleft() if test_queue.entries else None
+            trial_count = test_queue.state.trial_count
+        self._schedule(test_id)
+        return None if entry is None else {**entry, "total_samples": trial_count}
+
+    def refresh(self, test_id, state, version, removed_ids=()):
+        """Continue the queue from a committed state.
+
+        ``state`` must not be changed afterwards; the producer draws from it.
+        Entries drawn from ``removed_ids`` are dropped, the rest kept.
+        """
+        if queue_depth() <= 0:
+            return
+        removed_ids = set(removed_ids)
+        with self._lock:
+            test_queue = self._queues.peek(test_id)
+            if test_queue is None:
+                test_queue = _TestQueue(state, version)
+            test_queue.state = state
+            test_queue.version = version
+            if removed_ids:
+                test_queue.entries = deque(
+                    e
+                    for e in test_queue.entries
+                    if e["rectangle_id"] not in removed_ids
+                )
+            self._queues.put(test_id, test_queue)
+        self._schedule(test_id)
+
+    def invalidate(self, test_id):
+        with self._lock:
+            self._queues.pop(test_id)
+
+    def clear(self):
+        with self._lock:
+            self._queues.clear()
+
+    def join(self):
+        """Wait until every scheduled top-up has run"""
+        self._work.join()
+
+    def _schedule(self, test_id):
+        if self._producer is None:
+            with self._lock:
+                if self._producer is None:
+                    self._producer = threading.Thread(
+                        target=self._produce, name="trial-queue", daemon=True
+                    )
+                    self._producer.start()
+        self._work.put(test_id)
+
+    def _produce(self):
+        while True:
+            test_id = self._work.get()
+            try:
+                self._top_up(test_id)
+            finally:
+                self._work.task_done()
+
+    def _top_up(self, test_id):
+        with self._lock:
+            test_queue = self._queues.peek(test_id)
+            if test_queue is None:
+                return
+            state = test_queue.state
+            missing = queue_depth() - len(test_queue.entries)
+        entries = []
+        for _ in range(missing):
+            combination, rect = get_next_combination(state)
+            if combination is None or "id" not in rect:
+                break
+            entries.append({"rectangle_id": rect["id"], **combination})
+        with self._lock:
+            # Drop the draw if the state was replaced meanwhile
+            if self._queues.peek(test_id) is test_queue and test_queue.state is state:
+                test_queue.entries.extend(entries)
+
+
+trial_queues = TrialQueues()
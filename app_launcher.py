@@ -1,18 +1,98 @@
+import importlib.util
+import multiprocessing
+import os
 import uvicorn
 from main import app
 import webbrowser
 import threading
 import time
+import urllib.error
+import urllib.request
 
+# Worker processes share one port; each test's state is protected across them
+# by its version counter (see db.concurrency)
+WORKERS_ENV = "TRIANGLE_VISION_WORKERS"
+# Production mode serves headless on all interfaces with the fast event loop
+# and HTTP parser; the desktop default opens a browser on localhost
+PRODUCTION_ENV = "TRIANGLE_VISION_PRODUCTION"
+HOST_ENV = "TRIANGLE_VISION_HOST"
+PORT_ENV = "TRIANGLE_VISION_PORT"
+LOOP_ENV = "TRIANGLE_VISION_LOOP"
+HTTP_ENV = "TRIANGLE_VISION_HTTP"
+KEEPALIVE_ENV = "TRIANGLE_VISION_KEEPALIVE_SECONDS"
 
-def open_browser():
-    time.sleep(1.5)  # Wait for server to start
-    webbrowser.open("http://localhost:8000")
+READY_PATH = "/api/ready"
+READY_TIMEOUT_SECONDS = 60
+
+
+def production_mode():
+    return os.environ.get(PRODUCTION_ENV, "").lower() in ("1", "true", "yes")
+
+
+def _installed(module):
+    return importlib.util.find_spec(module) is not None
+
+
+def server_options(production=None):
+    """Keyword arguments for uvicorn.run"""
+    if production is None:
+        production = production_mode()
+    workers = int(os.environ.get(WORKERS_ENV, 1))
+    options = {
+        "host": os.environ.get(HOST_ENV, "0.0.0.0" if production else "localhost"),
+        "port": int(os.environ.get(PORT_ENV, 8000)),
+        "workers": workers,
+    }
+    if production:
+        options["loop"] = os.environ.get(
+            LOOP_ENV, "uvloop" if _installed("uvloop") else "asyncio"
+        )
+        options["http"] = os.environ.get(
+            HTTP_ENV, "httptools" if _installed("httptools") else "h11"
+        )
+        # Clients behind a proxy or load generator reuse connections for longer
+        # than uvicorn's 5 second default
+        options["timeout_keep_alive"] = int(os.environ.get(KEEPALIVE_ENV, 30))
+        # Requests are already counted and timed in /api/metrics
+        options["access_log"] = False
+    elif KEEPALIVE_ENV in os.environ:
+        options["timeout_keep_alive"] = int(os.environ[KEEPALIVE_ENV])
+    return options
+
+
+def wait_until_ready(url, timeout=READY_TIMEOUT_SECONDS, interval=0.1):
+    """Poll ``url`` until it answers 200; False if it did not within ``timeout``"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=interval * 10) as response:
+                if response.status == 200:
+                    return True
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(interval)
+    return False
+
+
+def open_browser(port):
+    url = f"http://localhost:{port}"
+    if wait_until_ready(url + READY_PATH):
+        webbrowser.open(url)
 
 
 if __name__ == "__main__":
-    # Start browser in a separate thread
-    threading.Thread(target=open_browser).start()
+    multiprocessing.freeze_support()  # Worker processes of the bundled app
+    options = server_options()
+
+    if not production_mode():
+        # Start browser in a separate thread once the server answers
+        threading.Thread(
+            target=open_browser, args=(options["port"],), daemon=True
+        ).start()
 
     # Start FastAPI server
-    uvicorn.run(app, host="localhost", port=8000)
+    if options["workers"] > 1:
+        # uvicorn imports the app in each worker from its import string
+        uvicorn.run("main:app", **options)
+    else:
+        uvicorn.run(app, **options)
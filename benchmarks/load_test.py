@@ -0,0 +1,313 @@
+"""HTTP load test: concurrent simulated participants against a local server.
+
+Seed synthetic tests into the server's database, then drive the trial loop:
+
+    python -m benchmarks.load_test seed --tests 5 --combinations 2000
+    python -m benchmarks.load_test run --participants 50 --trials 40 \\
+        --output load_report.json
+
+``run --start-server`` launches ``uvicorn main:app`` itself for the duration of
+the run. Every virtual participant repeatedly asks ``/next`` for a
+combination, answers it with ``ground_truth.test_combination`` and posts the
+answer to ``/result``. The report gives throughput and p50/p95/p99 latency
+per endpoint; with the same seed, tests and load parameters, reports from
+different commits are directly comparable.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+import numpy as np
+
+from algorithm_to_find_combinations.algorithm import run_base_algorithm
+from algorithm_to_find_combinations.ground_truth import test_combination
+
+from benchmarks.run_benchmarks import git_commit
+
+REPORT_SCHEMA = 1
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+triangle_size_bounds = (50, 300)
+saturation_bounds = (0.5, 1.0)
+
+
+def seed_tests(n_tests, n_combinations, seed=0):
+    """Insert tests with simulated histories into the application database.
+
+    Combinations come from ``run_base_algorithm`` with the ground truth
+    observer, and the rectangle grid is rebuilt from them by the same replay
+    the API uses when bounds change, which also assigns every combination to
+    its rectangle. Returns the new test ids.
+    """
+    from db.database import Base, SessionLocal, engine
+    from models.test import Test, TestCombination
+    from routers.test_router import recalculate_rectangles
+
+    Base.metadata.create_all(bind=engine)
+    random.seed(seed)
+    db = SessionLocal()
+    test_ids = []
+    try:
+        for i in range(n_tests):
+            test = Test(
+                title=f"Load test {i + 1}",
+                description=f"Synthetic test with {n_combinations} combinations",
+                min_triangle_size=triangle_size_bounds[0],
+                max_triangle_size=triangle_size_bounds[1],
+                min_saturation=saturation_bounds[0],
+                max_saturation=saturation_bounds[1],
+            )
+            db.add(test)
+            db.flush()
+            combinations, _ = run_base_algorithm(
+                triangle_size_bounds,
+                saturation_bounds,
+                None,
+                iterations=n_combinations,
+                show_progress=False,
+            )
+            db_combinations = [
+                TestCombination(
+                    test_id=test.id,
+                    triangle_size=c["triangle_size"],
+                    saturation=c["saturation"],
+                    orientation=random.choice(["N", "E", "S", "W"]),
+                    success=int(c["success"]),
+                )
+                for c in combinations
+            ]
+            db.add_all(db_combinations)
+            db.flush()
+            recalculate_rectangles(db, test)
+            db.commit()
+            test_ids.append(test.id)
+            print(f"Seeded test {test.id} ({len(combinations)} combinations)")
+    finally:
+        db.close()
+    return test_ids
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, endpoint, seconds, ok):
+        self.samples.setdefault(endpoint, []).append(seconds)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self, elapsed):
+        endpoints = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies_ms = np.array(samples) * 1e3
+            p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+            endpoints[endpoint] = {
+                "requests": len(samples),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput_rps": len(samples) / elapsed,
+                "mean_ms": float(latencies_ms.mean()),
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "max_ms": float(latencies_ms.max()),
+            }
+        return endpoints
+
+
+async def _timed(recorder, endpoint, request):
+    start = time.perf_counter()
+    try:
+        response = await request
+    except httpx.HTTPError:
+        recorder.record(endpoint, time.perf_counter() - start, False)
+        return None
+    recorder.record(endpoint, time.perf_counter() - start, response.is_success)
+    return response if response.is_success else None
+
+
+async def participant(client, test_id, trials, recorder):
+    """One observer working through ``trials`` triangles of a test"""
+    completed = 0
+    for _ in range(trials):
+        response = await _timed(
+            recorder,
+            "GET /api/test-combinations/next/{test_id}",
+            client.get(f"/api/test-combinations/next/{test_id}"),
+        )
+        if response is None:
+            continue
+        combination = response.json()
+        bounds = (triangle_size_bounds, saturation_bounds)
+        success = test_combination(
+            combination["triangle_size"], combination["saturation"], bounds
+        )
+        response = await _timed(
+            recorder,
+            "POST /api/test-combinations/result",
+            client.post(
+                "/api/test-combinations/result",
+                json={
+                    "test_id": test_id,
+                    "rectangle_id": combination["rectangle_id"],
+                    "triangle_size": combination["triangle_size"],
+                    "saturation": combination["saturation"],
+                    "orientation": combination["orientation"],
+                    "success": int(success),
+                },
+            ),
+        )
+        if response is not None:
+            completed += 1
+    return completed
+
+
+async def run_load(base_url, test_ids, participants, trials, seed=0):
+    random.seed(seed)
+    recorder = LatencyRecorder()
+    limits = httpx.Limits(max_connections=participants)
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=60.0
+    ) as client:
+        start = time.perf_counter()
+        completed = await asyncio.gather(
+            *(
+                participant(client, test_ids[i % len(test_ids)], trials, recorder)
+                for i in range(participants)
+            )
+        )
+        elapsed = time.perf_counter() - start
+    return {
+        "elapsed_s": elapsed,
+        "trials_completed": sum(completed),
+        "trials_per_s": sum(completed) / elapsed,
+        "endpoints": recorder.summary(elapsed),
+    }
+
+
+def wait_until_ready(base_url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/api/tests/", timeout=1.0).is_success:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not become ready")
+
+
+def start_server(port):
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=REPO_ROOT,
+    )
+    return server, f"http://127.0.0.1:{port}"
+
+
+def _existing_test_ids(base_url):
+    response = httpx.get(f"{base_url}/api/tests/", params={"limit": 1000})
+    response.raise_for_status()
+    return [t["id"] for t in response.json() if t["title"].startswith("Load test")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser("seed", help="insert synthetic tests")
+    seed_parser.add_argument("--tests", type=int, default=5)
+    seed_parser.add_argument("--combinations", type=int, default=2000)
+    seed_parser.add_argument("--seed", type=int, default=0)
+
+    run_parser = commands.add_parser("run", help="drive simulated participants")
+    run_parser.add_argument("--base-url", default="http://localhost:8000")
+    run_parser.add_argument("--start-server", action="store_true")
+    run_parser.add_argument("--port", type=int, default=8765)
+    run_parser.add_argument("--participants", type=int, default=20)
+    run_parser.add_argument("--trials", type=int, default=30)
+    run_parser.add_argument(
+        "--test-id",
+        type=int,
+        action="append",
+        help="test to load (repeatable); defaults to every seeded load test",
+    )
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--output", help="write the JSON report to this path")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "seed":
+        seed_tests(args.tests, args.combinations, args.seed)
+        return 0
+
+    server = None
+    base_url = args.base_url
+    if args.start_server:
+        server, base_url = start_server(args.port)
+    try:
+        wait_until_ready(base_url)
+        test_ids = args.test_id or _existing_test_ids(base_url)
+        if not test_ids:
+            print("No load tests found; run the seed command first")
+            return 1
+        results = asyncio.run(
+            run_load(base_url, test_ids, args.participants, args.trials, args.seed)
+        )
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    report = {
+        "schema": REPORT_SCHEMA,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            "participants": args.participants,
+            "trials": args.trials,
+            "test_ids": test_ids,
+            "seed": args.seed,
+        },
+        **results,
+    }
+    print(
+        f"{report['trials_completed']} trials in {report['elapsed_s']:.2f} s "
+        f"({report['trials_per_s']:.1f} trials/s)"
+    )
+    for endpoint, stats in report["endpoints"].items():
+        print(
+            f"{endpoint:<40} {stats['throughput_rps']:8.1f} req/s"
+            f"  p50 {stats['p50_ms']:8.2f} ms  p95 {stats['p95_ms']:8.2f} ms"
+            f"  p99 {stats['p99_ms']:8.2f} ms  errors {stats['errors']}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,393 @@
+"""Micro-benchmarks for the sampling algorithm and the smoothing kernels.
+
+Run from the repository root:
+
+    python -m benchmarks.run_benchmarks                     # compare to baseline
+    python -m benchmarks.run_benchmarks --output report.json
+    python -m benchmarks.run_benchmarks --filter knn --filter split
+    python -m benchmarks.run_benchmarks --update-baseline
+
+The report is JSON with one entry per case. A case regresses when its fastest
+repeat is slower than the baseline's fastest repeat times the case's
+threshold; the process then exits with status 1. The minimum is compared
+because interference from other processes only ever adds time. Baselines are machine specific, so refresh them with
+``--update-baseline`` when moving to a different machine.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from algorithm_to_find_combinations.algorithm import (
+    AlgorithmState,
+    get_next_combination,
+    split_rectangle,
+    update_state,
+)
+from algorithm_to_find_combinations.ground_truth import ground_truth_probability
+from algorithm_to_find_combinations.plotting import (
+    compute_knn_smooth,
+    compute_soft_brush_smooth,
+)
+
+REPORT_SCHEMA = 1
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_THRESHOLD = 1.5
+
+triangle_size_bounds = (50, 300)
+saturation_bounds = (0.5, 1.0)
+
+GRID_POINTS = 100 * 100
+# The soft brush holds several (grid points x samples) float64 matrices at once
+SOFT_BRUSH_MATRICES = 5
+SPLITS_PER_RUN = 50
+
+
+def build_state(n_rectangles, seed=0):
+    """State with at least ``n_rectangles`` cells, split breadth first"""
+    rng = random.Random(seed)
+    state = AlgorithmState(triangle_size_bounds, saturation_bounds)
+    queue = deque(state.rectangles)
+    while len(queue) < n_rectangles:
+        queue.extend(split_rectangle(queue.popleft()))
+    for rect in queue:
+        rect["true_samples"] = rng.randint(0, 5)
+        rect["false_samples"] = rng.randint(0, 2)
+    return AlgorithmState(triangle_size_bounds, saturation_bounds, list(queue))
+
+
+def build_samples(n_samples, seed=0):
+    """Uniform samples with successes drawn from the ground truth model"""
+    rng = np.random.default_rng(seed)
+    triangle_size = rng.uniform(*triangle_size_bounds, n_samples)
+    saturation = rng.uniform(*saturation_bounds, n_samples)
+    probability = np.array(
+        [
+            ground_truth_probability(t, s, (triangle_size_bounds, saturation_bounds))
+            for t, s in zip(triangle_size, saturation)
+        ]
+    )
+    success = (rng.random(n_samples) < probability).astype(int)
+    df = pd.DataFrame(
+        {"triangle_size": triangle_size, "saturation": saturation, "success": success}
+    )
+    df["success_float"] = df["success"].astype(float)
+    return df
+
+
+class Case:
+    """A named benchmark.
+
+    ``setup`` returns the argument passed to ``run``; it is called once per
+    repeat and is not timed. ``number`` calls of ``run`` make up one repeat,
+    and each call of ``run`` performs ``batch`` operations of the measured
+    function. Reported times are per operation.
+    """
+
+    def __init__(
+        self,
+        name,
+        run,
+        setup=lambda: None,
+        number=1,
+        batch=1,
+        repeats=5,
+        threshold=DEFAULT_THRESHOLD,
+        skip_reason=None,
+    ):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.number = number
+        self.batch = batch
+        self.repeats = repeats
+        self.threshold = threshold
+        self.skip_reason = skip_reason
+
+    def measure(self):
+        if self.skip_reason:
+            return {"status": "skipped", "reason": self.skip_reason}
+        timings = []
+        gc_enabled = gc.isenabled()
+        try:
+            for _ in range(self.repeats):
+                arg = self.setup()
+                # Like timeit, keep collector pauses out of the measurement
+                gc.collect()
+                gc.disable()
+                start = time.perf_counter()
+                for _ in range(self.number):
+                    self.run(arg)
+                elapsed = time.perf_counter() - start
+                if gc_enabled:
+                    gc.enable()
+                timings.append(elapsed / (self.number * self.batch))
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return {
+            "status": "ok",
+            "median_s": statistics.median(timings),
+            "min_s": min(timings),
+            "max_s": max(timings),
+            "repeats": self.repeats,
+            "number": self.number,
+            "batch": self.batch,
+            "threshold": self.threshold,
+        }
+
+
+def algorithm_cases():
+    cases = []
+    for n in (10, 1_000, 100_000):
+        state = build_state(n)
+        cases.append(
+            Case(
+                f"get_next_combination[{n}]",
+                lambda _, state=state: get_next_combination(state),
+                number=max(1, 10_000 // n),
+            )
+        )
+
+        # Cells that split on their next failure, in a state of n cells
+        def split_setup(n=n):
+            state = build_state(n)
+            step = max(1, len(state.rectangles) // SPLITS_PER_RUN)
+            rects = state.rectangles[::step][:SPLITS_PER_RUN]
+            for rect in rects:
+                rect["true_samples"], rect["false_samples"] = 0, 5
+            return state, rects
+
+        def split_all(arg):
+            state, rects = arg
+            for rect in rects:
+                update_state(
+                    state, rect, {"triangle_size": 100.0, "saturation": 0.7}, False
+                )
+
+        cases.append(
+            Case(
+                f"update_state[{n}]",
+                split_all,
+                setup=split_setup,
+                batch=min(n, SPLITS_PER_RUN),
+                repeats=10,
+            )
+        )
+
+    rect = build_state(1).rectangles[0]
+    cases.append(
+        Case("split_rectangle", lambda _: split_rectangle(rect), number=10_000)
+    )
+    return cases
+
+
+def smoothing_cases(max_matrix_bytes):
+    cases = []
+    for n in (1_000, 10_000, 100_000):
+        df = build_samples(n)
+        needed = GRID_POINTS * n * 8 * SOFT_BRUSH_MATRICES
+        cases.append(
+            Case(
+                f"compute_soft_brush_smooth[{n}]",
+                lambda _, df=df: compute_soft_brush_smooth(
+                    df, triangle_size_bounds, saturation_bounds, {}
+                ),
+                repeats=3,
+                skip_reason=(
+                    f"needs ~{needed / 2**30:.1f} GiB of distance matrices"
+                    if needed > max_matrix_bytes
+                    else None
+                ),
+            )
+        )
+        cases.append(
+            Case(
+                f"compute_knn_smooth[{n}]",
+                lambda _, df=df: compute_knn_smooth(
+                    df, triangle_size_bounds, saturation_bounds, k=50
+                ),
+                repeats=3,
+            )
+        )
+    return cases
+
+
+def replay_cases():
+    # Imported lazily: the router pulls in FastAPI and matplotlib
+    from db.database import Base
+    from models.test import Test, TestCombination
+    from routers.test_router import recalculate_rectangles
+
+    cases = []
+    for n in (1_000, 10_000):
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=engine)
+        session = sessionmaker(bind=engine)()
+        test = Test(
+            title="benchmark",
+            description="",
+            min_triangle_size=triangle_size_bounds[0],
+            max_triangle_size=triangle_size_bounds[1],
+            min_saturation=saturation_bounds[0],
+            max_saturation=saturation_bounds[1],
+        )
+        session.add(test)
+        session.flush()
+        df = build_samples(n)
+        session.add_all(
+            TestCombination(
+                test_id=test.id,
+                triangle_size=float(row.triangle_size),
+                saturation=float(row.saturation),
+                orientation="N",
+                success=int(row.success),
+            )
+            for row in df.itertuples()
+        )
+        session.commit()
+        cases.append(
+            Case(
+                f"recalculate_rectangles[{n}]",
+                lambda _, session=session, test=test: recalculate_rectangles(
+                    session, test
+                ),
+                repeats=3,
+            )
+        )
+    return cases
+
+
+def collect_cases(max_matrix_bytes):
+    return algorithm_cases() + smoothing_cases(max_matrix_bytes) + replay_cases()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(__file__),
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(cases, filters=()):
+    results = {}
+    for case in cases:
+        if filters and not any(f in case.name for f in filters):
+            continue
+        random.seed(0)
+        results[case.name] = case.measure()
+        print(_format_result(case.name, results[case.name]), flush=True)
+    return {
+        "schema": REPORT_SCHEMA,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def compare(report, baseline):
+    """Return (case, current, baseline, threshold) for every regressed case"""
+    regressions = []
+    for name, result in report["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if result["status"] != "ok" or not base or base.get("status") != "ok":
+            continue
+        threshold = result.get("threshold", DEFAULT_THRESHOLD)
+        if result["min_s"] > base["min_s"] * threshold:
+            regressions.append((name, result["min_s"], base["min_s"], threshold))
+    return regressions
+
+
+def _format_result(name, result):
+    if result["status"] != "ok":
+        return f"{name:<40} skipped ({result['reason']})"
+    return (
+        f"{name:<40} min {result['min_s'] * 1e3:10.3f} ms"
+        f"  median {result['median_s'] * 1e3:10.3f} ms"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="write the JSON report to this path")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="store this run as the new baseline instead of comparing",
+    )
+    parser.add_argument(
+        "--filter",
+        action="append",
+        default=[],
+        help="only run cases whose name contains this text (repeatable)",
+    )
+    parser.add_argument(
+        "--max-matrix-bytes",
+        type=float,
+        default=2 * 2**30,
+        help="skip soft brush sizes whose dense matrices exceed this many bytes",
+    )
+    args = parser.parse_args(argv)
+
+    report = run(collect_cases(args.max_matrix_bytes), args.filter)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        # Merge so a filtered run only refreshes the cases it measured
+        baseline.update({k: v for k, v in report.items() if k != "results"})
+        baseline.setdefault("results", {}).update(report["results"])
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare against; run with --update-baseline")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(report, baseline)
+    for name, current, base, threshold in regressions:
+        print(
+            f"REGRESSION {name}: {current * 1e3:.3f} ms vs baseline "
+            f"{base * 1e3:.3f} ms (threshold x{threshold})"
+        )
+    if not regressions:
+        print(f"No regressions against baseline {baseline.get('commit')}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
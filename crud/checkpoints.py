@@ -0,0 +1,110 @@
+import os
+
+from sqlalchemy.orm import Session
+from algorithm_to_find_combinations.algorithm import AlgorithmState, replay_results
+from algorithm_to_find_combinations.state_snapshot import decode_state, encode_state
+from models.test import StateCheckpoint, Test, TestCombination
+
+CHECKPOINT_INTERVAL_ENV = "TRIANGLE_VISION_CHECKPOINT_INTERVAL"
+
+
+def checkpoint_interval():
+    """Trials between checkpoints; 0 disables them"""
+    return int(os.environ.get(CHECKPOINT_INTERVAL_ENV, 200))
+
+
+def checkpoint_due(trial_count):
+    interval = checkpoint_interval()
+    return interval > 0 and trial_count > 0 and trial_count % interval == 0
+
+
+def add_checkpoint(db: Session, test_id: int, state: AlgorithmState, last_id: int):
+    db.add(
+        StateCheckpoint(
+            test_id=test_id,
+            trial_count=state.trial_count,
+            last_combination_id=last_id,
+            snapshot=encode_state(state),
+        )
+    )
+
+
+def nearest_checkpoint(db: Session, test_id: int, trial_count: int = None):
+    """Latest checkpoint of the test covering at most ``trial_count`` trials"""
+    query = db.query(StateCheckpoint).filter(StateCheckpoint.test_id == test_id)
+    if trial_count is not None:
+        query = query.filter(StateCheckpoint.trial_count <= trial_count)
+    return query.order_by(StateCheckpoint.trial_count.desc()).first()
+
+
+def _results_after(db: Session, test_id: int, after_id: int, limit: int = None):
+    query = (
+        db.query(
+            TestCombination.id,
+            TestCombination.triangle_size,
+            TestCombination.saturation,
+            TestCombination.success,
+        )
+        .filter(TestCombination.test_id == test_id, TestCombination.id > after_id)
+        .order_by(TestCombination.id)
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+def _initial_state(test: Test):
+    state = AlgorithmState(
+        (test.min_triangle_size, test.max_triangle_size),
+        (test.min_saturation, test.max_saturation),
+    )
+    state.new_rectangles = []
+    return state
+
+
+def replay_state(db: Session, test: Test, as_of: int = None):
+    """State after the test's first ``as_of`` results (all if None).
+
+    The replay starts from the nearest checkpoint, so it applies at most one
+    checkpoint interval of results. Returns the state and the checkpoint it
+    started from, or None if it replayed from the beginning.
+    """
+    checkpoint = nearest_checkpoint(db, test.id, as_of)
+    state = None
+    if checkpoint is not None:
+        state = decode_state(
+            checkpoint.snapshot,
+            (test.min_triangle_size, test.max_triangle_size),
+            (test.min_saturation, test.max_saturation),
+        )
+    if state is None:
+        checkpoint = None
+        state = _initial_state(test)
+    after_id = checkpoint.last_combination_id if checkpoint else 0
+    limit = None if as_of is None else max(as_of - state.trial_count, 0)
+    rows = _results_after(db, test.id, after_id, limit)
+    state = replay_results(
+        state, ((r.triangle_size, r.saturation, r.success) for r in rows)
+    )
+    state.new_rectangles = []
+    state.removed_rectangles = []
+    return state, checkpoint
+
+
+def rebuild_checkpoints(db: Session, test: Test):
+    """Replace the test's checkpoints by replaying its whole history.
+
+    Needed when the bounds change, since checkpoints only hold for the bounds
+    they were taken under. Returns the final state.
+    """
+    db.query(StateCheckpoint).filter(StateCheckpoint.test_id == test.id).delete()
+    state = _initial_state(test)
+    for row in _results_after(db, test.id, 0):
+        state = replay_results(
+            state, [(row.triangle_size, row.saturation, row.success)]
+        )
+        if checkpoint_due(state.trial_count):
+            add_checkpoint(db, test.id, state, row.id)
+    state.new_rectangles = []
+    state.removed_rectangles = []
+    return state
@@ -0,0 +1,70 @@
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from models.test import TestCombination
+
+# Columns of a listed combination, selected without building ORM objects
+COMBINATION_COLUMNS = (
+    TestCombination.id,
+    TestCombination.test_id,
+    TestCombination.rectangle_id,
+    TestCombination.triangle_size,
+    TestCombination.saturation,
+    TestCombination.orientation,
+    TestCombination.success,
+    TestCombination.created_at,
+)
+COMBINATION_FIELDS = tuple(column.key for column in COMBINATION_COLUMNS)
+STREAM_BATCH_SIZE = 1000
+
+
+def combination_rows(
+    db: Session, test_id: int = None, after: int = None, limit: int = None
+):
+    """Combination rows (plain Row tuples) in id order.
+
+    Pages are keyed on the last id seen (``after``) rather than an offset, so
+    every page costs the same however deep it is.
+    """
+    query = select(*COMBINATION_COLUMNS).order_by(TestCombination.id)
+    if test_id is not None:
+        query = query.where(TestCombination.test_id == test_id)
+    if after is not None:
+        query = query.where(TestCombination.id > after)
+    if limit is not None:
+        query = query.limit(limit)
+    return db.execute(query).all()
+
+
+def iter_combination_rows(db: Session, test_id: int, batch_size: int = None):
+    """All rows of a test, fetched one keyset page at a time"""
+    batch_size = batch_size or STREAM_BATCH_SIZE
+    after = None
+    while True:
+        rows = combination_rows(db, test_id, after, batch_size)
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        after = rows[-1][0]
+
+
+def combination_arrays(db: Session, test_id: int, dtype=np.float64):
+    """``(points, success)`` arrays of a test's results for the smoothing functions.
+
+    ``points`` is an ``(n, 2)`` array of triangle size and saturation and
+    ``success`` holds 1.0 or 0.0, both of ``dtype`` (float32 halves their
+    size). The rows are read from the DB-API cursor straight into one array,
+    without building ORM objects, Row tuples or a DataFrame.
+    """
+    query = select(
+        TestCombination.triangle_size,
+        TestCombination.saturation,
+        TestCombination.success,
+    ).where(TestCombination.test_id == test_id, TestCombination.success.is_not(None))
+    result = db.connection().execute(query)
+    try:
+        columns = np.fromiter(result.cursor, dtype=np.dtype((dtype, 3)))
+    finally:
+        result.close()
+    # Slices of the rows would be strided views; copy them into compact arrays
+    return np.ascontiguousarray(columns[:, :2]), np.ascontiguousarray(columns[:, 2])
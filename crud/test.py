@@ -1,5 +1,16 @@
+import math
+
+from sqlalchemy import inspect, select, text, update
 from sqlalchemy.orm import Session
-from models.test import Test, TestCreate, TestUpdate
+from algorithm_to_find_combinations.quadtree import locate, point_code
+from models.test import (
+    Rectangle,
+    StateCheckpoint,
+    Test,
+    TestCombination,
+    TestCreate,
+    TestUpdate,
+)
 
 
 def create_test(db: Session, test: TestCreate):
@@ -31,6 +42,104 @@ def update_test(db: Session, test_id: int, test: TestUpdate):
 def delete_test(db: Session, test_id: int):
     db_test = db.query(Test).filter(Test.id == test_id).first()
     if db_test:
+        # Checkpoints have no relationship to clear their reference to the test
+        db.query(StateCheckpoint).filter(StateCheckpoint.test_id == test_id).delete()
         db.delete(db_test)
         db.commit()
     return db_test
+
+
+def assign_combinations_to_rectangles(
+    db: Session, test: Test, cells, from_rectangle_ids=None
+):
+    """Point combinations at the rectangle of their test that contains them.
+
+    ``cells`` maps the (depth, morton) cell of every current rectangle of the
+    test to its id. Only combinations assigned to one of
+    ``from_rectangle_ids`` (rectangles about to be removed) are moved when
+    given, otherwise all of the test's; a combination outside the test's
+    bounds gets no rectangle. Cells are found by point location in
+    Python, so this is one SELECT and one executemany UPDATE however many
+    combinations move.
+    """
+    query = select(
+        TestCombination.id, TestCombination.triangle_size, TestCombination.saturation
+    ).where(TestCombination.test_id == test.id)
+    if from_rectangle_ids is not None:
+        query = query.where(TestCombination.rectangle_id.in_(from_rectangle_ids))
+    triangle_size_bounds = (test.min_triangle_size, test.max_triangle_size)
+    saturation_bounds = (test.min_saturation, test.max_saturation)
+    max_depth = max((depth for depth, _ in cells), default=0)
+    moves = [
+        {
+            "id": combination_id,
+            "rectangle_id": locate(
+                cells,
+                triangle_size,
+                saturation,
+                triangle_size_bounds,
+                saturation_bounds,
+                max_depth,
+            ),
+        }
+        for combination_id, triangle_size, saturation in db.execute(query)
+    ]
+    if moves:
+        db.execute(
+            update(TestCombination).execution_options(synchronize_session=False),
+            moves,
+        )
+
+
+def backfill_rectangle_cells(db: Session):
+    """Set depth and morton on rectangles stored with float bounds.
+
+    Databases created before rectangles were identified by their quadtree
+    cell only have the bounds; the cell is recovered from the bounds and the
+    test's. Those columns are left in place but no longer read.
+    """
+    columns = {c["name"] for c in inspect(db.get_bind()).get_columns("rectangles")}
+    if "min_triangle_size" not in columns:
+        return
+    rows = db.execute(
+        text(
+            "SELECT r.id, r.min_triangle_size, r.max_triangle_size, "
+            "r.min_saturation, r.max_saturation, t.min_triangle_size, "
+            "t.max_triangle_size, t.min_saturation, t.max_saturation "
+            "FROM rectangles r JOIN tests t ON t.id = r.test_id "
+            "WHERE r.depth IS NULL"
+        )
+    ).all()
+    cells = []
+    for rect_id, t_min, t_max, s_min, s_max, *test_bounds in rows:
+        triangle_size_bounds = tuple(test_bounds[:2])
+        saturation_bounds = tuple(test_bounds[2:])
+        depth = round(
+            math.log2(
+                (triangle_size_bounds[1] - triangle_size_bounds[0]) / (t_max - t_min)
+            )
+        )
+        morton = point_code(
+            (t_min + t_max) / 2,
+            (s_min + s_max) / 2,
+            depth,
+            triangle_size_bounds,
+            saturation_bounds,
+        )
+        cells.append({"id": rect_id, "depth": depth, "morton": morton})
+    if cells:
+        db.execute(
+            update(Rectangle).execution_options(synchronize_session=False), cells
+        )
+    db.commit()
+
+
+def backfill_state_versions(db: Session):
+    """Start the version counter of tests created before it existed"""
+    db.execute(
+        update(Test)
+        .where(Test.state_version.is_(None))
+        .values(state_version=0)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
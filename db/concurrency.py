@@ -0,0 +1,58 @@
+"""Concurrency control for a test's adaptive grid.
+
+Each request that changes a test's rectangles reads the state, changes it and
+writes it back, so two requests for the same test must not interleave. Within
+a process, requests for one test take the same striped lock. Across worker
+processes ``Test.state_version`` is checked and bumped by every UPDATE of the
+test row (SQLAlchemy's version counter), so a request that read a state another
+worker has since replaced fails with StaleDataError on commit; its transaction
+is rolled back and the whole operation runs again on the new state.
+"""
+
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy.orm.exc import StaleDataError
+
+from observability.metrics import STATE_CONFLICTS
+
+LOCK_STRIPES = 64
+STATE_RETRIES_ENV = "TRIANGLE_VISION_STATE_RETRIES"
+
+_stripes = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+
+def state_retries():
+    return int(os.environ.get(STATE_RETRIES_ENV, 5))
+
+
+@contextmanager
+def state_lock(test_id):
+    """Serialise changes to one test's state within this process"""
+    with _stripes[hash(test_id) % LOCK_STRIPES]:
+        yield
+
+
+def run_with_state_retry(db, test_id, operation):
+    """Run ``operation()`` under the test's lock, retrying on stale state.
+
+    ``operation`` must do all of its reads and writes through ``db`` and
+    commit; StaleDataError is re-raised once the retries are used up. The
+    lock is released during the backoff so other requests for the test can
+    proceed meanwhile.
+    """
+    attempts = max(1, state_retries())
+    for attempt in range(attempts):
+        with state_lock(test_id):
+            try:
+                return operation()
+            except StaleDataError:
+                db.rollback()
+                STATE_CONFLICTS.inc()
+                if attempt == attempts - 1:
+                    raise
+        # Back off so racing workers do not collide again
+        time.sleep(random.uniform(0, 0.005 * 2**attempt))
@@ -1,16 +1,117 @@
-from sqlalchemy import create_engine
+"""Database engine and session factory.
+
+The database is chosen with ``TRIANGLE_VISION_DATABASE_URL`` (any SQLAlchemy
+URL; PostgreSQL needs a driver such as psycopg installed) and defaults to the
+SQLite file next to the app. Pooling is tuned with:
+
+- ``TRIANGLE_VISION_DB_POOL_SIZE`` and ``TRIANGLE_VISION_DB_MAX_OVERFLOW``:
+  connections kept open, and opened beyond that under load
+- ``TRIANGLE_VISION_DB_POOL_RECYCLE``: seconds after which a connection is
+  replaced
+- ``TRIANGLE_VISION_DB_PRE_PING``: check connections before use; on by default
+  except for SQLite
+- ``TRIANGLE_VISION_DB_STATEMENT_CACHE_SIZE``: compiled statements cached per
+  engine (SQLAlchemy's ``query_cache_size``)
+"""
+
+import os
+
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./sql_app.db"
+DATABASE_URL_ENV = "TRIANGLE_VISION_DATABASE_URL"
+DEFAULT_DATABASE_URL = "sqlite:///./sql_app.db"
+_ENV_PREFIX = "TRIANGLE_VISION_DB_"
+
+
+def _env_int(name):
+    value = os.environ.get(_ENV_PREFIX + name)
+    return int(value) if value else None
+
+
+def engine_options(url):
+    """Keyword arguments for create_engine from the environment"""
+    url = make_url(url)
+    sqlite = url.get_backend_name() == "sqlite"
+    options = {}
+    if sqlite:
+        # Sessions are used from FastAPI's threadpool
+        options["connect_args"] = {"check_same_thread": False}
+    pre_ping = os.environ.get(_ENV_PREFIX + "PRE_PING")
+    options["pool_pre_ping"] = (
+        pre_ping.lower() in ("1", "true", "yes") if pre_ping else not sqlite
+    )
+    for name, option in (
+        ("POOL_SIZE", "pool_size"),
+        ("MAX_OVERFLOW", "max_overflow"),
+        ("POOL_RECYCLE", "pool_recycle"),
+        ("STATEMENT_CACHE_SIZE", "query_cache_size"),
+    ):
+        value = _env_int(name)
+        if value is not None:
+            options[option] = value
+    return options
+
+
+def make_engine(url=None):
+    url = url or os.environ.get(DATABASE_URL_ENV, DEFAULT_DATABASE_URL)
+    engine = create_engine(url, **engine_options(url))
+    if engine.dialect.name == "sqlite" and engine.url.database not in (
+        None,
+        "",
+        ":memory:",
+    ):
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+        @event.listens_for(engine, "connect")
+        def _enable_wal(dbapi_connection, connection_record):
+            # Readers in other worker processes are not blocked while one writes
+            dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+    return engine
+
+
+SQLALCHEMY_DATABASE_URL = os.environ.get(DATABASE_URL_ENV, DEFAULT_DATABASE_URL)
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
 
+def add_missing_columns(engine, metadata):
+    """Add model columns missing from existing tables.
+
+    ``create_all`` only creates missing tables, so columns added to a model
+    later are added here with ALTER TABLE. Only nullable columns without
+    server defaults can be added this way, which is what new columns should be.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(
+                    text(
+                        f"ALTER TABLE {table.name} "
+                        f"ADD COLUMN {column.name} {column_type}"
+                    )
+                )
+
+
+def add_missing_indexes(engine, metadata):
+    """Create model indexes missing from existing tables"""
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+
 def get_db():
     db = SessionLocal()
     try:
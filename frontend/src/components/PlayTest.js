@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { useParams, Link } from "react-router-dom"; // Added Link import
 import { useTheme } from "../context/ThemeContext"; // Added import
 import Content from "./Content";
@@ -11,6 +11,7 @@ function PlayTest() {
   const [startTime, setStartTime] = useState(null);
   const { theme } = useTheme(); // Get current theme
   const [totalSamples, setTotalSamples] = useState(0); // Added state for total samples
+  const sessionRef = useRef(null); // WebSocket trial session
 
   const hslToRgb = (h, s, l) => {
     // Convert saturation and lightness to decimal
@@ -35,55 +36,65 @@ function PlayTest() {
     return `rgb(${r}, ${g}, ${b})`;
   };
 
-  const fetchNextCombination = async () => {
-    try {
-      const response = await fetch(
-        `http://localhost:8000/api/test-combinations/next/${testId}`
-      );
-      const data = await response.json();
-      setCurrentTest(data);
-      setStartTime(Date.now());
-      setTotalSamples(data.total_samples); // Use the total_samples from API instead of incrementing
-    } catch (error) {
-      console.error("Error fetching next combination:", error);
-    }
+  const showCombination = (data) => {
+    setCurrentTest(data);
+    setStartTime(Date.now());
+    setTotalSamples(data.total_samples); // Use the total_samples from API instead of incrementing
   };
 
-  const submitResult = async (success) => {
-    if (!currentTest) return;
+  const submitResult = (success) => {
+    const session = sessionRef.current;
+    if (!currentTest || !session || session.readyState !== WebSocket.OPEN)
+      return;
     const answerTime = Date.now() - startTime;
 
-    try {
-      // Set feedback immediately
-      setFeedback({
-        correct: success,
-        time: answerTime,
-      });
-
-      // First, send result to server and wait for it to complete
-      await fetch("http://localhost:8000/api/test-combinations/result", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({
-          ...currentTest,
-          success: success ? 1 : 0,
-        }),
-      });
-
-      // Then fetch next combination
-      fetchNextCombination();
-
-      // Clear feedback after 500ms
-      setTimeout(() => {
-        setFeedback(null);
-      }, 500);
-    } catch (error) {
-      console.error("Error submitting result:", error);
-    }
+    // Set feedback immediately
+    setFeedback({
+      correct: success,
+      time: answerTime,
+    });
+
+    // The server answers with the next combination straight away
+    session.send(
+      JSON.stringify({
+        type: "result",
+        trial: currentTest.trial,
+        success: success ? 1 : 0,
+      })
+    );
+
+    // Clear feedback after 500ms
+    setTimeout(() => {
+      setFeedback(null);
+    }, 500);
   };
 
   useEffect(() => {
-    fetchNextCombination();
+    const session = new WebSocket(
+      `ws://localhost:8000/api/test-combinations/session/${testId}`
+    );
+    session.onmessage = (event) => {
+      const data = JSON.parse(event.data);
+      if (data.type === "combination") {
+        showCombination(data);
+      } else if (data.type === "error") {
+        console.error("Trial session error:", data.detail);
+      }
+    };
+    session.onerror = (error) => {
+      console.error("Trial session error:", error);
+    };
+    sessionRef.current = session;
+
+    return () => {
+      sessionRef.current = null;
+      if (session.readyState === WebSocket.OPEN) {
+        // The server stores the remaining results and closes the session
+        session.send(JSON.stringify({ type: "end" }));
+      } else {
+        session.close();
+      }
+    };
   }, [testId]);
 
   const handleKeyPress = (event) => {
@@ -1,68 +1,73 @@
 "use client";
 
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useMemo, useRef } from "react";
 import { useParams } from "react-router-dom";
 import "../css/TestVisualization.css";
+import { decodeSurface, drawSurface, thresholdProfile } from "../surface";
 
 function TestVisualization() {
   const { testId } = useParams();
-  const [plotData, setPlotData] = useState([]);
-  const [plotImage, setPlotImage] = useState(null);
+  const [surface, setSurface] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [showRectangles, setShowRectangles] = useState(false);
   const [stepValue, setStepValue] = useState("10"); // new state for step size
   const [thresholdValue, setThresholdValue] = useState("0.75"); // new state for threshold line
+  const canvasRef = useRef(null);
 
-  const fetchPlotData = async (showRects) => {
+  // The smoothed grid is fetched once; thresholds and overlays are drawn here
+  const fetchSurface = async () => {
     try {
       setLoading(true);
-      let url = `http://localhost:8000/api/tests/${testId}/plot?show_rectangles=${showRects}`;
-      if (stepValue && !isNaN(stepValue)) {
-        url += `&step=${stepValue}`;
-      }
-      if (thresholdValue && !isNaN(thresholdValue)) {
-        url += `&threshold=${thresholdValue}`;
-      }
-      const response = await fetch(url);
+      const response = await fetch(
+        `http://localhost:8000/api/tests/${testId}/surface`
+      );
       if (!response.ok) {
         throw new Error("Failed to fetch plot data");
       }
-      const data = await response.json();
-      setPlotData(data.plot_data);
-      setPlotImage(`data:image/png;base64,${data.image}`);
+      setSurface(decodeSurface(await response.arrayBuffer()));
       setError(null);
     } catch (err) {
       setError(err.message);
-      setPlotData([]);
-      setPlotImage(null);
+      setSurface(null);
     } finally {
       setLoading(false);
     }
   };
 
   useEffect(() => {
-    fetchPlotData(showRectangles);
-  }, [testId, showRectangles, stepValue, thresholdValue]);
+    fetchSurface();
+  }, [testId]);
+
+  const threshold = parseFloat(thresholdValue);
+  const step = parseFloat(stepValue);
+
+  useEffect(() => {
+    if (!surface || !canvasRef.current) return;
+    drawSurface(canvasRef.current, surface, {
+      threshold,
+      showRectangles,
+      showSamples: true,
+    });
+  }, [surface, showRectangles, threshold, loading]);
+
+  const plotData = useMemo(() => {
+    if (!surface || !(step > 0) || Number.isNaN(threshold)) return [];
+    return thresholdProfile(surface, step, threshold);
+  }, [surface, step, threshold]);
 
   const handleDownloadPlot = () => {
-    if (!plotImage) return;
-    const byteString = atob(plotImage.split(",")[1]);
-    const mimeString = plotImage.split(",")[0].split(":")[1].split(";")[0];
-    const ab = new ArrayBuffer(byteString.length);
-    const ia = new Uint8Array(ab);
-    for (let i = 0; i < byteString.length; i++) {
-      ia[i] = byteString.charCodeAt(i);
-    }
-    const blob = new Blob([ab], { type: mimeString });
-    const url = URL.createObjectURL(blob);
-    const link = document.createElement("a");
-    link.href = url;
-    link.download = `test-${testId}-visualization.png`;
-    document.body.appendChild(link);
-    link.click();
-    document.body.removeChild(link);
-    URL.revokeObjectURL(url);
+    if (!canvasRef.current) return;
+    canvasRef.current.toBlob((blob) => {
+      const url = URL.createObjectURL(blob);
+      const link = document.createElement("a");
+      link.href = url;
+      link.download = `test-${testId}-visualization.png`;
+      document.body.appendChild(link);
+      link.click();
+      document.body.removeChild(link);
+      URL.revokeObjectURL(url);
+    }, "image/png");
   };
 
   const handleDownloadCSV = async () => {
@@ -158,7 +163,7 @@ function TestVisualization() {
             <div className="action-buttons">
               <button
                 className="visualization-btn"
-                onClick={() => fetchPlotData(showRectangles)}
+                onClick={fetchSurface}
                 disabled={loading}
               >
                 {loading ? "Loading..." : "Refresh"}
@@ -170,11 +175,11 @@ function TestVisualization() {
               >
                 Download CSV
               </button>
-              {plotImage && (
+              {surface && (
                 <button
                   className="visualization-btn"
                   onClick={handleDownloadPlot}
-                  disabled={!plotImage}
+                  disabled={!surface}
                 >
                   Download Chart
                 </button>
@@ -192,9 +197,14 @@ function TestVisualization() {
         ) : (
           <>
             <div className="visualization-section">
-              {plotImage && (
+              {surface && (
                 <div className="visualization-image">
-                  <img src={plotImage} alt="Test visualization" />
+                  <canvas
+                    ref={canvasRef}
+                    width={800}
+                    height={640}
+                    aria-label="Test visualization"
+                  />
                 </div>
               )}
             </div>
@@ -0,0 +1,243 @@
+// Decoding and drawing of the binary surface payload of
+// GET /api/tests/{id}/surface; the layout is described in
+// algorithm_to_find_combinations/surface_payload.py
+
+const MAGIC = "TVSF";
+const FORMAT_VERSION = 1;
+const HEADER_SIZE = 56;
+const SCALE = 65535;
+const VMIN = 0.6;
+const VMAX = 1.0;
+const LOWEST_LEVEL = 0.3;
+
+// RdYlGn colour stops, as in the server-side plots
+const RD_YL_GN = [
+  [165, 0, 38],
+  [215, 48, 39],
+  [244, 109, 67],
+  [253, 174, 97],
+  [254, 224, 139],
+  [255, 255, 191],
+  [217, 239, 139],
+  [166, 217, 106],
+  [102, 189, 99],
+  [26, 152, 80],
+  [0, 104, 55],
+];
+
+const halfToFloat = (bits) => {
+  const exponent = (bits >> 10) & 0x1f;
+  const fraction = bits & 0x3ff;
+  const sign = bits & 0x8000 ? -1 : 1;
+  if (exponent === 0) return sign * 2 ** -14 * (fraction / 1024);
+  if (exponent === 0x1f) return fraction ? NaN : sign * Infinity;
+  return sign * 2 ** (exponent - 15) * (1 + fraction / 1024);
+};
+
+const bitAt = (bytes, index) => (bytes[index >> 3] >> (7 - (index & 7))) & 1;
+
+export const decodeSurface = (buffer) => {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(
+    ...new Uint8Array(buffer, 0, MAGIC.length)
+  );
+  if (magic !== MAGIC || view.getUint16(4, true) !== FORMAT_VERSION) {
+    throw new Error("Unknown surface format");
+  }
+  const encoding = view.getUint16(6, true) === 1 ? "u8" : "f16";
+  const width = view.getUint32(8, true);
+  const height = view.getUint32(12, true);
+  const nSamples = view.getUint32(16, true);
+  const nRects = view.getUint32(20, true);
+  const bounds = [0, 1, 2, 3].map((i) => view.getFloat64(24 + i * 8, true));
+  const [tsLo, tsHi, satLo, satHi] = bounds;
+
+  let offset = HEADER_SIZE;
+  const take = (ArrayType, count) => {
+    const array = new ArrayType(buffer, offset, count);
+    offset += array.byteLength;
+    return array;
+  };
+  const x = take(Float32Array, width);
+  const y = take(Float32Array, height);
+  const samplePairs = take(Uint16Array, nSamples * 2);
+  const rectValues = take(Uint16Array, nRects * 4);
+  const zItemSize = encoding === "u8" ? 1 : 2;
+  offset += (zItemSize - (offset % zItemSize)) % zItemSize;
+  const zRaw = take(
+    encoding === "u8" ? Uint8Array : Uint16Array,
+    width * height
+  );
+  const mask = take(Uint8Array, Math.ceil((width * height) / 8));
+  const successBits = take(Uint8Array, Math.ceil(nSamples / 8));
+
+  const z = new Float32Array(width * height);
+  for (let i = 0; i < z.length; i++) {
+    if (!bitAt(mask, i)) z[i] = NaN;
+    else z[i] = encoding === "u8" ? zRaw[i] / 255 : halfToFloat(zRaw[i]);
+  }
+  const ts = (v) => tsLo + (v / SCALE) * (tsHi - tsLo);
+  const sat = (v) => satLo + (v / SCALE) * (satHi - satLo);
+  const samples = [];
+  for (let i = 0; i < nSamples; i++) {
+    samples.push({
+      triangleSize: ts(samplePairs[2 * i]),
+      saturation: sat(samplePairs[2 * i + 1]),
+      success: bitAt(successBits, i),
+    });
+  }
+  const rectangles = [];
+  for (let i = 0; i < nRects; i++) {
+    const r = rectValues.subarray(4 * i, 4 * i + 4);
+    rectangles.push({
+      triangleSize: [ts(r[0]), ts(r[1])],
+      saturation: [sat(r[2]), sat(r[3])],
+    });
+  }
+  return {
+    width,
+    height,
+    x,
+    y,
+    z,
+    samples,
+    rectangles,
+    triangleSizeBounds: [tsLo, tsHi],
+    saturationBounds: [satLo, satHi],
+  };
+};
+
+const colorOf = (value) => {
+  const t = Math.min(Math.max((value - VMIN) / (VMAX - VMIN), 0), 1);
+  const position = t * (RD_YL_GN.length - 1);
+  const i = Math.min(Math.floor(position), RD_YL_GN.length - 2);
+  const f = position - i;
+  // Blended onto white like the server's 0.9 alpha fill
+  return RD_YL_GN[i].map(
+    (c, k) => 0.9 * (c + f * (RD_YL_GN[i + 1][k] - c)) + 0.1 * 255
+  );
+};
+
+// Segments of the level line, one marching-squares cell at a time
+export const contourSegments = (surface, level) => {
+  const { width, height, x, y, z } = surface;
+  const segments = [];
+  const crossing = (i0, j0, i1, j1) => {
+    const a = z[i0 * width + j0];
+    const b = z[i1 * width + j1];
+    if (Number.isNaN(a) || Number.isNaN(b) || a >= level === b >= level) {
+      return null;
+    }
+    const f = (level - a) / (b - a);
+    return [x[j0] + f * (x[j1] - x[j0]), y[i0] + f * (y[i1] - y[i0])];
+  };
+  for (let i = 0; i < height - 1; i++) {
+    for (let j = 0; j < width - 1; j++) {
+      const points = [
+        crossing(i, j, i, j + 1),
+        crossing(i, j + 1, i + 1, j + 1),
+        crossing(i + 1, j + 1, i + 1, j),
+        crossing(i + 1, j, i, j),
+      ].filter(Boolean);
+      for (let k = 0; k + 1 < points.length; k += 2) {
+        segments.push([points[k], points[k + 1]]);
+      }
+    }
+  }
+  return segments;
+};
+
+// Lowest saturation of the threshold line at every step of triangle size,
+// as the plot endpoint's plot_data
+export const thresholdProfile = (surface, step, threshold) => {
+  const points = contourSegments(surface, threshold).flat();
+  const [lo, hi] = surface.triangleSizeBounds;
+  const profile = [];
+  for (let xValue = lo; xValue <= hi + step / 2; xValue += step) {
+    let lowest = Infinity;
+    for (const [px, py] of points) {
+      if (Math.abs(px - xValue) <= step / 2 && py < lowest) lowest = py;
+    }
+    if (lowest !== Infinity) {
+      profile.push({ triangle_size: xValue, saturation: lowest });
+    }
+  }
+  return profile;
+};
+
+export const drawSurface = (canvas, surface, options = {}) => {
+  const { threshold, showRectangles, showSamples } = options;
+  const { width, height, z } = surface;
+  const [tsLo, tsHi] = surface.triangleSizeBounds;
+  const [satLo, satHi] = surface.saturationBounds;
+
+  // Colour the grid at its own resolution, then let the canvas scale it
+  const grid = document.createElement("canvas");
+  grid.width = width;
+  grid.height = height;
+  const gridContext = grid.getContext("2d");
+  const image = gridContext.createImageData(width, height);
+  for (let i = 0; i < height; i++) {
+    // Saturation grows upwards
+    const row = (height - 1 - i) * width;
+    for (let j = 0; j < width; j++) {
+      const value = z[i * width + j];
+      const p = (row + j) * 4;
+      if (!(value >= LOWEST_LEVEL)) continue;
+      const [r, g, b] = colorOf(value);
+      image.data[p] = r;
+      image.data[p + 1] = g;
+      image.data[p + 2] = b;
+      image.data[p + 3] = 255;
+    }
+  }
+  gridContext.putImageData(image, 0, 0);
+
+  const context = canvas.getContext("2d");
+  context.clearRect(0, 0, canvas.width, canvas.height);
+  context.imageSmoothingEnabled = true;
+  context.drawImage(grid, 0, 0, canvas.width, canvas.height);
+
+  const px = (ts) => ((ts - tsLo) / (tsHi - tsLo)) * canvas.width;
+  const py = (sat) =>
+    canvas.height - ((sat - satLo) / (satHi - satLo)) * canvas.height;
+
+  if (showRectangles) {
+    context.strokeStyle = "rgba(0, 0, 255, 0.5)";
+    context.setLineDash([4, 3]);
+    for (const rect of surface.rectangles) {
+      const [x0, x1] = rect.triangleSize.map(px);
+      const [y0, y1] = rect.saturation.map(py);
+      context.strokeRect(x0, y1, x1 - x0, y0 - y1);
+    }
+    context.setLineDash([]);
+  }
+  if (showSamples) {
+    context.strokeStyle = "black";
+    for (const sample of surface.samples) {
+      const [r, g, b] = colorOf(sample.success);
+      context.fillStyle = `rgb(${r}, ${g}, ${b})`;
+      context.beginPath();
+      context.arc(
+        px(sample.triangleSize),
+        py(sample.saturation),
+        3,
+        0,
+        2 * Math.PI
+      );
+      context.fill();
+      context.stroke();
+    }
+  }
+  if (threshold !== undefined && !Number.isNaN(threshold)) {
+    context.strokeStyle = "black";
+    context.lineWidth = 2;
+    context.beginPath();
+    for (const [[x0, y0], [x1, y1]] of contourSegments(surface, threshold)) {
+      context.moveTo(px(x0), py(y0));
+      context.lineTo(px(x1), py(y1));
+    }
+    context.stroke();
+    context.lineWidth = 1;
+  }
+};
@@ -1,17 +1,56 @@
 import os
 import sys
+import time
 from fastapi import FastAPI, Request
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from db.database import engine
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm.exc import StaleDataError
+from crud.test import backfill_rectangle_cells, backfill_state_versions
+from db.database import SessionLocal, add_missing_columns, add_missing_indexes, engine
 from models.test import Base
-from routers import test_router, test_combination_router
+from routers import (
+    admin_router,
+    frontend_router,
+    metrics_router,
+    test_combination_router,
+    test_router,
+)
 from fastapi.middleware.cors import CORSMiddleware
+from observability.metrics import observe_request
+from observability.queries import (
+    QUERIES_PER_REQUEST,
+    check_query_budget,
+    count_queries,
+    debug_headers_enabled,
+)
 
 # Initialize the database
 Base.metadata.create_all(bind=engine)
+add_missing_columns(engine, Base.metadata)
+with SessionLocal() as db:
+    backfill_rectangle_cells(db)
+    backfill_state_versions(db)
+add_missing_indexes(engine, Base.metadata)
+
+try:
+    import orjson
+except ImportError:  # optional; the standard json module is used instead
+    orjson = None
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when it is installed"""
 
-app = FastAPI()
+    def render(self, content) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(
+            content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
+
+
+app = FastAPI(default_response_class=FastJSONResponse)
+
+API_PREFIX = "/api"
 
 # CORS configuration
 origins = ["http://localhost:3000", "http://localhost:8000", "http://127.0.0.1:8000"]
@@ -24,9 +63,67 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    with count_queries() as queries:
+        # Streaming endpoints count the statements of their body on it
+        request.state.query_counter = queries
+        response = await call_next(request)
+    route = _route_template(request)
+    observe_request(
+        request.method, route, response.status_code, time.perf_counter() - start
+    )
+    if "route" in request.scope:
+        check_query_budget(request.scope["route"].endpoint, route, queries)
+        response.body_iterator = _observe_queries_after(
+            response.body_iterator, queries, route
+        )
+    if debug_headers_enabled():
+        response.headers["X-Query-Count"] = str(queries.count)
+    return response
+
+
+async def _observe_queries_after(body, queries, route):
+    """Pass ``body`` through, then record the request's statements, including
+    those a streamed body executed"""
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        QUERIES_PER_REQUEST.observe(queries.count, route=route)
+
+
+@app.exception_handler(StaleDataError)
+async def state_conflict(request: Request, exc: StaleDataError):
+    # Another worker kept changing the test's state while this request retried
+    return JSONResponse(
+        status_code=409,
+        content={"detail": "Test state changed concurrently; try again"},
+    )
+
+
+def _route_template(request: Request) -> str:
+    """Label requests by route template so every test id shares one series"""
+    route = request.scope.get("route")
+    if route is None:
+        return "unmatched"
+    path = route.path
+    # Depending on the FastAPI version, routes of included routers report
+    # their path with or without the include prefix
+    if request.url.path.startswith(API_PREFIX + "/") and not path.startswith(
+        API_PREFIX + "/"
+    ):
+        path = API_PREFIX + path
+    return path
+
+
 # First, mount the API routes with a prefix
-app.include_router(test_router.router, prefix="/api")
-app.include_router(test_combination_router.router, prefix="/api")
+app.include_router(test_router.router, prefix=API_PREFIX)
+app.include_router(test_combination_router.router, prefix=API_PREFIX)
+app.include_router(metrics_router.router, prefix=API_PREFIX)
+app.include_router(admin_router.router, prefix=API_PREFIX)
 
 # Determine the absolute path to the frontend build
 if getattr(sys, "frozen", False):
@@ -38,16 +135,6 @@ else:
 
 frontend_build_dir = os.path.join(base_path, "frontend", "build")
 
-# Serve static files from the build directory
-app.mount(
-    "/static",
-    StaticFiles(directory=os.path.join(frontend_build_dir, "static")),
-    name="static",
-)
-
-
-@app.get("/{full_path:path}")
-async def serve_react(full_path: str):
-    if full_path.startswith("api/"):
-        return {"detail": "Not Found"}
-    return FileResponse(os.path.join(frontend_build_dir, "index.html"))
+# Serve the built frontend for every other path; it must be included last
+frontend_router.load_frontend(frontend_build_dir)
+app.include_router(frontend_router.router)
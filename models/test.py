@@ -1,9 +1,19 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Integer,
+    String,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    LargeBinary,
+)
+from sqlalchemy.orm import deferred, relationship
 from datetime import datetime
 from pydantic import BaseModel, ConfigDict
 from db.database import Base
-from typing import Literal
+from typing import Literal, Optional
 
 
 class Test(Base):
@@ -17,20 +27,33 @@ class Test(Base):
     min_saturation = Column(Float)
     max_saturation = Column(Float)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Packed copy of the rectangles (see algorithm_to_find_combinations.
+    # state_snapshot), kept in step with them; deferred so listing tests does
+    # not read it
+    state_snapshot = deferred(Column(LargeBinary, nullable=True))
+    # Bumped by every UPDATE of the row and checked against the value read, so
+    # concurrent writers of a test's state fail instead of overwriting each
+    # other (see db.concurrency)
+    state_version = Column(Integer, nullable=True)
     rectangles = relationship("Rectangle", back_populates="test")
     combinations = relationship("TestCombination", back_populates="test")
 
+    __mapper_args__ = {"version_id_col": state_version}
+
 
 class Rectangle(Base):
+    """A quadtree cell of a test's bounds (see algorithm_to_find_combinations.
+    quadtree); its bounds and area follow from depth, morton and the test"""
+
     __tablename__ = "rectangles"
+    __table_args__ = (
+        Index("ix_rectangles_test_cell", "test_id", "depth", "morton", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     test_id = Column(Integer, ForeignKey("tests.id"))
-    min_triangle_size = Column(Float)
-    max_triangle_size = Column(Float)
-    min_saturation = Column(Float)
-    max_saturation = Column(Float)
-    area = Column(Float)
+    depth = Column(Integer)
+    morton = Column(BigInteger)
     true_samples = Column(Integer, default=0)
     false_samples = Column(Integer, default=0)
 
@@ -54,6 +77,23 @@ class TestCombination(Base):
     test = relationship("Test", back_populates="combinations")
 
 
+class StateCheckpoint(Base):
+    """Algorithm state after the first ``trial_count`` results of a test"""
+
+    __tablename__ = "state_checkpoints"
+    __table_args__ = (
+        Index("ix_state_checkpoints_test_trials", "test_id", "trial_count"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    test_id = Column(Integer, ForeignKey("tests.id"))
+    trial_count = Column(Integer)
+    # Last TestCombination included; replays continue after it
+    last_combination_id = Column(Integer)
+    snapshot = Column(LargeBinary)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
 class TestBase(BaseModel):
     title: str
     description: str
@@ -79,11 +119,8 @@ class TestResponse(TestBase):
 
 
 class RectangleBase(BaseModel):
-    min_triangle_size: float
-    max_triangle_size: float
-    min_saturation: float
-    max_saturation: float
-    area: float
+    depth: int
+    morton: int
     true_samples: int
     false_samples: int
 
@@ -117,5 +154,7 @@ class TestCombinationCreate(TestCombinationBase):
 class TestCombinationResponse(TestCombinationBase):
     id: int
     created_at: datetime
+    # None once a bounds change leaves the combination outside every rectangle
+    rectangle_id: Optional[int] = None
 
     model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,18 @@
+"""Access control for operator-only diagnostics."""
+
+import hmac
+import os
+
+ADMIN_TOKEN_ENV = "TRIANGLE_VISION_ADMIN_TOKEN"
+
+
+def admin_token():
+    """The configured admin token, or None when admin access is disabled"""
+    return os.environ.get(ADMIN_TOKEN_ENV) or None
+
+
+def is_admin_token(value):
+    token = admin_token()
+    if token is None or not value:
+        return False
+    return hmac.compare_digest(value.encode(), token.encode())
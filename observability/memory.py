@@ -0,0 +1,205 @@
+"""Memory accounting for caches, analysis buffers and individual requests.
+
+Caches are bounded by bytes rather than entries: ``ByteBudgetCache`` evicts
+least recently used entries once their estimated size exceeds the budget,
+which ``TRIANGLE_VISION_CACHE_BYTES_<NAME>`` overrides per cache. Every cache
+registers itself so the admin endpoint can report its size.
+
+Peak allocations are measured with tracemalloc, which is off by default
+because it slows every allocation. Start it from the admin endpoint, with
+``PYTHONTRACEMALLOC=1``, or for a single request with the profiler's
+``memory`` mode (see ``observability.profiling``).
+"""
+
+import os
+import sys
+import threading
+import tracemalloc
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from algorithm_to_find_combinations import plotting
+
+CACHE_BYTES_ENV_PREFIX = "TRIANGLE_VISION_CACHE_BYTES_"
+SNAPSHOTS_PER_ENDPOINT = 5
+
+_caches = {}
+_caches_lock = threading.Lock()
+_endpoint_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def sizeof(value):
+    """Approximate bytes held by a cached value, counting array buffers"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes + sys.getsizeof(np.empty(0))
+    if isinstance(value, (bytes, bytearray, str)):
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            sizeof(k) + sizeof(v) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+def cache_budget(name, default):
+    value = os.environ.get(CACHE_BYTES_ENV_PREFIX + name.upper().replace("-", "_"))
+    return int(value) if value else default
+
+
+class ByteBudgetCache:
+    """Thread-safe LRU cache holding at most ``max_bytes`` of values"""
+
+    def __init__(self, name, max_bytes, sizeof=sizeof):
+        self.name = name
+        self.max_bytes = cache_budget(name, max_bytes)
+        self._sizeof = sizeof
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with _caches_lock:
+            _caches[name] = self
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key, default=None):
+        """Like ``get``, without refreshing recency or counting a hit or miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return default if entry is None else entry[0]
+
+    def put(self, key, value):
+        size = self._sizeof(value)
+        with self._lock:
+            self._remove(key)
+            # A value larger than the whole budget would only evict everything
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def pop_matching(self, predicate):
+        """Remove every entry whose key satisfies ``predicate``"""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def cache_stats():
+    with _caches_lock:
+        caches = list(_caches.values())
+    return {cache.name: cache.stats() for cache in caches}
+
+
+def record_endpoint_snapshot(endpoint, before, after, peak_bytes, limit=25):
+    """Keep the allocation diff of one request to ``endpoint``"""
+    differences = after.compare_to(before, "lineno")
+    record = {
+        "peak_bytes": peak_bytes,
+        "net_bytes": sum(stat.size_diff for stat in differences),
+        "top": [
+            {
+                "location": str(stat.traceback[0]),
+                "size_diff": stat.size_diff,
+                "count_diff": stat.count_diff,
+            }
+            for stat in differences[:limit]
+        ],
+    }
+    with _snapshots_lock:
+        _endpoint_snapshots.setdefault(
+            endpoint, deque(maxlen=SNAPSHOTS_PER_ENDPOINT)
+        ).append(record)
+    return record
+
+
+def endpoint_snapshots():
+    with _snapshots_lock:
+        return {name: list(records) for name, records in _endpoint_snapshots.items()}
+
+
+def top_allocations(limit=25):
+    """Largest live allocations by source line, if tracemalloc is tracing"""
+    if not tracemalloc.is_tracing():
+        return []
+    statistics = tracemalloc.take_snapshot().statistics("lineno")
+    return [
+        {"location": str(stat.traceback[0]), "size": stat.size, "count": stat.count}
+        for stat in statistics[:limit]
+    ]
+
+
+def _max_rss_bytes():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def memory_report():
+    tracing = tracemalloc.is_tracing()
+    current, peak = tracemalloc.get_traced_memory() if tracing else (None, None)
+    return {
+        "max_rss_bytes": _max_rss_bytes(),
+        "tracemalloc": {
+            "tracing": tracing,
+            "current_bytes": current,
+            "peak_bytes": peak,
+        },
+        "caches": cache_stats(),
+        "smoothing_peaks": plotting.allocation_stats(),
+        "endpoints": endpoint_snapshots(),
+    }
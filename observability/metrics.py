@@ -0,0 +1,195 @@
+"""In-process metrics rendered in the Prometheus text exposition format."""
+
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers sub-millisecond stages up to slow plot renders
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        return self._values.get(key, 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # label values -> [bucket counts..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        state = self._values.get(key)
+        return state[-1] if state else 0
+
+    def sum(self, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        state = self._values.get(key)
+        return state[-2] if state else 0.0
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        lines = []
+        for key, state in items:
+            for bound, bucket_count in zip(self.buckets, state):
+                labels = _format_labels(
+                    self.label_names, key, [("le", _format_value(bound))]
+                )
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, label_names=()):
+        return self._register(Counter(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_DURATION = REGISTRY.histogram(
+    "triangle_vision_http_request_duration_seconds",
+    "Time from receiving a request to sending its response headers.",
+    ("method", "route", "status"),
+)
+REQUESTS = REGISTRY.counter(
+    "triangle_vision_http_requests_total",
+    "Handled HTTP requests.",
+    ("method", "route", "status"),
+)
+STAGE_DURATION = REGISTRY.histogram(
+    "triangle_vision_stage_duration_seconds",
+    "Time spent in each stage of the trial and plot handlers.",
+    ("stage",),
+)
+RECTANGLE_SPLITS = REGISTRY.counter(
+    "triangle_vision_rectangle_splits_total",
+    "Rectangles split into quadrants by the adaptive sampler.",
+)
+STATE_CONFLICTS = REGISTRY.counter(
+    "triangle_vision_state_conflicts_total",
+    "Test state updates retried because another worker changed the state first.",
+)
+TRIAL_RESULTS = REGISTRY.counter(
+    "triangle_vision_trial_results_total",
+    "Submitted trial results.",
+    ("success",),
+)
+
+
+def observe_request(method, route, status, seconds):
+    REQUEST_DURATION.observe(seconds, method=method, route=route, status=status)
+    REQUESTS.inc(method=method, route=route, status=status)
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as one stage of a request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage=name)
@@ -0,0 +1,260 @@
+"""Opt-in profiling of individual API requests.
+
+A request is profiled when ``TRIANGLE_VISION_PROFILE`` is set to ``1`` (every
+request on a profiled router) or when it carries an ``X-Profile`` header equal
+to the admin token. ``X-Profile-Mode`` or ``TRIANGLE_VISION_PROFILE_MODE``
+chooses between:
+
+* ``sample``: a background thread samples the handler's stack and writes
+  collapsed stacks (``frame;frame;frame count``) that flamegraph.pl,
+  speedscope and similar tools read directly;
+* ``cprofile``: deterministic profiling written as a ``.pstats`` file;
+* ``memory``: a tracemalloc snapshot diff of the request, written as text and
+  kept for the admin memory report.
+
+Files go to ``TRIANGLE_VISION_PROFILE_DIR``; the oldest are deleted once the
+directory holds more than ``TRIANGLE_VISION_PROFILE_MAX_FILES`` files or
+``TRIANGLE_VISION_PROFILE_MAX_BYTES`` bytes. The response names the file in
+an ``X-Profile-File`` header.
+"""
+
+import asyncio
+import cProfile
+import functools
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+from fastapi.routing import APIRoute
+
+from algorithm_to_find_combinations.plotting import peak_measurement
+from observability.admin import is_admin_token
+from observability.memory import record_endpoint_snapshot
+
+PROFILE_ENV = "TRIANGLE_VISION_PROFILE"
+MODE_ENV = "TRIANGLE_VISION_PROFILE_MODE"
+DIR_ENV = "TRIANGLE_VISION_PROFILE_DIR"
+MAX_FILES_ENV = "TRIANGLE_VISION_PROFILE_MAX_FILES"
+MAX_BYTES_ENV = "TRIANGLE_VISION_PROFILE_MAX_BYTES"
+INTERVAL_ENV = "TRIANGLE_VISION_PROFILE_INTERVAL"
+
+MODES = ("sample", "cprofile", "memory")
+PROFILE_EXTENSIONS = (".collapsed", ".pstats", ".memory.txt")
+
+_active_profile = ContextVar("active_profile", default=None)
+
+
+class ProfileRequest:
+    """Profiling settings of one request, filled in with the output file"""
+
+    def __init__(self, mode, name):
+        self.mode = mode
+        self.name = name
+        self.path = None
+
+
+def profile_directory():
+    return os.environ.get(DIR_ENV, "profiles")
+
+
+def requested_mode(request):
+    """Profiling mode for this request, or None if it is not profiled"""
+    enabled = os.environ.get(PROFILE_ENV, "").lower() in ("1", "true", "yes")
+    if not enabled and not is_admin_token(request.headers.get("x-profile")):
+        return None
+    mode = request.headers.get("x-profile-mode") or os.environ.get(MODE_ENV, "sample")
+    return mode if mode in MODES else "sample"
+
+
+class StackSampler:
+    """Sample the stack of one thread at a fixed interval"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[_collapse(frame)] += 1
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _collapse(frame):
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.basename(code.co_filename)
+        frames.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    # Root first; spaces and semicolons separate fields in the collapsed format
+    return ";".join(reversed(frames)).replace(" ", "_")
+
+
+def _output_path(profile, extension):
+    directory = profile_directory()
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    return os.path.join(directory, f"{stamp}-{profile.name}-{os.getpid()}{extension}")
+
+
+def enforce_retention(directory=None):
+    """Delete the oldest profiles beyond the configured file and byte limits"""
+    directory = directory or profile_directory()
+    max_files = int(os.environ.get(MAX_FILES_ENV, 50))
+    max_bytes = int(os.environ.get(MAX_BYTES_ENV, 50 * 2**20))
+    try:
+        entries = [
+            entry
+            for entry in os.scandir(directory)
+            if entry.is_file() and entry.name.endswith(PROFILE_EXTENSIONS)
+        ]
+    except FileNotFoundError:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    kept_bytes = 0
+    for index, entry in enumerate(entries):
+        kept_bytes += entry.stat().st_size
+        if index >= max_files or kept_bytes > max_bytes:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+@contextmanager
+def _profiling(profile):
+    """Profile the current thread while the block runs and write the result"""
+    if profile.mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profile.path = _output_path(profile, ".pstats")
+            profiler.dump_stats(profile.path)
+            enforce_retention()
+        return
+    if profile.mode == "memory":
+        with _tracing_memory() as snapshots:
+            yield
+        profile.path = _output_path(profile, ".memory.txt")
+        record = record_endpoint_snapshot(profile.name, *snapshots)
+        _write_memory_record(record, profile.path)
+        enforce_retention()
+        return
+    interval = float(os.environ.get(INTERVAL_ENV, 0.001))
+    with StackSampler(threading.get_ident(), interval) as sampler:
+        yield
+    profile.path = _output_path(profile, ".collapsed")
+    sampler.write(profile.path)
+    enforce_retention()
+
+
+@contextmanager
+def _tracing_memory():
+    """Yield a list filled with (before, after, peak bytes) once the block ends"""
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    snapshots = []
+    try:
+        # Keep tracked smoothing calls from resetting this request's peak
+        with peak_measurement():
+            before = tracemalloc.take_snapshot()
+            start, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            yield snapshots
+            _, peak = tracemalloc.get_traced_memory()
+        snapshots.extend([before, tracemalloc.take_snapshot(), peak - start])
+    finally:
+        if started:
+            tracemalloc.stop()
+
+
+def _write_memory_record(record, path):
+    with open(path, "w") as f:
+        f.write(f"peak {record['peak_bytes']} bytes\n")
+        f.write(f"net {record['net_bytes']} bytes\n")
+        for stat in record["top"]:
+            f.write(
+                f"{stat['size_diff']:>12} B {stat['count_diff']:>8} blocks "
+                f"{stat['location']}\n"
+            )
+
+
+def profiled(endpoint):
+    """Wrap an endpoint so it runs under the profiler its request asked for.
+
+    The wrapper runs where the endpoint runs (the worker thread for sync
+    endpoints), so the profile covers the handler rather than the event loop.
+    """
+    if asyncio.iscoroutinefunction(endpoint):
+
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            profile = _active_profile.get()
+            if profile is None:
+                return await endpoint(*args, **kwargs)
+            with _profiling(profile):
+                return await endpoint(*args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        profile = _active_profile.get()
+        if profile is None:
+            return endpoint(*args, **kwargs)
+        with _profiling(profile):
+            return endpoint(*args, **kwargs)
+
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """Route class that profiles requests which opt in"""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, profiled(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request):
+            mode = requested_mode(request)
+            if mode is None:
+                return await handler(request)
+            profile = ProfileRequest(mode, self.name)
+            token = _active_profile.set(profile)
+            try:
+                response = await handler(request)
+            finally:
+                _active_profile.reset(token)
+            if profile.path:
+                response.headers["X-Profile-File"] = os.path.basename(profile.path)
+            return response
+
+        return profiled_handler
@@ -0,0 +1,122 @@
+"""Per-request SQL statement counting and query budgets.
+
+Every statement executed through any SQLAlchemy engine is counted against the
+``QueryCounter`` active in the current context. The HTTP middleware opens a
+counter per request; because contextvars are copied into the threadpool,
+statements issued from sync endpoints land on the request's counter too.
+
+Endpoints declare how many statements they may issue with ``query_budget``.
+Exceeding it logs a warning and increments a metric, and raises
+``QueryBudgetExceeded`` when ``TRIANGLE_VISION_QUERY_BUDGET_STRICT`` is set,
+which the test suite does so that regressions fail the tests.
+"""
+
+import logging
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from observability.metrics import REGISTRY
+
+STRICT_ENV = "TRIANGLE_VISION_QUERY_BUDGET_STRICT"
+DEBUG_HEADERS_ENV = "TRIANGLE_VISION_DEBUG_HEADERS"
+
+logger = logging.getLogger(__name__)
+
+QUERIES_PER_REQUEST = REGISTRY.histogram(
+    "triangle_vision_http_request_queries",
+    "SQL statements executed while handling a request.",
+    ("route",),
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, 233),
+)
+QUERY_BUDGET_EXCEEDED = REGISTRY.counter(
+    "triangle_vision_query_budget_exceeded_total",
+    "Requests that executed more SQL statements than their route's budget.",
+    ("route",),
+)
+
+_current_counter = ContextVar("current_query_counter", default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter:
+    """Statements executed while the counter is active"""
+
+    def __init__(self, record_statements=False):
+        self.count = 0
+        self.record_statements = record_statements
+        self.statements = []
+
+    def record(self, statement):
+        self.count += 1
+        if self.record_statements:
+            self.statements.append(statement)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    counter = _current_counter.get()
+    if counter is not None:
+        counter.record(statement)
+
+
+@contextmanager
+def count_queries(record_statements=False):
+    """Count the statements executed in this context while the block runs"""
+    counter = QueryCounter(record_statements)
+    token = _current_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _current_counter.reset(token)
+
+
+def count_iteration(iterable, counter):
+    """Yield from ``iterable`` with ``counter`` active while each item is made.
+
+    A streaming response's body is produced after its endpoint has returned,
+    one item at a time and not always in the same thread, so a
+    ``count_queries`` block cannot span it.
+    """
+    iterator = iter(iterable)
+    while True:
+        token = _current_counter.set(counter)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _current_counter.reset(token)
+        yield item
+
+
+def query_budget(max_queries):
+    """Declare the most SQL statements one call of an endpoint may execute"""
+
+    def decorator(endpoint):
+        endpoint.query_budget = max_queries
+        return endpoint
+
+    return decorator
+
+
+def debug_headers_enabled():
+    return os.environ.get(DEBUG_HEADERS_ENV, "").lower() in ("1", "true", "yes")
+
+
+def check_query_budget(endpoint, route, counter):
+    """Report a request whose endpoint executed more statements than allowed"""
+    budget = getattr(endpoint, "query_budget", None)
+    if budget is None or counter.count <= budget:
+        return
+    QUERY_BUDGET_EXCEEDED.inc(route=route)
+    message = f"{route} executed {counter.count} SQL statements (budget {budget})"
+    if os.environ.get(STRICT_ENV, "").lower() in ("1", "true", "yes"):
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
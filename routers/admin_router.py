@@ -0,0 +1,44 @@
+import tracemalloc
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from pydantic import BaseModel
+from observability.admin import is_admin_token
+from observability.memory import memory_report, top_allocations
+
+
+def require_admin(x_admin_token: str = Header(default=None)):
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+router = APIRouter(
+    prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin)]
+)
+
+
+class TracingSettings(BaseModel):
+    enabled: bool
+    frames: int = 1
+
+
+@router.get("/memory")
+def read_memory_report(top: int = 0):
+    """Cache sizes, smoothing peaks and recent per-endpoint snapshots.
+
+    With ``top`` set, also lists the largest live allocations by source line
+    (requires tracemalloc to be tracing).
+    """
+    report = memory_report()
+    if top:
+        report["top_allocations"] = top_allocations(top)
+    return report
+
+
+@router.put("/memory/tracing")
+def set_memory_tracing(settings: TracingSettings):
+    """Start or stop tracemalloc for the whole process"""
+    if settings.enabled and not tracemalloc.is_tracing():
+        tracemalloc.start(settings.frames)
+    elif not settings.enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return {"tracing": tracemalloc.is_tracing()}
@@ -0,0 +1,166 @@
+"""Serves the built frontend from memory.
+
+Every file of ``frontend/build`` is read once at startup together with gzip
+and, if the ``brotli`` package is installed, brotli variants. Variants written
+next to a file at build time (``main.js.gz``, ``main.js.br``; see ``main``
+below) are used as they are, otherwise they are compressed on load. Responses
+carry an ETag per variant and honour If-None-Match. Files whose names contain
+a content hash never change and may be cached for a year; everything else,
+including the ``index.html`` shell returned for client-side routes, is
+revalidated on each use.
+
+Run ``python -m routers.frontend_router frontend/build`` after ``yarn build``
+to precompress the build.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import brotli
+except ImportError:  # optional; gzip only
+    brotli = None
+
+SHELL = "index.html"
+# Create React App names built assets like main.1a2b3c4d.js
+HASHED_NAME = re.compile(r"\.[0-9a-f]{8,}\.")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+COMPRESSIBLE = {".html", ".js", ".css", ".json", ".svg", ".txt", ".ico", ".map"}
+MIN_COMPRESS_BYTES = 256
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+router = APIRouter(include_in_schema=False)
+
+_assets = {}
+
+
+class Asset:
+    def __init__(self, body, media_type, cache_control, variants):
+        self.body = body
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.variants = variants  # content coding -> compressed body
+        self.etag = hashlib.sha1(body).hexdigest()[:20]
+
+
+def _compress(encoding, body):
+    if encoding == "gzip":
+        # A fixed mtime keeps the output, and so its ETag, stable
+        return gzip.compress(body, compresslevel=9, mtime=0)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(body)
+    return None
+
+
+def _variants(path, body):
+    variants = {}
+    compressible = (
+        os.path.splitext(path)[1] in COMPRESSIBLE and len(body) >= MIN_COMPRESS_BYTES
+    )
+    for encoding, suffix in ENCODINGS:
+        if os.path.exists(path + suffix):
+            with open(path + suffix, "rb") as f:
+                variants[encoding] = f.read()
+        elif compressible:
+            compressed = _compress(encoding, body)
+            if compressed is not None and len(compressed) < len(body):
+                variants[encoding] = compressed
+    return variants
+
+
+def load_assets(build_dir):
+    """Asset of every file of the build, by URL path relative to the root"""
+    assets = {}
+    for root, _, files in os.walk(build_dir):
+        for name in files:
+            if name.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                body = f.read()
+            url_path = os.path.relpath(path, build_dir).replace(os.sep, "/")
+            media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            cache_control = IMMUTABLE if HASHED_NAME.search(name) else REVALIDATE
+            assets[url_path] = Asset(
+                body, media_type, cache_control, _variants(path, body)
+            )
+    return assets
+
+
+def load_frontend(build_dir):
+    """Serve ``build_dir``; a missing build leaves only the API available"""
+    _assets.clear()
+    if os.path.isdir(build_dir):
+        _assets.update(load_assets(build_dir))
+
+
+def _accepted_encoding(request: Request, asset: Asset):
+    accepted = {}
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    for encoding, _ in ENCODINGS:
+        if encoding in asset.variants and accepted.get(encoding, 0) > 0:
+            return encoding
+    return None
+
+
+def asset_response(request: Request, asset: Asset):
+    encoding = _accepted_encoding(request, asset)
+    etag = f'"{asset.etag}-{encoding}"' if encoding else f'"{asset.etag}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": asset.cache_control,
+        "Vary": "Accept-Encoding",
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    body = asset.variants[encoding] if encoding else asset.body
+    return Response(body, media_type=asset.media_type, headers=headers)
+
+
+@router.api_route("/{full_path:path}", methods=["GET", "HEAD"])
+def serve_frontend(full_path: str, request: Request):
+    if full_path.startswith("api/"):
+        return JSONResponse({"detail": "Not Found"}, status_code=404)
+    asset = _assets.get(full_path)
+    if asset is None:
+        if full_path.startswith("static/") or SHELL not in _assets:
+            return JSONResponse({"detail": "Not Found"}, status_code=404)
+        # Client-side routes all load the shell
+        asset = _assets[SHELL]
+    return asset_response(request, asset)
+
+
+def main(build_dir):
+    """Write compressed variants next to the build's files"""
+    written = 0
+    for url_path, asset in load_assets(build_dir).items():
+        path = os.path.join(build_dir, url_path)
+        for encoding, suffix in ENCODINGS:
+            if encoding in asset.variants and not os.path.exists(path + suffix):
+                with open(path + suffix, "wb") as f:
+                    f.write(asset.variants[encoding])
+                written += 1
+    print(f"wrote {written} compressed files")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else os.path.join("frontend", "build"))
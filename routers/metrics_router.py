@@ -0,0 +1,27 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from db.database import get_db
+from observability.metrics import REGISTRY
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    """Request and stage timings in the Prometheus text format"""
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@router.get("/ready")
+def read_readiness(db: Session = Depends(get_db)):
+    """200 once the app is imported and its database answers, 503 otherwise"""
+    try:
+        db.execute(text("SELECT 1"))
+    except SQLAlchemyError:
+        return JSONResponse({"status": "unavailable"}, status_code=503)
+    return {"status": "ready"}
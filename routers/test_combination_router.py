@@ -1,8 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+import asyncio
+import os
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, undefer
 from typing import List, Dict, Literal
 from pydantic import BaseModel
-from db.database import get_db
+from db.concurrency import run_with_state_retry
+from db.database import SessionLocal, get_db
+from crud.checkpoints import add_checkpoint, checkpoint_due
+from crud.combinations import (
+    COMBINATION_COLUMNS,
+    COMBINATION_FIELDS,
+    combination_rows,
+    iter_combination_rows,
+)
+from crud.test import assign_combinations_to_rectangles
 import random
 from models.test import (
     TestCombination,
@@ -14,18 +37,31 @@ from models.test import (
 )
 from algorithm_to_find_combinations.algorithm import (
     AlgorithmState,
+    find_rectangle,
     get_next_combination,
+    replay_results,
     update_state,
 )
-from crud.test import get_test
-from fastapi.responses import StreamingResponse
+from algorithm_to_find_combinations.quadtree import cell_area, cell_bounds
+from algorithm_to_find_combinations.state_snapshot import decode_state, encode_state
+from algorithm_to_find_combinations.trial_queue import queue_depth, trial_queues
+from observability.metrics import RECTANGLE_SPLITS, TRIAL_RESULTS, stage
+from observability.profiling import ProfiledRoute
+from observability.queries import count_iteration, query_budget
+from fastapi.responses import JSONResponse, StreamingResponse
 import csv
+import json
 from io import StringIO
 
-router = APIRouter(prefix="/test-combinations", tags=["test-combinations"])
+router = APIRouter(
+    prefix="/test-combinations", tags=["test-combinations"], route_class=ProfiledRoute
+)
 
 orientations = ["N", "E", "S", "W"]
 
+SESSION_BATCH_ENV = "TRIANGLE_VISION_SESSION_BATCH"
+SESSION_FLUSH_SECONDS_ENV = "TRIANGLE_VISION_SESSION_FLUSH_SECONDS"
+
 
 def _validate_orientation(orientation: str) -> str:
     """Validate and normalize orientation value"""
@@ -34,27 +70,47 @@ def _validate_orientation(orientation: str) -> str:
     return normalized if normalized in valid_orientations else "N"
 
 
+def _combination_dict(row):
+    """Response fields of a combination row, as TestCombinationResponse
+    would serialise them but without validating each row"""
+    combination = dict(zip(COMBINATION_FIELDS, row))
+    combination["orientation"] = _validate_orientation(combination["orientation"])
+    combination["created_at"] = combination["created_at"].isoformat()
+    return combination
+
+
+def _combination_page(rows, limit):
+    response = JSONResponse([_combination_dict(row) for row in rows])
+    if limit is not None and len(rows) == limit:
+        # Pass as ?after= to get the next page
+        response.headers["X-Next-After"] = str(rows[-1][0])
+    return response
+
+
 @router.get("/", response_model=List[TestCombinationResponse])
+@query_budget(1)
 def read_test_combinations(
-    skip: int = 0, limit: int = 100, db: Session = Depends(get_db)
+    skip: int = 0,
+    limit: int = 100,
+    after: int = Query(None, description="id of the last combination seen"),
+    db: Session = Depends(get_db),
 ):
-    combinations = db.query(TestCombination).offset(skip).limit(limit).all()
-    return [
-        TestCombinationResponse(
-            id=c.id,
-            test_id=c.test_id,
-            rectangle_id=c.rectangle_id,
-            triangle_size=c.triangle_size,
-            saturation=c.saturation,
-            orientation=_validate_orientation(c.orientation),
-            success=c.success,
-            created_at=c.created_at,
-        )
-        for c in combinations
-    ]
+    """Combinations in id order; page with ``after`` rather than ``skip``"""
+    if skip:
+        # Offset paging is kept for existing clients; it scans skipped rows
+        rows = db.execute(
+            select(*COMBINATION_COLUMNS)
+            .order_by(TestCombination.id)
+            .offset(skip)
+            .limit(limit)
+        ).all()
+    else:
+        rows = combination_rows(db, after=after, limit=limit)
+    return _combination_page(rows, limit)
 
 
 @router.get("/{combination_id}", response_model=TestCombinationResponse)
+@query_budget(1)
 def read_test_combination(combination_id: int, db: Session = Depends(get_db)):
     db_combination = (
         db.query(TestCombination).filter(TestCombination.id == combination_id).first()
@@ -74,33 +130,60 @@ def read_test_combination(combination_id: int, db: Session = Depends(get_db)):
 
 
 @router.get("/test/{test_id}", response_model=List[TestCombinationResponse])
-def read_test_combinations_by_test(test_id: int, db: Session = Depends(get_db)):
-    combinations = (
-        db.query(TestCombination).filter(TestCombination.test_id == test_id).all()
+@query_budget(1)
+def read_test_combinations_by_test(
+    test_id: int,
+    after: int = Query(None, description="id of the last combination seen"),
+    limit: int = Query(None, ge=1, description="page size; all by default"),
+    db: Session = Depends(get_db),
+):
+    return _combination_page(combination_rows(db, test_id, after, limit), limit)
+
+
+@router.get("/test/{test_id}/ndjson")
+def stream_test_combinations(
+    test_id: int, request: Request, db: Session = Depends(get_db)
+):
+    """All of a test's combinations as newline-delimited JSON.
+
+    Rows are read in keyset pages while the response is sent, so memory
+    stays flat however many combinations the test has. That happens after
+    the request's session is closed, so the pages are read with a session of
+    their own and counted on the request's query counter.
+    """
+    return StreamingResponse(
+        count_iteration(
+            _ndjson_lines(db.get_bind(), test_id), request.state.query_counter
+        ),
+        media_type="application/x-ndjson",
     )
-    return [
-        TestCombinationResponse(
-            id=c.id,
-            test_id=c.test_id,
-            rectangle_id=c.rectangle_id,
-            triangle_size=c.triangle_size,
-            saturation=c.saturation,
-            orientation=_validate_orientation(c.orientation),
-            success=c.success,
-            created_at=c.created_at,
-        )
-        for c in combinations
-    ]
 
 
-def _load_algorithm_state(db: Session, test_id: int) -> AlgorithmState:
-    test = get_test(db, test_id)
+def _ndjson_lines(bind, test_id):
+    db = SessionLocal(bind=bind)
+    try:
+        for row in iter_combination_rows(db, test_id):
+            yield json.dumps(_combination_dict(row)) + "\n"
+    finally:
+        db.close()
+
+
+def _get_test_for_update(db: Session, test_id: int) -> Test:
+    test = db.get(Test, test_id, options=[undefer(Test.state_snapshot)])
     if not test:
         raise HTTPException(status_code=404, detail="Test not found")
+    return test
 
+
+def _load_algorithm_state(db: Session, test: Test) -> AlgorithmState:
+    test_id = test.id
     triangle_size_bounds = (test.min_triangle_size, test.max_triangle_size)
     saturation_bounds = (test.min_saturation, test.max_saturation)
 
+    state = decode_state(test.state_snapshot, triangle_size_bounds, saturation_bounds)
+    if state is not None:
+        return state
+
     # Load existing rectangles from database
     db_rectangles = db.query(Rectangle).filter(Rectangle.test_id == test_id).all()
 
@@ -109,58 +192,94 @@ def _load_algorithm_state(db: Session, test_id: int) -> AlgorithmState:
     for rect in db_rectangles:
         rectangles.append(
             {
-                "bounds": {
-                    "triangle_size": (rect.min_triangle_size, rect.max_triangle_size),
-                    "saturation": (rect.min_saturation, rect.max_saturation),
-                },
-                "area": rect.area,
+                "id": rect.id,
+                "bounds": cell_bounds(
+                    rect.depth, rect.morton, triangle_size_bounds, saturation_bounds
+                ),
+                "depth": rect.depth,
+                "morton": rect.morton,
+                "area": cell_area(rect.depth),
                 "true_samples": rect.true_samples,
                 "false_samples": rect.false_samples,
             }
         )
 
-    return AlgorithmState(triangle_size_bounds, saturation_bounds, rectangles)
-
-
-def _sync_algorithm_state(state: AlgorithmState, test_id: int, db: Session):
-    """Sync algorithm state changes with database"""
-    # Remove split rectangles
-    for removed_rect in state.removed_rectangles:
-        db_rect = (
-            db.query(Rectangle)
-            .filter(
-                Rectangle.test_id == test_id,
-                Rectangle.min_triangle_size
-                == removed_rect["bounds"]["triangle_size"][0],
-                Rectangle.max_triangle_size
-                == removed_rect["bounds"]["triangle_size"][1],
-                Rectangle.min_saturation == removed_rect["bounds"]["saturation"][0],
-                Rectangle.max_saturation == removed_rect["bounds"]["saturation"][1],
-            )
-            .first()
-        )
-        if db_rect:
-            db.delete(db_rect)
-
-    # Add new rectangles
-    for new_rect in state.new_rectangles:
-        db_rect = Rectangle(
-            test_id=test_id,
-            min_triangle_size=new_rect["bounds"]["triangle_size"][0],
-            max_triangle_size=new_rect["bounds"]["triangle_size"][1],
-            min_saturation=new_rect["bounds"]["saturation"][0],
-            max_saturation=new_rect["bounds"]["saturation"][1],
-            area=new_rect["area"],
-            true_samples=new_rect["true_samples"],
-            false_samples=new_rect["false_samples"],
+    state = AlgorithmState(triangle_size_bounds, saturation_bounds, rectangles)
+    if rectangles:
+        # Tests created before snapshots existed get one here; it is
+        # committed with the caller's changes
+        state.trial_count = (
+            db.query(TestCombination).filter(TestCombination.test_id == test_id).count()
         )
-        db.add(db_rect)
+        test.state_snapshot = encode_state(state)
+    return state
+
+
+def _sync_algorithm_state(
+    state: AlgorithmState,
+    test: Test,
+    db: Session,
+    counts_changed=False,
+    combinations=(),
+):
+    """Sync algorithm state changes with database.
+
+    The test's state snapshot is rewritten in the same transaction whenever
+    the rectangles or their counts changed. New ``combinations`` are pointed
+    at the rectangle containing them once new rectangles have ids.
+    """
+    test_id = test.id
+    with stage("sync"):
+        # Add new rectangles
+        db_new_rects = [
+            Rectangle(
+                test_id=test_id,
+                depth=new_rect["depth"],
+                morton=new_rect["morton"],
+                true_samples=new_rect["true_samples"],
+                false_samples=new_rect["false_samples"],
+            )
+            for new_rect in state.new_rectangles
+        ]
+        if db_new_rects:
+            db.add_all(db_new_rects)
+            db.flush()
+            for new_rect, db_rect in zip(state.new_rectangles, db_new_rects):
+                new_rect["id"] = db_rect.id
+        for combination in combinations:
+            rect = find_rectangle(
+                state, combination.triangle_size, combination.saturation
+            )
+            combination.rectangle_id = rect["id"] if rect else None
+
+        # Remove split rectangles, moving their combinations to the cell that
+        # now contains them. Bulk statements keep the query count independent
+        # of how many combinations the split cells held.
+        removed_ids = [r["id"] for r in state.removed_rectangles]
+        if removed_ids:
+            cells = {(r["depth"], r["morton"]): r["id"] for r in state.rectangles}
+            assign_combinations_to_rectangles(db, test, cells, removed_ids)
+            db.execute(
+                delete(Rectangle)
+                .where(Rectangle.id.in_(removed_ids))
+                .execution_options(synchronize_session="fetch")
+            )
+
+        if counts_changed or state.new_rectangles or state.removed_rectangles:
+            test.state_snapshot = encode_state(state)
 
-    # Clear change tracking
-    state.new_rectangles = []
-    state.removed_rectangles = []
+        RECTANGLE_SPLITS.inc(len(state.removed_rectangles))
 
-    db.commit()
+        # Clear change tracking
+        state.new_rectangles = []
+        state.removed_rectangles = []
+
+    with stage("commit"):
+        # Flushed first so the bumped state version is known without a query
+        db.flush()
+        version = test.state_version
+        db.commit()
+    return removed_ids, version
 
 
 class TestCombinationResult(BaseModel):
@@ -173,61 +292,92 @@ class TestCombinationResult(BaseModel):
 
 
 @router.get("/next/{test_id}")
+@query_budget(5)
 def get_next_test_combination(test_id: int, db: Session = Depends(get_db)):
     """Get next combination to test for a given test ID"""
-    test = db.query(Test).filter(Test.id == test_id).first()
-    if not test:
-        raise HTTPException(status_code=404, detail="Test not found")
-
-    # Get total samples count and add 1 to include the combination we're about to test
-    total_samples = (
-        db.query(TestCombination).filter(TestCombination.test_id == test_id).count()
+    if queue_depth() > 0:
+        version = db.scalar(select(Test.state_version).where(Test.id == test_id))
+        queued = trial_queues.pop(test_id, version) if version is not None else None
+        if queued is not None:
+            return _combination_response(test_id, queued)
+
+    response, state, version = run_with_state_retry(
+        db, test_id, lambda: _next_test_combination(test_id, db)
     )
+    trial_queues.refresh(test_id, state, version)
+    return response
 
-    state = _load_algorithm_state(db, test_id)
-    combination, selected_rect = get_next_combination(state)
-    if not combination:
-        raise HTTPException(status_code=404, detail="No more combinations to test")
 
-    # Sync any state changes with database
-    _sync_algorithm_state(state, test_id, db)
-
-    # Find the corresponding rectangle in database
-    db_rectangle = (
-        db.query(Rectangle)
-        .filter(
-            Rectangle.test_id == test_id,
-            Rectangle.min_triangle_size == selected_rect["bounds"]["triangle_size"][0],
-            Rectangle.max_triangle_size == selected_rect["bounds"]["triangle_size"][1],
-            Rectangle.min_saturation == selected_rect["bounds"]["saturation"][0],
-            Rectangle.max_saturation == selected_rect["bounds"]["saturation"][1],
-        )
-        .first()
-    )
-
-    # Return combination with total_samples included
+def _combination_response(test_id: int, combination):
     return {
         "test_id": test_id,
-        "rectangle_id": db_rectangle.id,
+        "rectangle_id": combination["rectangle_id"],
         "triangle_size": combination["triangle_size"],
         "saturation": combination["saturation"],
         "orientation": random.choice(orientations),
         "success": 0,  # Initial success value
-        "total_samples": total_samples,  # This now includes the current combination
+        "total_samples": combination["total_samples"],  # Results recorded so far
     }
 
 
+def _next_test_combination(test_id: int, db: Session):
+    with stage("state_load"):
+        test = _get_test_for_update(db, test_id)
+        state = _load_algorithm_state(db, test)
+
+    with stage("next_combination"):
+        combination, selected_rect = get_next_combination(state)
+    if not combination:
+        raise HTTPException(status_code=404, detail="No more combinations to test")
+
+    # Sync any state changes with database
+    _, version = _sync_algorithm_state(state, test, db)
+
+    response = _combination_response(
+        test_id,
+        {
+            **combination,
+            # Set by the sync if the rectangle was only just created
+            "rectangle_id": selected_rect["id"],
+            "total_samples": state.trial_count,
+        },
+    )
+    return response, state, version
+
+
 @router.post("/result")
+@query_budget(13)
 def submit_test_result(result: TestCombinationResult, db: Session = Depends(get_db)):
     """Submit the result of a test combination and update rectangle cache"""
     if result.orientation not in orientations:
         raise HTTPException(status_code=422, detail="Invalid orientation")
 
+    state, removed_ids, version = run_with_state_retry(
+        db, result.test_id, lambda: _record_test_result(result, db)
+    )
+    trial_queues.refresh(result.test_id, state, version, removed_ids)
+    TRIAL_RESULTS.inc(success=bool(result.success))
+
+    return {"message": "Test result recorded successfully"}
+
+
+def _record_test_result(result: TestCombinationResult, db: Session):
     # Verify rectangle exists
     rectangle = db.query(Rectangle).filter(Rectangle.id == result.rectangle_id).first()
     if not rectangle:
         raise HTTPException(status_code=404, detail="Rectangle not found")
 
+    # Load the state before touching the rectangle so update_state counts
+    # this result exactly once
+    with stage("state_load"):
+        test = _get_test_for_update(db, result.test_id)
+        state = _load_algorithm_state(db, test)
+    selected_rect = next(
+        (r for r in state.rectangles if r["id"] == result.rectangle_id), None
+    )
+    if selected_rect is None:
+        raise HTTPException(status_code=404, detail="Rectangle not found")
+
     # Update rectangle cache
     if result.success:
         rectangle.true_samples += 1
@@ -237,35 +387,21 @@ def submit_test_result(result: TestCombinationResult, db: Session = Depends(get_
     # Create test combination record
     db_combination = TestCombination(**result.model_dump())
     db.add(db_combination)
-    db.commit()
-    db.refresh(rectangle)
 
-    # Load state and update algorithm
-    state = _load_algorithm_state(db, result.test_id)
-    selected_rect = next(
-        (
-            r
-            for r in state.rectangles
-            if (
-                r["bounds"]["triangle_size"][0] == rectangle.min_triangle_size
-                and r["bounds"]["triangle_size"][1] == rectangle.max_triangle_size
-                and r["bounds"]["saturation"][0] == rectangle.min_saturation
-                and r["bounds"]["saturation"][1] == rectangle.max_saturation
-            )
-        ),
-        None,
-    )
-
-    if selected_rect:
+    # The rows, the combination and the snapshot are committed together
+    with stage("update_state"):
         state = update_state(
             state, selected_rect, result.model_dump(), bool(result.success)
         )
-        _sync_algorithm_state(state, result.test_id, db)
-
-    return {"message": "Test result recorded successfully"}
+    if checkpoint_due(state.trial_count):
+        db.flush()
+        add_checkpoint(db, test.id, state, db_combination.id)
+    removed_ids, version = _sync_algorithm_state(state, test, db, counts_changed=True)
+    return state, removed_ids, version
 
 
 @router.get("/{test_id}/export-csv")
+@query_budget(1)
 def export_test_combinations_csv(test_id: int, db: Session = Depends(get_db)):
     """Export test combinations for a test as CSV"""
     combinations = (
@@ -304,3 +440,216 @@ def export_test_combinations_csv(test_id: int, db: Session = Depends(get_db)):
             "Content-Disposition": f'attachment; filename="test-{test_id}-results.csv"'
         },
     )
+
+
+def session_batch_size():
+    return int(os.environ.get(SESSION_BATCH_ENV, 10))
+
+
+def session_flush_seconds():
+    return float(os.environ.get(SESSION_FLUSH_SECONDS_ENV, 2.0))
+
+
+def _persist_session_results(test_id: int, results, db: Session) -> AlgorithmState:
+    """Record a session's results and return the test's state after them.
+
+    The results are replayed onto the stored state, locating each one's
+    rectangle by its point, so changes other sessions or workers made in the
+    meantime are kept rather than overwritten.
+    """
+
+    def operation():
+        test = _get_test_for_update(db, test_id)
+        state = _load_algorithm_state(db, test)
+        db_combinations = []
+        counted = {}
+        for result in results:
+            rect = find_rectangle(state, result["triangle_size"], result["saturation"])
+            if rect is not None:
+                update_state(state, rect, result, bool(result["success"]))
+                if "id" in rect:
+                    counted[rect["id"]] = rect
+            else:
+                state.trial_count += 1
+            db_combination = TestCombination(test_id=test_id, **result)
+            db.add(db_combination)
+            db_combinations.append(db_combination)
+            if checkpoint_due(state.trial_count):
+                db.flush()
+                add_checkpoint(db, test_id, state, db_combination.id)
+
+        # Counts of stored rectangles that were not split since
+        split = {rect.get("id") for rect in state.removed_rectangles}
+        current = [
+            {
+                "id": rect_id,
+                "true_samples": rect["true_samples"],
+                "false_samples": rect["false_samples"],
+            }
+            for rect_id, rect in counted.items()
+            if rect_id not in split
+        ]
+        if current:
+            db.execute(
+                update(Rectangle).execution_options(synchronize_session=False),
+                current,
+            )
+        _sync_algorithm_state(
+            state,
+            test,
+            db,
+            counts_changed=bool(results),
+            combinations=db_combinations,
+        )
+        return state
+
+    with stage("session_flush"):
+        state = run_with_state_retry(db, test_id, operation)
+    if results:
+        # The session keeps using this state, so it cannot feed the queue
+        trial_queues.invalidate(test_id)
+    return state
+
+
+def _session_combination(test_id: int, trial: int, state: AlgorithmState):
+    combination, _ = get_next_combination(state)
+    if not combination:
+        return None
+    return {
+        "type": "combination",
+        "trial": trial,
+        "test_id": test_id,
+        "triangle_size": combination["triangle_size"],
+        "saturation": combination["saturation"],
+        "orientation": random.choice(orientations),
+        "total_samples": state.trial_count,
+    }
+
+
+@router.websocket("/session/{test_id}")
+async def trial_session(
+    websocket: WebSocket, test_id: int, db: Session = Depends(get_db)
+):
+    """Run a participant's trials over one connection.
+
+    The server sends ``{"type": "combination", "trial": n, ...}`` and the
+    client answers ``{"type": "result", "trial": n, "success": 0 or 1}``; the
+    result is acknowledged and the next combination sent straight away. The
+    state is kept in memory and results are written in batches of
+    ``TRIANGLE_VISION_SESSION_BATCH``, at least every
+    ``TRIANGLE_VISION_SESSION_FLUSH_SECONDS`` and when the session ends.
+    A client that sends ``{"type": "end"}`` is answered with ``{"type":
+    "end", "trial_count": n}`` once every result is stored. If results cannot
+    be stored (the test was deleted, or the state kept changing under the
+    batch), no further result is acknowledged: the client gets an ``error``
+    message and the socket is closed with code 4404 or 1011.
+    """
+    await websocket.accept()
+    try:
+        stored = await run_in_threadpool(_persist_session_results, test_id, [], db)
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "detail": e.detail})
+        await websocket.close(code=4404)
+        return
+
+    # The in-memory state is the stored one with the unsaved results replayed
+    state = stored
+    pending = []
+    flush_requested = asyncio.Event()
+    closing = False
+
+    async def flush_loop():
+        nonlocal state
+        while True:
+            if not closing:
+                try:
+                    await asyncio.wait_for(
+                        flush_requested.wait(), timeout=session_flush_seconds()
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                flush_requested.clear()
+            if pending:
+                batch = pending[:]
+                stored = await run_in_threadpool(
+                    _persist_session_results, test_id, batch, db
+                )
+                del pending[: len(batch)]
+                state = replay_results(
+                    stored,
+                    [
+                        (r["triangle_size"], r["saturation"], r["success"])
+                        for r in pending
+                    ],
+                )
+            # Results may have arrived while the last batch was written
+            if closing and not pending:
+                return
+
+    flusher = asyncio.create_task(flush_loop())
+    trial = 0
+    outstanding = _session_combination(test_id, trial, state)
+    ended = disconnected = False
+    failure = None
+    try:
+        while outstanding is not None:
+            await websocket.send_json(outstanding)
+            message = await websocket.receive_json()
+            if message.get("type") == "end":
+                ended = True
+                break
+            if (
+                message.get("type") != "result"
+                or message.get("trial") != outstanding["trial"]
+                or message.get("success") not in (0, 1)
+            ):
+                await websocket.send_json(
+                    {"type": "error", "detail": "Expected the result of the trial"}
+                )
+                continue
+            if flusher.done():
+                # The flusher only stops early when storing failed; this
+                # result could not be stored either, so it is not acknowledged
+                break
+            result = {
+                "triangle_size": outstanding["triangle_size"],
+                "saturation": outstanding["saturation"],
+                "orientation": outstanding["orientation"],
+                "success": message["success"],
+            }
+            replay_results(
+                state,
+                [(result["triangle_size"], result["saturation"], result["success"])],
+            )
+            pending.append(result)
+            TRIAL_RESULTS.inc(success=bool(result["success"]))
+            if len(pending) >= session_batch_size():
+                flush_requested.set()
+            await websocket.send_json({"type": "ack", "trial": outstanding["trial"]})
+            trial += 1
+            outstanding = _session_combination(test_id, trial, state)
+    except WebSocketDisconnect:
+        disconnected = True
+    finally:
+        closing = True
+        flush_requested.set()
+        try:
+            await flusher
+        except (HTTPException, SQLAlchemyError) as e:
+            failure = e
+    if failure is not None:
+        if not disconnected:
+            not_found = getattr(failure, "status_code", None) == 404
+            await websocket.send_json(
+                {
+                    "type": "error",
+                    "detail": (
+                        failure.detail if not_found else "Results could not be stored"
+                    ),
+                }
+            )
+            await websocket.close(code=4404 if not_found else 1011)
+    elif ended or outstanding is None:
+        # Everything is stored once the client sees this
+        await websocket.send_json({"type": "end", "trial_count": state.trial_count})
+        await websocket.close()
@@ -2,22 +2,63 @@ import matplotlib
 
 matplotlib.use("Agg")  # Set the backend to non-interactive Agg
 import matplotlib.pyplot as plt
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Path, Query
 from sqlalchemy.orm import Session
 from typing import List
+from db.concurrency import run_with_state_retry
 from db.database import get_db
-from models.test import TestCreate, TestUpdate, TestResponse, Test, Rectangle
+from models.test import (
+    TestCreate,
+    TestUpdate,
+    TestResponse,
+    Test,
+    Rectangle,
+    TestCombination,
+)
 import crud.test as crud
 import io
 from algorithm_to_find_combinations.plotting import (
     create_single_smooth_plot,
+    compute_rectangle_aggregate_smooth,
     compute_soft_brush_smooth,
 )
-from fastapi.responses import StreamingResponse
-from algorithm_to_find_combinations.algorithm import AlgorithmState, update_state
+from algorithm_to_find_combinations import raster
+from algorithm_to_find_combinations.adaptive_mesh import (
+    contour_segments,
+    soft_brush_mesh,
+)
+from fastapi.responses import Response, StreamingResponse
+from algorithm_to_find_combinations.quadtree import cell_bounds
+from algorithm_to_find_combinations.state_snapshot import encode_state
+from algorithm_to_find_combinations.surface_payload import (
+    MEDIA_TYPE as SURFACE_MEDIA_TYPE,
+    encode_surface,
+)
+from algorithm_to_find_combinations.surface_tiles import (
+    MAX_LEVEL,
+    compute_tile,
+    normalized_samples,
+    tile_bounds,
+    tile_grid,
+)
+from algorithm_to_find_combinations.trial_queue import trial_queues
+from crud.checkpoints import rebuild_checkpoints, replay_state
+from crud.combinations import combination_arrays
+from observability.memory import ByteBudgetCache
+from observability.metrics import stage
+from observability.profiling import ProfiledRoute
+from observability.queries import query_budget
 import base64
+import numpy as np
+from PIL import Image
+
+router = APIRouter(prefix="/tests", tags=["tests"], route_class=ProfiledRoute)
 
-router = APIRouter(prefix="/tests", tags=["tests"])
+# Computed surface tiles by test, state version and position, and the samples
+# they are computed from by test and state version; a new result or bounds
+# change bumps the version, so stale entries are never looked up again
+_tile_cache = ByteBudgetCache("surface-tiles", 64 * 1024 * 1024)
+TILE_PIXELS = 256
 
 
 @router.post("/", response_model=TestResponse)
@@ -26,11 +67,13 @@ def create_test(test: TestCreate, db: Session = Depends(get_db)):
 
 
 @router.get("/", response_model=List[TestResponse])
+@query_budget(1)
 def read_tests(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     return crud.get_tests(db=db, skip=skip, limit=limit)
 
 
 @router.get("/{test_id}", response_model=TestResponse)
+@query_budget(1)
 def read_test(test_id: int, db: Session = Depends(get_db)):
     db_test = crud.get_test(db=db, test_id=test_id)
     if db_test is None:
@@ -39,65 +82,56 @@ def read_test(test_id: int, db: Session = Depends(get_db)):
 
 
 def recalculate_rectangles(db: Session, test: Test):
-    """Recalculate rectangles based on test combinations"""
-    # Delete existing rectangles
-    db.query(Rectangle).filter(Rectangle.test_id == test.id).delete()
-
-    # Initialize new state with base rectangle
-    state = AlgorithmState(
-        (test.min_triangle_size, test.max_triangle_size),
-        (test.min_saturation, test.max_saturation),
+    """Recalculate rectangles based on test combinations.
+
+    The whole history is replayed under the test's current bounds, rebuilding
+    its checkpoints on the way, and every combination within the new bounds is
+    pointed at the rectangle that now contains it; those outside are left
+    without a rectangle.
+    """
+    # Delete existing rectangles, detaching their combinations first so
+    # databases enforcing foreign keys accept it
+    db.query(TestCombination).filter(TestCombination.test_id == test.id).update(
+        {TestCombination.rectangle_id: None}, synchronize_session=False
     )
+    db.query(Rectangle).filter(Rectangle.test_id == test.id).delete()
 
-    # Get all test combinations for this test
-    combinations = test.combinations
-
-    # Sort combinations by creation date to maintain history
-    sorted_combinations = sorted(combinations, key=lambda x: x.created_at)
-
-    # Replay all combinations to rebuild rectangles
-    for combo in sorted_combinations:
-        selected_rect = next(
-            (
-                r
-                for r in state.rectangles
-                if r["bounds"]["triangle_size"][0]
-                <= combo.triangle_size
-                <= r["bounds"]["triangle_size"][1]
-                and r["bounds"]["saturation"][0]
-                <= combo.saturation
-                <= r["bounds"]["saturation"][1]
-            ),
-            None,
-        )
-
-        if selected_rect:
-            state = update_state(
-                state,
-                selected_rect,
-                {"triangle_size": combo.triangle_size, "saturation": combo.saturation},
-                bool(combo.success),
-            )
+    state = rebuild_checkpoints(db, test)
 
     # Save new rectangles to database
-    for rect in state.rectangles:
-        db_rect = Rectangle(
+    db_rects = [
+        Rectangle(
             test_id=test.id,
-            min_triangle_size=rect["bounds"]["triangle_size"][0],
-            max_triangle_size=rect["bounds"]["triangle_size"][1],
-            min_saturation=rect["bounds"]["saturation"][0],
-            max_saturation=rect["bounds"]["saturation"][1],
-            area=rect["area"],
+            depth=rect["depth"],
+            morton=rect["morton"],
             true_samples=rect["true_samples"],
             false_samples=rect["false_samples"],
         )
-        db.add(db_rect)
+        for rect in state.rectangles
+    ]
+    db.add_all(db_rects)
+    db.flush()
+    for rect, db_rect in zip(state.rectangles, db_rects):
+        rect["id"] = db_rect.id
+    crud.assign_combinations_to_rectangles(
+        db, test, {(r["depth"], r["morton"]): r["id"] for r in state.rectangles}
+    )
 
+    test.state_snapshot = encode_state(state)
     db.commit()
 
 
 @router.put("/{test_id}", response_model=TestResponse)
 def update_test(test_id: int, test_update: TestUpdate, db: Session = Depends(get_db)):
+    db_test = run_with_state_retry(
+        db, test_id, lambda: _update_test(test_id, test_update, db)
+    )
+    # Queued combinations may lie outside new bounds
+    trial_queues.invalidate(test_id)
+    return db_test
+
+
+def _update_test(test_id: int, test_update: TestUpdate, db: Session):
     db_test = db.query(Test).filter(Test.id == test_id).first()
     if db_test is None:
         raise HTTPException(status_code=404, detail="Test not found")
@@ -128,87 +162,383 @@ def delete_test(test_id: int, db: Session = Depends(get_db)):
     db_test = crud.delete_test(db=db, test_id=test_id)
     if db_test is None:
         raise HTTPException(status_code=404, detail="Test not found")
+    trial_queues.invalidate(test_id)
+    # A test created later may reuse the id
+    _tile_cache.pop_matching(lambda key: key[0] == test_id)
     return db_test
 
 
+@router.get("/{test_id}/state")
+@query_budget(3)
+def get_test_state(
+    test_id: int,
+    as_of: int = Query(None, ge=0, description="number of results to include"),
+    db: Session = Depends(get_db),
+):
+    """Rectangle state after the test's first ``as_of`` results (all by default)"""
+    db_test = crud.get_test(db=db, test_id=test_id)
+    if db_test is None:
+        raise HTTPException(status_code=404, detail="Test not found")
+    state, checkpoint = replay_state(db, db_test, as_of)
+    return {
+        "trial_count": state.trial_count,
+        "replayed_from": checkpoint.trial_count if checkpoint else 0,
+        "rectangles": [
+            {
+                "depth": rect["depth"],
+                "morton": rect["morton"],
+                "bounds": rect["bounds"],
+                "area": rect["area"],
+                "true_samples": rect["true_samples"],
+                "false_samples": rect["false_samples"],
+            }
+            for rect in state.rectangles
+        ],
+    }
+
+
+def _threshold_profile(segments, triangle_size_bounds, step):
+    """Lowest saturation of the threshold line at every ``step`` of triangle size"""
+    plot_data = []
+    tol = step / 2
+    for x_val in np.arange(
+        triangle_size_bounds[0], triangle_size_bounds[1] + step, step
+    ):
+        candidate_sats = []
+        for seg in segments:
+            # seg is an array of shape (N,2) with col0=X, col1=Y.
+            matching = seg[abs(seg[:, 0] - x_val) <= tol]
+            if matching.size:
+                candidate_sats.extend(matching[:, 1].tolist())
+        if candidate_sats:
+            min_sat = float(min(candidate_sats))
+            plot_data.append({"triangle_size": float(x_val), "saturation": min_sat})
+    return plot_data
+
+
 @router.get("/{test_id}/plot")
+@query_budget(3)
 def get_test_plot(
     test_id: int,
     show_rectangles: bool = False,
     step: float = None,  # new query parameter for step size
     threshold: float = 0.75,  # new query parameter for threshold line value
+    renderer: str = Query("matplotlib", pattern="^(matplotlib|raster)$"),
+    image_format: str = Query("png", pattern="^(png|webp)$"),
+    framed: bool = True,
+    show_samples: bool = False,
+    show_threshold: bool = False,
+    contour_mesh: str = Query("grid", pattern="^(grid|adaptive)$"),
+    smoothing_method: str = Query(
+        "soft_brush", pattern="^(soft_brush|rectangle_aggregate)$"
+    ),
     db: Session = Depends(get_db),
 ):
+    """Smoothed success surface as a base64 image, plus the threshold profile.
+
+    The ``raster`` renderer colours the surface through a lookup table and
+    draws rectangles, samples and the threshold line only when asked to;
+    ``image_format`` and ``framed`` (axes and colorbar) apply to it alone.
+    With ``contour_mesh=adaptive`` the threshold profile, and the raster's
+    threshold line, come from a mesh that follows the rectangle tree instead of
+    the 100x100 grid. ``smoothing_method=rectangle_aggregate`` estimates the
+    surface from the rectangles' sample counts rather than every result (the
+    raster renderer then loads results only to draw them), and always contours
+    its own grid.
+    """
     db_test = crud.get_test(db=db, test_id=test_id)
     if db_test is None:
         raise HTTPException(status_code=404, detail="Test not found")
+    if renderer == "raster":
+        return _raster_plot(
+            db,
+            db_test,
+            show_rectangles,
+            step,
+            threshold,
+            image_format,
+            framed,
+            show_samples,
+            show_threshold,
+            contour_mesh,
+            smoothing_method,
+        )
 
     try:
         fig, ax = plt.subplots(figsize=(10, 8))
 
-        combinations = [
-            {
-                "triangle_size": c.triangle_size,
-                "saturation": c.saturation,
-                "success": c.success,
-            }
-            for c in db_test.combinations
-        ]
+        combinations = combination_arrays(db, test_id)
         triangle_size_bounds = (db_test.min_triangle_size, db_test.max_triangle_size)
         saturation_bounds = (db_test.min_saturation, db_test.max_saturation)
 
         rectangles = None
-        if show_rectangles:
-            rectangles = [
-                {
-                    "bounds": {
-                        "triangle_size": (r.min_triangle_size, r.max_triangle_size),
-                        "saturation": (r.min_saturation, r.max_saturation),
-                    }
-                }
-                for r in db_test.rectangles
-            ]
+        if smoothing_method == "rectangle_aggregate":
+            rectangles = _rectangle_aggregates(db_test)
+        elif show_rectangles:
+            rectangles = _rectangle_bounds(db_test)
 
         # Call the plotting function and capture smooth arrays
-        X_s, Y_s, Z_s = create_single_smooth_plot(
-            combinations,
-            triangle_size_bounds,
-            saturation_bounds,
-            smoothing_method="soft_brush",
-            ax=ax,
-            rectangles=rectangles,
-            threshold=threshold,
-        )
-        # Save image (without extra contour line overlaid)
-        buf = io.BytesIO()
-        plt.savefig(buf, format="png", bbox_inches="tight", dpi=300)
-        buf.seek(0)
-        plt.close(fig)
-        img_base64 = base64.b64encode(buf.getvalue()).decode("utf-8")
+        with stage("plot_compute"):
+            X_s, Y_s, Z_s = create_single_smooth_plot(
+                combinations,
+                triangle_size_bounds,
+                saturation_bounds,
+                smoothing_method=smoothing_method,
+                ax=ax,
+                rectangles=rectangles,
+                threshold=threshold,
+                show_rectangles=show_rectangles,
+            )
+        # Save image (without extra contour line overlaid); rasterizing and
+        # PNG compression both happen inside savefig
+        with stage("plot_render"):
+            buf = io.BytesIO()
+            plt.savefig(buf, format="png", bbox_inches="tight", dpi=300)
+            buf.seek(0)
+            plt.close(fig)
+        with stage("plot_encode"):
+            img_base64 = base64.b64encode(buf.getvalue()).decode("utf-8")
 
         plot_data = []
-        if step:
-            import numpy as np
-
-            # Extract contour segments at exactly 0.75 without drawing them
+        if step and contour_mesh == "adaptive" and smoothing_method == "soft_brush":
+            segments = _adaptive_segments(db_test, combinations, threshold)
+            plot_data = _threshold_profile(segments, triangle_size_bounds, step)
+        elif step:
+            # Extract contour segments at exactly the threshold without drawing them
             CS = ax.contour(X_s, Y_s, Z_s, levels=[threshold], colors="none")
-            segments = CS.allsegs[0]  # segments for level 0.75
-            tol = step / 2
-            for x_val in np.arange(
-                triangle_size_bounds[0], triangle_size_bounds[1] + step, step
-            ):
-                candidate_sats = []
-                for seg in segments:
-                    # seg is an array of shape (N,2) with col0=X, col1=Y.
-                    matching = seg[abs(seg[:, 0] - x_val) <= tol]
-                    if matching.size:
-                        candidate_sats.extend(matching[:, 1].tolist())
-                if candidate_sats:
-                    min_sat = float(min(candidate_sats))
-                    plot_data.append(
-                        {"triangle_size": float(x_val), "saturation": min_sat}
-                    )
-        return {"image": img_base64, "plot_data": plot_data}
+            plot_data = _threshold_profile(CS.allsegs[0], triangle_size_bounds, step)
+        return {"image": img_base64, "media_type": "image/png", "plot_data": plot_data}
     except Exception as e:
         plt.close("all")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+def _rectangle_bounds(db_test: Test):
+    triangle_size_bounds = (db_test.min_triangle_size, db_test.max_triangle_size)
+    saturation_bounds = (db_test.min_saturation, db_test.max_saturation)
+    return [
+        {
+            "bounds": cell_bounds(
+                r.depth, r.morton, triangle_size_bounds, saturation_bounds
+            )
+        }
+        for r in db_test.rectangles
+    ]
+
+
+def _rectangle_aggregates(db_test: Test):
+    """Rectangles with their cells and sample counts, for rectangle_aggregate"""
+    triangle_size_bounds = (db_test.min_triangle_size, db_test.max_triangle_size)
+    saturation_bounds = (db_test.min_saturation, db_test.max_saturation)
+    return [
+        {
+            "bounds": cell_bounds(
+                r.depth, r.morton, triangle_size_bounds, saturation_bounds
+            ),
+            "depth": r.depth,
+            "morton": r.morton,
+            "true_samples": r.true_samples,
+            "false_samples": r.false_samples,
+        }
+        for r in db_test.rectangles
+    ]
+
+
+def _adaptive_segments(db_test: Test, samples, threshold: float):
+    """Threshold line segments on the mesh of the test's rectangles"""
+    with stage("plot_compute"):
+        mesh = soft_brush_mesh(
+            samples,
+            [(r.depth, r.morton) for r in db_test.rectangles],
+            (db_test.min_triangle_size, db_test.max_triangle_size),
+            (db_test.min_saturation, db_test.max_saturation),
+        )
+        return contour_segments(mesh, threshold)
+
+
+def _smoothed_surface(db: Session, db_test: Test):
+    """The test's samples and their soft brush surface ``X, Y, Z``"""
+    samples = combination_arrays(db, db_test.id)
+    if not len(samples[1]):
+        raise HTTPException(status_code=422, detail="Test has no results to plot")
+    with stage("plot_compute"):
+        X_s, Y_s, Z_s = compute_soft_brush_smooth(
+            samples,
+            (db_test.min_triangle_size, db_test.max_triangle_size),
+            (db_test.min_saturation, db_test.max_saturation),
+            {},
+        )
+    return samples, X_s, Y_s, Z_s
+
+
+def _aggregate_surface(db_test: Test):
+    """``X, Y, Z`` of the rectangle-aggregate estimate"""
+    rectangles = _rectangle_aggregates(db_test)
+    if not any(r["true_samples"] or r["false_samples"] for r in rectangles):
+        raise HTTPException(status_code=422, detail="Test has no results to plot")
+    with stage("plot_compute"):
+        return compute_rectangle_aggregate_smooth(
+            rectangles,
+            (db_test.min_triangle_size, db_test.max_triangle_size),
+            (db_test.min_saturation, db_test.max_saturation),
+        )
+
+
+def _raster_plot(
+    db: Session,
+    db_test: Test,
+    show_rectangles: bool,
+    step: float,
+    threshold: float,
+    image_format: str,
+    framed: bool,
+    show_samples: bool,
+    show_threshold: bool,
+    contour_mesh: str,
+    smoothing_method: str,
+):
+    triangle_size_bounds = (db_test.min_triangle_size, db_test.max_triangle_size)
+    saturation_bounds = (db_test.min_saturation, db_test.max_saturation)
+    if smoothing_method == "rectangle_aggregate":
+        X_s, Y_s, Z_s = _aggregate_surface(db_test)
+        samples = combination_arrays(db, db_test.id) if show_samples else None
+    else:
+        samples, X_s, Y_s, Z_s = _smoothed_surface(db, db_test)
+    segments = None
+    if (
+        contour_mesh == "adaptive"
+        and smoothing_method == "soft_brush"
+        and (step or show_threshold)
+    ):
+        segments = _adaptive_segments(db_test, samples, threshold)
+    with stage("plot_render"):
+        image = raster.render_surface(
+            X_s,
+            Y_s,
+            Z_s,
+            triangle_size_bounds,
+            saturation_bounds,
+            image_format=image_format,
+            framed=framed,
+            rectangles=_rectangle_bounds(db_test) if show_rectangles else None,
+            samples=samples if show_samples else None,
+            threshold=threshold if show_threshold else None,
+            lines=segments,
+        )
+    with stage("plot_encode"):
+        img_base64 = base64.b64encode(image).decode("utf-8")
+
+    plot_data = []
+    if step:
+        if segments is None:
+            segments = raster.threshold_lines(X_s, Y_s, Z_s, threshold)
+        plot_data = _threshold_profile(segments, triangle_size_bounds, step)
+    return {
+        "image": img_base64,
+        "media_type": raster.FORMATS[image_format],
+        "plot_data": plot_data,
+    }
+
+
+@router.get("/{test_id}/surface")
+@query_budget(3)
+def get_test_surface(
+    test_id: int,
+    encoding: str = Query("u8", pattern="^(u8|f16)$"),
+    include_samples: bool = True,
+    include_rectangles: bool = True,
+    db: Session = Depends(get_db),
+):
+    """Smoothed grid, samples and rectangles as a binary payload.
+
+    The layout is documented in ``algorithm_to_find_combinations.surface_payload``;
+    clients draw thresholds and overlays from it without further requests.
+    """
+    db_test = crud.get_test(db=db, test_id=test_id)
+    if db_test is None:
+        raise HTTPException(status_code=404, detail="Test not found")
+    samples, X_s, Y_s, Z_s = _smoothed_surface(db, db_test)
+    with stage("plot_encode"):
+        payload = encode_surface(
+            X_s,
+            Y_s,
+            Z_s,
+            (db_test.min_triangle_size, db_test.max_triangle_size),
+            (db_test.min_saturation, db_test.max_saturation),
+            samples=samples if include_samples else None,
+            rectangles=_rectangle_bounds(db_test) if include_rectangles else None,
+            encoding=encoding,
+        )
+    return Response(payload, media_type=SURFACE_MEDIA_TYPE)
+
+
+def _tile_samples(db: Session, db_test: Test):
+    """The test's normalized samples, loaded once per state version"""
+    key = (db_test.id, db_test.state_version, "samples")
+    samples = _tile_cache.get(key)
+    if samples is None:
+        samples = normalized_samples(
+            combination_arrays(db, db_test.id),
+            (db_test.min_triangle_size, db_test.max_triangle_size),
+            (db_test.min_saturation, db_test.max_saturation),
+        )
+        _tile_cache.put(key, samples)
+    return samples
+
+
+@router.get("/{test_id}/tiles/{level}/{column}/{row}")
+@query_budget(2)
+def get_surface_tile(
+    test_id: int,
+    level: int = Path(ge=0, le=MAX_LEVEL),
+    column: int = Path(ge=0),
+    row: int = Path(ge=0),
+    encoding: str = Query("u8", pattern="^(u8|f16|png)$"),
+    db: Session = Depends(get_db),
+):
+    """One tile of the multi-resolution surface.
+
+    Tiles are laid out as described in
+    ``algorithm_to_find_combinations.surface_tiles``, computed on first use and
+    cached. ``u8`` and ``f16`` return the grid as a surface payload whose
+    bounds are the tile's; ``png`` returns the coloured tile image.
+    """
+    db_test = crud.get_test(db=db, test_id=test_id)
+    if db_test is None:
+        raise HTTPException(status_code=404, detail="Test not found")
+    if column >= 1 << level or row >= 1 << level:
+        raise HTTPException(status_code=404, detail="Tile not found")
+    triangle_size_bounds = (db_test.min_triangle_size, db_test.max_triangle_size)
+    saturation_bounds = (db_test.min_saturation, db_test.max_saturation)
+
+    key = (test_id, db_test.state_version, level, column, row)
+    Z_t = _tile_cache.get(key)
+    if Z_t is None:
+        samples = _tile_samples(db, db_test)
+        with stage("plot_compute"):
+            _, _, Z_t = compute_tile(
+                samples, triangle_size_bounds, saturation_bounds, level, column, row
+            )
+        Z_t = Z_t.astype(np.float32)
+        _tile_cache.put(key, Z_t)
+
+    with stage("plot_encode"):
+        if encoding == "png":
+            rgba = raster.surface_rgba(Z_t, (TILE_PIXELS, TILE_PIXELS))
+            content = raster.encode_image(Image.fromarray(rgba))
+            media_type = raster.FORMATS["png"]
+        else:
+            X_t, Y_t = tile_grid(
+                level, column, row, triangle_size_bounds, saturation_bounds
+            )
+            content = encode_surface(
+                X_t,
+                Y_t,
+                Z_t,
+                *tile_bounds(
+                    level, column, row, triangle_size_bounds, saturation_bounds
+                ),
+                encoding=encoding,
+            )
+            media_type = SURFACE_MEDIA_TYPE
+    return Response(content, media_type=media_type)
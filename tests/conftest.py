@@ -1,16 +1,23 @@
+import os
+
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from db.database import Base, get_db
+from algorithm_to_find_combinations.trial_queue import trial_queues
+from db.database import Base, get_db, make_engine
 from main import app
+from routers.test_router import _tile_cache
 
-# Use an in-memory SQLite database for testing
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+# Fail any request that exceeds its endpoint's declared query budget
+os.environ.setdefault("TRIANGLE_VISION_QUERY_BUDGET_STRICT", "1")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+# Use a SQLite file for testing, or the database named by
+# TRIANGLE_VISION_TEST_DATABASE_URL (such as an empty PostgreSQL database)
+SQLALCHEMY_DATABASE_URL = os.environ.get(
+    "TRIANGLE_VISION_TEST_DATABASE_URL", "sqlite:///./test.db"
 )
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
@@ -19,6 +26,9 @@ def test_db():
     Base.metadata.create_all(bind=engine)
     yield  # Run the tests
     Base.metadata.drop_all(bind=engine)
+    # Test ids are reused once the tables are dropped
+    trial_queues.clear()
+    _tile_cache.clear()
 
 
 @pytest.fixture
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from algorithm_to_find_combinations.adaptive_mesh import (
+    AdaptiveMesh,
+    contour_segments,
+    rectangle_mesh,
+)
+from algorithm_to_find_combinations.quadtree import child_code
+
+triangle_size_bounds = (50.0, 300.0)
+saturation_bounds = (0.5, 1.0)
+
+
+def _split_tree():
+    """The root's four children, the last of them split again"""
+    children = [(1, child_code(0, i, j)) for j in range(2) for i in range(2)]
+    grandchildren = [
+        (2, child_code(children[-1][1], i, j)) for j in range(2) for i in range(2)
+    ]
+    return children[:-1] + grandchildren
+
+
+def test_mesh_is_finer_in_split_cells():
+    mesh = rectangle_mesh(
+        _split_tree(), triangle_size_bounds, saturation_bounds, subdivisions=4
+    )
+    # 5x5 nodes per cell, shared along common edges
+    assert len(np.unique(mesh.points, axis=0)) == len(mesh) == 9 * 9 + 9 * 9 - 5 * 5
+    x, y = mesh.points[mesh.triangles].transpose(2, 0, 1)
+    areas = 0.5 * np.abs(
+        (x[:, 1] - x[:, 0]) * (y[:, 2] - y[:, 0])
+        - (x[:, 2] - x[:, 0]) * (y[:, 1] - y[:, 0])
+    )
+    assert np.isclose(areas.sum(), 250.0 * 0.5)
+
+    upper_right = (mesh.points[:, 0] > 175.0) & (mesh.points[:, 1] > 0.75)
+    lower_left = (mesh.points[:, 0] < 175.0) & (mesh.points[:, 1] < 0.75)
+    assert upper_right.sum() == 8 * 8 and lower_left.sum() == 4 * 4
+
+
+def test_contour_segments_follow_the_level():
+    mesh = rectangle_mesh(_split_tree(), triangle_size_bounds, saturation_bounds)
+    # A linear surface is reproduced exactly by linear interpolation
+    mesh.Z = (mesh.points[:, 0] - 50.0) / 250.0 + (mesh.points[:, 1] - 0.5) * 2
+    segments = contour_segments(mesh, 0.8)
+    assert segments.shape[1:] == (2, 2) and len(segments) > 0
+    ends = segments.reshape(-1, 2)
+    assert np.allclose((ends[:, 0] - 50.0) / 250.0 + (ends[:, 1] - 0.5) * 2, 0.8)
+
+    # Triangles touching an unevaluated node are left out
+    mesh.Z[mesh.points[:, 0] < 100.0] = np.nan
+    assert (contour_segments(mesh, 0.8).reshape(-1, 2)[:, 0] >= 100.0).all()
+
+    empty = AdaptiveMesh(mesh.points, mesh.triangles, np.zeros(len(mesh)))
+    assert contour_segments(empty, 0.8).shape == (0, 2, 2)
+
+
+def test_adaptive_threshold_profile(client: TestClient):
+    test_id = client.post(
+        "/api/tests/",
+        json={
+            "title": "Mesh test",
+            "description": "Testing the adaptive mesh",
+            "min_triangle_size": 50.0,
+            "max_triangle_size": 300.0,
+            "min_saturation": 0.5,
+            "max_saturation": 1.0,
+        },
+    ).json()["id"]
+    for _ in range(60):
+        combination = client.get(f"/api/test-combinations/next/{test_id}").json()
+        success = combination["triangle_size"] / 300 + combination["saturation"] > 1.2
+        client.post(
+            "/api/test-combinations/result",
+            json={**combination, "success": int(success)},
+        )
+
+    params = {"renderer": "raster", "step": 25, "show_threshold": True}
+    url = f"/api/tests/{test_id}/plot"
+    grid = client.get(url, params=params).json()["plot_data"]
+    adaptive = client.get(url, params={**params, "contour_mesh": "adaptive"})
+    assert adaptive.status_code == 200
+    adaptive = adaptive.json()["plot_data"]
+    assert adaptive
+    # The same line, up to the resolution of the coarser of the two
+    grid_by_size = {p["triangle_size"]: p["saturation"] for p in grid}
+    for point in adaptive:
+        if point["triangle_size"] in grid_by_size:
+            assert abs(point["saturation"] - grid_by_size[point["triangle_size"]]) < 0.1
+
+
+@pytest.mark.filterwarnings("error::RuntimeWarning")
+def test_contour_segments_on_plateaus():
+    """Edges along a plateau are not crossed and raise no warnings"""
+    mesh = rectangle_mesh(_split_tree(), triangle_size_bounds, saturation_bounds)
+    # Level everywhere but along the lowest saturation, so the triangles there
+    # have axis-aligned edges with equal values at both ends
+    mesh.Z = np.where(mesh.points[:, 1] > 0.5, 1.0, 0.0)
+    segments = contour_segments(mesh, 0.5)
+    assert len(segments) > 0 and np.isfinite(segments).all()
+    assert (segments[:, :, 1] < 0.5 + 0.5 / 8).all()
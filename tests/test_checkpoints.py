@@ -0,0 +1,176 @@
+import random
+
+from fastapi.testclient import TestClient
+
+import models.test as models
+from algorithm_to_find_combinations.algorithm import AlgorithmState, replay_results
+from algorithm_to_find_combinations.quadtree import point_code
+from algorithm_to_find_combinations.state_snapshot import decode_state
+from tests.conftest import TestingSessionLocal
+
+test_payload = {
+    "title": "Checkpoint test",
+    "description": "Testing state checkpoints",
+    "min_triangle_size": 50.0,
+    "max_triangle_size": 300.0,
+    "min_saturation": 0.5,
+    "max_saturation": 1.0,
+}
+
+
+def _run_trials(client: TestClient, test_id, trials):
+    random.seed(1)
+    for _ in range(trials):
+        combination = client.get(f"/api/test-combinations/next/{test_id}").json()
+        response = client.post(
+            "/api/test-combinations/result",
+            json={**combination, "success": int(random.random() < 0.6)},
+        )
+        assert response.status_code == 200
+
+
+def _cells(rectangles):
+    return sorted(
+        (
+            rect["depth"],
+            rect["morton"],
+            rect["true_samples"],
+            rect["false_samples"],
+        )
+        for rect in rectangles
+    )
+
+
+def _history(test_id):
+    db = TestingSessionLocal()
+    try:
+        return [
+            (c.triangle_size, c.saturation, c.success)
+            for c in db.query(models.TestCombination)
+            .filter(models.TestCombination.test_id == test_id)
+            .order_by(models.TestCombination.id)
+        ]
+    finally:
+        db.close()
+
+
+def test_state_as_of_replays_from_nearest_checkpoint(client: TestClient, monkeypatch):
+    """
+    Test GET /api/tests/{test_id}/state
+    This test verifies that:
+    1. The trial loop stores a checkpoint every interval
+    2. Point-in-time queries start from the nearest checkpoint
+    3. Replaying from a checkpoint gives the same state as replaying everything
+    4. The replayed current state matches the live state
+    """
+    monkeypatch.setenv("TRIANGLE_VISION_CHECKPOINT_INTERVAL", "10")
+    test_id = client.post("/api/tests/", json=test_payload).json()["id"]
+    _run_trials(client, test_id, 35)
+
+    db = TestingSessionLocal()
+    try:
+        checkpoints = (
+            db.query(models.StateCheckpoint)
+            .filter(models.StateCheckpoint.test_id == test_id)
+            .order_by(models.StateCheckpoint.trial_count)
+            .all()
+        )
+        assert [c.trial_count for c in checkpoints] == [10, 20, 30]
+        live = decode_state(
+            db.get(models.Test, test_id).state_snapshot, (50.0, 300.0), (0.5, 1.0)
+        )
+    finally:
+        db.close()
+    assert live.trial_count == 35
+
+    response = client.get(f"/api/tests/{test_id}/state", params={"as_of": 25})
+    assert response.status_code == 200
+    state = response.json()
+    assert state["trial_count"] == 25
+    assert state["replayed_from"] == 20
+
+    from_scratch = replay_results(
+        AlgorithmState((50.0, 300.0), (0.5, 1.0)), _history(test_id)[:25]
+    )
+    assert _cells(state["rectangles"]) == _cells(from_scratch.rectangles)
+
+    current = client.get(f"/api/tests/{test_id}/state").json()
+    assert current["trial_count"] == 35
+    assert current["replayed_from"] == 30
+    assert _cells(current["rectangles"]) == _cells(live.rectangles)
+
+
+def test_bounds_change_rebuilds_checkpoints(client: TestClient, monkeypatch):
+    """Changing the bounds replays the history and replaces the checkpoints"""
+    monkeypatch.setenv("TRIANGLE_VISION_CHECKPOINT_INTERVAL", "10")
+    test_id = client.post("/api/tests/", json=test_payload).json()["id"]
+    _run_trials(client, test_id, 25)
+
+    response = client.put(
+        f"/api/tests/{test_id}", json={**test_payload, "max_triangle_size": 200.0}
+    )
+    assert response.status_code == 200
+
+    history = _history(test_id)
+    db = TestingSessionLocal()
+    try:
+        checkpoints = (
+            db.query(models.StateCheckpoint)
+            .filter(models.StateCheckpoint.test_id == test_id)
+            .all()
+        )
+        assert sorted(c.trial_count for c in checkpoints) == [10, 20]
+        for checkpoint in checkpoints:
+            state = decode_state(checkpoint.snapshot, (50.0, 200.0), (0.5, 1.0))
+            replayed = replay_results(
+                AlgorithmState((50.0, 200.0), (0.5, 1.0)),
+                history[: checkpoint.trial_count],
+            )
+            assert _cells(state.rectangles) == _cells(replayed.rectangles)
+
+        # Combinations inside the new bounds point at the cell containing them
+        rectangles = {
+            r.id: r
+            for r in db.query(models.Rectangle).filter(
+                models.Rectangle.test_id == test_id
+            )
+        }
+        for c in db.query(models.TestCombination).filter(
+            models.TestCombination.test_id == test_id
+        ):
+            if c.triangle_size > 200.0:
+                assert c.rectangle_id is None
+                continue
+            cell = rectangles[c.rectangle_id]
+            assert cell.morton == point_code(
+                c.triangle_size, c.saturation, cell.depth, (50.0, 200.0), (0.5, 1.0)
+            )
+    finally:
+        db.close()
+
+
+def test_combinations_outside_new_bounds_can_be_read(client: TestClient):
+    """A combination left outside every rectangle is served without one"""
+    test_id = client.post("/api/tests/", json=test_payload).json()["id"]
+    _run_trials(client, test_id, 25)
+    response = client.put(
+        f"/api/tests/{test_id}", json={**test_payload, "min_triangle_size": 60.0}
+    )
+    assert response.status_code == 200
+
+    db = TestingSessionLocal()
+    try:
+        outside = [
+            c.id
+            for c in db.query(models.TestCombination).filter(
+                models.TestCombination.test_id == test_id,
+                models.TestCombination.triangle_size < 60.0,
+            )
+        ]
+    finally:
+        db.close()
+    assert outside
+    for combination_id in outside:
+        response = client.get(f"/api/test-combinations/{combination_id}")
+        assert response.status_code == 200
+        assert response.json()["rectangle_id"] is None
@@ -0,0 +1,130 @@
+import random
+import threading
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+from sqlalchemy.orm.exc import StaleDataError
+
+import db.concurrency as concurrency
+import models.test as models
+from algorithm_to_find_combinations.state_snapshot import decode_state
+from db.concurrency import run_with_state_retry
+from observability.metrics import STATE_CONFLICTS
+from routers import test_combination_router
+from tests.conftest import TestingSessionLocal
+
+test_payload = {
+    "title": "Concurrency test",
+    "description": "Testing concurrent trials",
+    "min_triangle_size": 50.0,
+    "max_triangle_size": 300.0,
+    "min_saturation": 0.5,
+    "max_saturation": 1.0,
+}
+
+
+def test_stale_state_is_retried(client: TestClient):
+    """A commit over a state another session changed first runs again"""
+    test_id = client.post("/api/tests/", json=test_payload).json()["id"]
+    conflicts_before = STATE_CONFLICTS.value()
+    attempts = []
+
+    db = TestingSessionLocal()
+    try:
+
+        def operation():
+            test = db.get(models.Test, test_id)
+            if not attempts:
+                # Another worker updates the test between our read and write
+                other = TestingSessionLocal()
+                other.get(models.Test, test_id).description = "changed elsewhere"
+                other.commit()
+                other.close()
+            attempts.append(test.state_version)
+            test.title = "changed here"
+            db.commit()
+
+        run_with_state_retry(db, test_id, operation)
+    finally:
+        db.close()
+
+    assert len(attempts) == 2
+    assert attempts[1] == attempts[0] + 1
+    assert STATE_CONFLICTS.value() - conflicts_before == 1
+    data = client.get(f"/api/tests/{test_id}").json()
+    assert data["title"] == "changed here"
+    assert data["description"] == "changed elsewhere"
+
+
+def test_exhausted_retries_conflict(client: TestClient, monkeypatch):
+    test_id = client.post("/api/tests/", json=test_payload).json()["id"]
+    monkeypatch.setenv("TRIANGLE_VISION_STATE_RETRIES", "2")
+    calls = []
+
+    def always_stale(test_id, db):
+        calls.append(test_id)
+        raise StaleDataError("version changed")
+
+    lock = concurrency._stripes[hash(test_id) % concurrency.LOCK_STRIPES]
+    free_during_backoff = []
+
+    def backoff(seconds):
+        free = lock.acquire(blocking=False)
+        if free:
+            lock.release()
+        free_during_backoff.append(free)
+
+    monkeypatch.setattr(test_combination_router, "_next_test_combination", always_stale)
+    monkeypatch.setattr(concurrency, "time", SimpleNamespace(sleep=backoff))
+    response = client.get(f"/api/test-combinations/next/{test_id}")
+    assert response.status_code == 409
+    assert len(calls) == 2
+    # Other requests for the test are not held up by the backoff
+    assert free_during_backoff == [True]
+
+
+def test_concurrent_trials_count_every_result(client: TestClient):
+    """
+    Test concurrent trial loops on one test
+    This test verifies that:
+    1. Every result is recorded once in the rectangles and the snapshot
+    2. No request fails because another one changed the grid
+    """
+    test_id = client.post("/api/tests/", json=test_payload).json()["id"]
+    failures = []
+
+    def participant(seed):
+        rng = random.Random(seed)
+        for _ in range(15):
+            combination = client.get(f"/api/test-combinations/next/{test_id}").json()
+            response = client.post(
+                "/api/test-combinations/result",
+                json={**combination, "success": int(rng.random() < 0.6)},
+            )
+            # A result may name a rectangle another participant just split
+            if response.status_code not in (200, 404):
+                failures.append(response.status_code)
+
+    threads = [threading.Thread(target=participant, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert failures == []
+
+    db = TestingSessionLocal()
+    try:
+        test = db.get(models.Test, test_id)
+        combinations = (
+            db.query(models.TestCombination)
+            .filter(models.TestCombination.test_id == test_id)
+            .count()
+        )
+        state = decode_state(test.state_snapshot, (50.0, 300.0), (0.5, 1.0))
+        assert state.trial_count == combinations > 0
+        rows = db.query(models.Rectangle).filter(models.Rectangle.test_id == test_id)
+        assert sum(r.true_samples + r.false_samples for r in rows) == sum(
+            r["true_samples"] + r["false_samples"] for r in state.rectangles
+        )
+    finally:
+        db.close()
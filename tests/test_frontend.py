@@ -0,0 +1,87 @@
+import gzip
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from routers import frontend_router
+
+SCRIPT = b"console.log('triangle vision');\n" * 100
+
+
+@pytest.fixture
+def build(tmp_path):
+    (tmp_path / "static" / "js").mkdir(parents=True)
+    (tmp_path / "index.html").write_bytes(
+        b"<!doctype html><div id=root></div>" + b" " * 400
+    )
+    (tmp_path / "static" / "js" / "main.1a2b3c4d.js").write_bytes(SCRIPT)
+    (tmp_path / "favicon.ico").write_bytes(b"\x00" * 100)
+    yield tmp_path
+    frontend_router.load_frontend(main.frontend_build_dir)
+
+
+def test_shell_and_assets_served_from_memory(build):
+    frontend_router.load_frontend(build)
+    client = TestClient(main.app)
+
+    shell = client.get("/tests/5", headers={"Accept-Encoding": "identity"})
+    assert shell.status_code == 200
+    assert shell.text.startswith("<!doctype html>")
+    assert shell.headers["cache-control"] == "no-cache"
+    assert "content-encoding" not in shell.headers
+    # The files are read once at startup
+    (build / "index.html").write_bytes(b"changed")
+    cached = client.get(
+        "/", headers={"If-None-Match": shell.headers["etag"], "Accept-Encoding": ""}
+    )
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+    script = client.get(
+        "/static/js/main.1a2b3c4d.js", headers={"Accept-Encoding": "br;q=0, gzip"}
+    )
+    assert script.status_code == 200
+    assert script.headers["content-encoding"] == "gzip"
+    assert script.headers["cache-control"] == "public, max-age=31536000, immutable"
+    assert "Accept-Encoding" in script.headers["vary"]
+    assert script.content == SCRIPT  # decoded by the client
+    assert script.headers["etag"].endswith('-gzip"')
+    assert script.headers["content-type"].startswith(
+        ("application/javascript", "text/javascript")
+    )
+
+    # Small files are not worth compressing
+    icon = client.get("/favicon.ico", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in icon.headers
+    assert icon.content == b"\x00" * 100
+
+    assert client.get("/static/js/missing.js").status_code == 404
+    assert client.get("/api/unknown").status_code == 404
+
+
+def test_precompressed_variants_are_used(build):
+    script = build / "static" / "js" / "main.1a2b3c4d.js"
+    frontend_router.main(str(build))
+    assert gzip.decompress((build / "static/js/main.1a2b3c4d.js.gz").read_bytes()) == (
+        SCRIPT
+    )
+    # A variant written at build time is served as it is
+    script.with_name(script.name + ".gz").write_bytes(gzip.compress(b"prebuilt"))
+    frontend_router.load_frontend(build)
+
+    response = TestClient(main.app).get(
+        "/static/js/main.1a2b3c4d.js", headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.content == b"prebuilt"
+    assert "static/js/main.1a2b3c4d.js.gz" not in frontend_router._assets
+
+
+def test_missing_build(tmp_path):
+    frontend_router.load_frontend(tmp_path / "missing")
+    try:
+        client = TestClient(main.app)
+        assert client.get("/tests/5").status_code == 404
+        assert client.get("/api/tests/").status_code == 200
+    finally:
+        frontend_router.load_frontend(main.frontend_build_dir)
@@ -0,0 +1,176 @@
+import json
+import random
+
+import numpy as np
+import pandas as pd
+
+from algorithm_to_find_combinations.algorithm import run_base_algorithm
+from algorithm_to_find_combinations.ground_truth import ground_truth_probability
+from algorithm_to_find_combinations.plotting import (
+    compute_error,
+    compute_knn_smooth,
+    compute_soft_brush_smooth,
+)
+from algorithm_to_find_combinations.search_engine import (
+    _evaluate_trial,
+    halving_budgets,
+    load_results,
+    prepare_dataset,
+    run_search,
+    successive_halving_search,
+)
+
+triangle_size_bounds = (50, 300)
+saturation_bounds = (0.5, 1.0)
+
+
+def _combinations():
+    random.seed(0)
+    combinations, _ = run_base_algorithm(
+        triangle_size_bounds, saturation_bounds, None, iterations=200
+    )
+    return combinations
+
+
+def _model():
+    X, Y = np.meshgrid(
+        np.linspace(*triangle_size_bounds, 100), np.linspace(*saturation_bounds, 100)
+    )
+    return np.vectorize(
+        lambda x, y: ground_truth_probability(
+            x, y, (triangle_size_bounds, saturation_bounds)
+        )
+    )(X, Y)
+
+
+def test_search_matches_direct_smoothing(tmp_path):
+    """Errors from the precomputed dataset match the plotting functions"""
+    combinations = _combinations()
+    best_knn, best_soft = run_search(
+        combinations,
+        triangle_size_bounds,
+        saturation_bounds,
+        n_trials=4,
+        knn_k_range=(5, 50),
+        results_path=str(tmp_path / "results.jsonl"),
+        workers=2,
+    )
+
+    df = pd.DataFrame(combinations)
+    df["success_float"] = df["success"].astype(float)
+    Z_model = _model()
+
+    _, _, Z_knn, _ = compute_knn_smooth(
+        df, triangle_size_bounds, saturation_bounds, k=best_knn["params"]["k"]
+    )
+    _, _, Z_soft = compute_soft_brush_smooth(
+        df, triangle_size_bounds, saturation_bounds, best_soft["params"]
+    )
+    assert np.isclose(best_knn["error"], compute_error(Z_knn, Z_model))
+    assert np.isclose(best_soft["error"], compute_error(Z_soft, Z_model))
+
+
+def test_large_datasets_evaluate_the_soft_brush_directly():
+    """Past the size cap no sorted matrices are built and errors are unchanged"""
+    df = pd.DataFrame(_combinations())
+    sorted_arrays = prepare_dataset(df, triangle_size_bounds, saturation_bounds, 20)
+    direct_arrays = prepare_dataset(
+        df, triangle_size_bounds, saturation_bounds, 20, max_sorted_entries=0
+    )
+    assert "soft_cum_values" in sorted_arrays
+    assert "soft_cum_values" not in direct_arrays
+    params = {"inner_radius": 20.0, "outer_radius": 60.0}
+    assert np.isclose(
+        _evaluate_trial(direct_arrays, "soft_brush", params),
+        _evaluate_trial(sorted_arrays, "soft_brush", params),
+    )
+
+
+def test_search_resumes_from_persisted_results(tmp_path):
+    """A second run with the same results file only evaluates new trials"""
+    combinations = _combinations()
+    results_path = str(tmp_path / "results.jsonl")
+
+    run_search(
+        combinations,
+        triangle_size_bounds,
+        saturation_bounds,
+        n_trials=3,
+        results_path=results_path,
+        workers=1,
+    )
+    with open(results_path) as f:
+        assert len(f.readlines()) == 6
+
+    run_search(
+        combinations,
+        triangle_size_bounds,
+        saturation_bounds,
+        n_trials=3,
+        results_path=results_path,
+        workers=1,
+    )
+    with open(results_path) as f:
+        assert len(f.readlines()) == 6
+
+    # Results recorded for a different dataset are not picked up
+    assert load_results(results_path, "other-dataset") == []
+
+
+def test_search_does_not_resume_a_different_search_space(tmp_path):
+    """Trial indices of another trial count, range or seed are not reused"""
+    combinations = _combinations()
+    results_path = str(tmp_path / "results.jsonl")
+    run_search(
+        combinations,
+        triangle_size_bounds,
+        saturation_bounds,
+        n_trials=2,
+        results_path=results_path,
+        workers=1,
+    )
+    for changed in (
+        {"n_trials": 3},
+        {"soft_brush_inner_range": (10, 40)},
+        {"knn_k_range": (5, 100)},
+        {"seed": 1},
+    ):
+        run_search(
+            combinations,
+            triangle_size_bounds,
+            saturation_bounds,
+            **{"n_trials": 2, **changed},
+            results_path=results_path,
+            workers=1,
+        )
+    with open(results_path) as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 2 * (2 + 3 + 2 + 2 + 2)
+    assert len({r["dataset"] for r in records}) == 5
+
+
+def test_successive_halving_promotes_best_configurations(tmp_path):
+    """Only the best third of each rung is evaluated with the larger budget"""
+    assert halving_budgets(100, 1000, 3) == [111, 333, 1000]
+
+    global_state = random.getstate()
+    best, history = successive_halving_search(
+        triangle_size_bounds,
+        saturation_bounds,
+        n_configurations=9,
+        min_iterations=50,
+        max_iterations=150,
+        results_path=str(tmp_path / "halving.jsonl"),
+        workers=1,
+    )
+    # The simulated sessions draw from generators of their own
+    assert random.getstate() == global_state
+    first_rung = [r for r in history if r["rung"] == 0]
+    second_rung = [r for r in history if r["rung"] == 1]
+    assert [r["iterations"] for r in first_rung] == [50] * 9
+    assert [r["iterations"] for r in second_rung] == [150] * 3
+
+    promoted = sorted(first_rung, key=lambda r: r["error"])[:3]
+    assert {r["config"] for r in second_rung} == {r["config"] for r in promoted}
+    assert best["iterations"] == 150
+    assert best["error"] == min(r["error"] for r in second_rung)
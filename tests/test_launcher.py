@@ -0,0 +1,60 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import app_launcher
+
+
+def test_server_options(monkeypatch):
+    for name in (
+        app_launcher.WORKERS_ENV,
+        app_launcher.HOST_ENV,
+        app_launcher.LOOP_ENV,
+        app_launcher.HTTP_ENV,
+        app_launcher.KEEPALIVE_ENV,
+    ):
+        monkeypatch.delenv(name, raising=False)
+    assert app_launcher.server_options(production=False) == {
+        "host": "localhost",
+        "port": 8000,
+        "workers": 1,
+    }
+
+    monkeypatch.setenv(app_launcher.WORKERS_ENV, "4")
+    monkeypatch.setenv(app_launcher.LOOP_ENV, "asyncio")
+    options = app_launcher.server_options(production=True)
+    assert options["host"] == "0.0.0.0"
+    assert options["workers"] == 4
+    assert options["loop"] == "asyncio"
+    assert options["http"] in ("httptools", "h11")
+    assert options["timeout_keep_alive"] == 30
+    assert options["access_log"] is False
+
+
+def test_readiness(client):
+    response = client.get("/api/ready")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ready"}
+
+
+def test_wait_until_ready_polls_until_the_server_answers():
+    calls = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            calls.append(self.path)
+            # Starting up for the first two polls
+            self.send_response(200 if len(calls) > 2 else 503)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{server.server_port}{app_launcher.READY_PATH}"
+        assert app_launcher.wait_until_ready(url, timeout=5, interval=0.01)
+        assert calls == [app_launcher.READY_PATH] * 3
+    finally:
+        server.shutdown()
+    assert not app_launcher.wait_until_ready(url, timeout=0.1, interval=0.01)
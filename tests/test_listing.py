@@ -0,0 +1,127 @@
+import json
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+import models.test as models
+from crud.combinations import combination_arrays
+from observability.queries import QUERIES_PER_REQUEST
+from tests.conftest import TestingSessionLocal
+
+
+def _seed_combinations(n):
+    db = TestingSessionLocal()
+    try:
+        test = models.Test(
+            title="Listing test",
+            description="Testing combination listings",
+            min_triangle_size=50.0,
+            max_triangle_size=300.0,
+            min_saturation=0.5,
+            max_saturation=1.0,
+        )
+        db.add(test)
+        db.flush()
+        rectangle = models.Rectangle(
+            test_id=test.id, depth=0, morton=0, true_samples=0, false_samples=0
+        )
+        db.add(rectangle)
+        db.flush()
+        db.add_all(
+            models.TestCombination(
+                test_id=test.id,
+                rectangle_id=rectangle.id,
+                triangle_size=50.0 + i,
+                saturation=0.5 + i / (2 * n),
+                orientation="NESW"[i % 4],
+                success=i % 2,
+            )
+            for i in range(n)
+        )
+        db.commit()
+        return test.id
+    finally:
+        db.close()
+
+
+def test_keyset_pages_cover_every_combination(client: TestClient):
+    """
+    Test GET /api/test-combinations/test/{test_id} with ?after= and ?limit=
+    This test verifies that:
+    1. Pages follow each other by id without gaps or repeats
+    2. The last full page names the cursor of the next one
+    3. Rows serialise as TestCombinationResponse would
+    """
+    test_id = _seed_combinations(25)
+    everything = client.get(f"/api/test-combinations/test/{test_id}").json()
+    assert len(everything) == 25
+
+    seen = []
+    after = None
+    while True:
+        params = {"limit": 10} if after is None else {"limit": 10, "after": after}
+        response = client.get(f"/api/test-combinations/test/{test_id}", params=params)
+        assert response.status_code == 200
+        seen.extend(response.json())
+        after = response.headers.get("X-Next-After")
+        if after is None:
+            break
+    assert seen == everything
+    assert [c["id"] for c in seen] == sorted(c["id"] for c in seen)
+
+    first = everything[0]
+    assert set(first) == set(models.TestCombinationResponse.model_fields)
+    assert models.TestCombinationResponse.model_validate(first).orientation == "N"
+
+    page = client.get("/api/test-combinations/", params={"after": first["id"]})
+    assert page.json()[0]["id"] == everything[1]["id"]
+    skipped = client.get("/api/test-combinations/", params={"skip": 1, "limit": 2})
+    assert [c["id"] for c in skipped.json()] == [c["id"] for c in everything[1:3]]
+
+
+def test_ndjson_stream(client: TestClient, monkeypatch):
+    """The NDJSON listing streams every combination in keyset batches"""
+    import crud.combinations
+
+    test_id = _seed_combinations(25)
+    batches = []
+    original = crud.combinations.combination_rows
+
+    def counting_rows(db, test_id=None, after=None, limit=None):
+        rows = original(db, test_id, after, limit)
+        batches.append(len(rows))
+        return rows
+
+    monkeypatch.setattr(crud.combinations, "combination_rows", counting_rows)
+    monkeypatch.setattr(crud.combinations.iter_combination_rows, "__defaults__", (10,))
+    route = "/api/test-combinations/test/{test_id}/ndjson"
+    streamed_before = QUERIES_PER_REQUEST.sum(route=route)
+    response = client.get(f"/api/test-combinations/test/{test_id}/ndjson")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == client.get(f"/api/test-combinations/test/{test_id}").json()
+    assert batches == [10, 10, 5]
+    # The pages are read while the body streams and still count
+    assert QUERIES_PER_REQUEST.sum(route=route) - streamed_before >= 3
+
+
+def test_combination_arrays(client: TestClient):
+    """The analysis loader reads a test's results into plain float arrays"""
+    test_id = _seed_combinations(6)
+    db = TestingSessionLocal()
+    try:
+        points, success = combination_arrays(db, test_id)
+        assert points.shape == (6, 2) and points.dtype == np.float64
+        assert points[:, 0].tolist() == [50.0, 51.0, 52.0, 53.0, 54.0, 55.0]
+        assert success.tolist() == [0.0, 1.0, 0.0, 1.0, 0.0, 1.0]
+        assert points.flags.c_contiguous and success.flags.c_contiguous
+
+        points, success = combination_arrays(db, test_id, dtype=np.float32)
+        assert points.dtype == success.dtype == np.float32
+        assert np.allclose(points[:, 1], 0.5 + np.arange(6) / 12)
+
+        points, success = combination_arrays(db, test_id + 1)
+        assert points.shape == (0, 2) and success.shape == (0,)
+    finally:
+        db.close()
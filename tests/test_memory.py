@@ -0,0 +1,152 @@
+import tracemalloc
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from algorithm_to_find_combinations.plotting import (
+    allocation_stats,
+    track_allocations,
+)
+from observability.memory import ByteBudgetCache, cache_stats
+from observability.profiling import _tracing_memory
+
+
+def _create_test_with_results(client: TestClient, trials=10):
+    test_id = client.post(
+        "/api/tests/",
+        json={
+            "title": "Memory test",
+            "description": "Testing memory accounting",
+            "min_triangle_size": 50.0,
+            "max_triangle_size": 300.0,
+            "min_saturation": 0.5,
+            "max_saturation": 1.0,
+        },
+    ).json()["id"]
+    for i in range(trials):
+        combination = client.get(f"/api/test-combinations/next/{test_id}").json()
+        client.post(
+            "/api/test-combinations/result",
+            json={**combination, "success": i % 2},
+        )
+    return test_id
+
+
+def test_byte_budget_cache_evicts_least_recently_used(monkeypatch):
+    """
+    Test ByteBudgetCache
+    This test verifies that:
+    1. Entries are evicted once their total size exceeds the byte budget
+    2. Reads refresh an entry's recency
+    3. Values larger than the budget are not stored
+    4. The budget can be overridden from the environment
+    """
+    array = np.zeros(100)  # 800 bytes of data
+    cache = ByteBudgetCache("test-arrays", max_bytes=2500)
+    cache.put("a", array.copy())
+    cache.put("b", array.copy())
+    assert cache.get("a") is not None
+    cache.put("c", array.copy())
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.nbytes <= 2500
+    stats = cache_stats()["test-arrays"]
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+
+    cache.put("big", np.zeros(1000))
+    assert cache.get("big") is None
+
+    cache.pop_matching(lambda key: key == "a")
+    assert cache.get("a") is None and cache.get("c") is not None
+
+    monkeypatch.setenv("TRIANGLE_VISION_CACHE_BYTES_TEST_ARRAYS", "100")
+    assert ByteBudgetCache("test-arrays", max_bytes=2500).max_bytes == 100
+
+
+def test_memory_report(client: TestClient, monkeypatch, tmp_path):
+    """
+    Test the admin memory report
+    This test verifies that:
+    1. The report requires the admin token
+    2. Peak allocations of the smoothing functions are recorded while tracing
+    3. A request profiled in memory mode is kept under its endpoint
+    4. The trial queues report their size with the caches
+    """
+    monkeypatch.setenv("TRIANGLE_VISION_ADMIN_TOKEN", "secret")
+    monkeypatch.setenv("TRIANGLE_VISION_PROFILE_DIR", str(tmp_path))
+    headers = {"X-Admin-Token": "secret"}
+    test_id = _create_test_with_results(client)
+
+    assert client.get("/api/admin/memory").status_code == 403
+    assert (
+        client.get("/api/admin/memory", headers={"X-Admin-Token": "wrong"}).status_code
+        == 403
+    )
+
+    try:
+        response = client.put(
+            "/api/admin/memory/tracing", json={"enabled": True}, headers=headers
+        )
+        assert response.json() == {"tracing": True}
+        assert client.get(f"/api/tests/{test_id}/plot").status_code == 200
+        report = client.get("/api/admin/memory?top=5", headers=headers).json()
+    finally:
+        client.put(
+            "/api/admin/memory/tracing", json={"enabled": False}, headers=headers
+        )
+    assert not tracemalloc.is_tracing()
+
+    assert report["tracemalloc"]["tracing"]
+    # The trial queue of the played test is accounted for like the caches
+    queues = report["caches"]["trial-queues"]
+    assert queues["entries"] >= 1 and 0 < queues["bytes"] <= queues["max_bytes"]
+    peaks = report["smoothing_peaks"]["compute_soft_brush_smooth"]
+    # The soft brush holds several (grid points x samples) float64 matrices
+    assert peaks["last_peak_bytes"] >= 100 * 100 * 10 * 8
+    assert len(report["top_allocations"]) == 5
+
+    response = client.get(
+        f"/api/tests/{test_id}/plot",
+        headers={"X-Profile": "secret", "X-Profile-Mode": "memory"},
+    )
+    assert response.headers["X-Profile-File"].endswith(".memory.txt")
+    assert not tracemalloc.is_tracing()
+    report = client.get("/api/admin/memory", headers=headers).json()
+    snapshot = report["endpoints"]["get_test_plot"][-1]
+    assert snapshot["peak_bytes"] > 0
+    assert snapshot["top"]
+
+
+def test_memory_profile_keeps_the_request_peak(client: TestClient, monkeypatch):
+    """
+    Test that tracked smoothing calls do not reset a profiled request's peak
+    This test verifies that:
+    1. An allocation freed before a tracked call still counts for the block
+    2. A /plot request profiled in memory mode reports at least the peak of
+       its soft brush computation
+    """
+
+    @track_allocations
+    def small_allocation():
+        return np.ones(10).sum()
+
+    with _tracing_memory() as snapshots:
+        large = np.ones(1_000_000)  # 8 MB
+        del large
+        small_allocation()
+    assert snapshots[2] >= 8_000_000
+
+    monkeypatch.setenv("TRIANGLE_VISION_ADMIN_TOKEN", "secret")
+    headers = {"X-Admin-Token": "secret"}
+    test_id = _create_test_with_results(client)
+    response = client.get(
+        f"/api/tests/{test_id}/plot",
+        headers={"X-Profile": "secret", "X-Profile-Mode": "memory"},
+    )
+    assert response.status_code == 200
+    smoothing = allocation_stats()["compute_soft_brush_smooth"]["last_peak_bytes"]
+    assert smoothing >= 100 * 100 * 10 * 8
+    report = client.get("/api/admin/memory", headers=headers).json()
+    assert report["endpoints"]["get_test_plot"][-1]["peak_bytes"] >= smoothing
@@ -0,0 +1,43 @@
+from fastapi.testclient import TestClient
+
+
+def _create_test(client: TestClient):
+    response = client.post(
+        "/api/tests/",
+        json={
+            "title": "Metrics test",
+            "description": "Testing metrics",
+            "min_triangle_size": 50.0,
+            "max_triangle_size": 300.0,
+            "min_saturation": 0.5,
+            "max_saturation": 1.0,
+        },
+    )
+    return response.json()["id"]
+
+
+def test_metrics_endpoint_reports_requests_and_stages(client: TestClient):
+    """
+    Test GET /api/metrics
+    This test verifies that:
+    1. The response is Prometheus text
+    2. Requests are labelled by route template rather than by concrete path
+    3. The trial loop records its state load, selection, sync and commit stages
+    """
+    test_id = _create_test(client)
+    combination = client.get(f"/api/test-combinations/next/{test_id}").json()
+    client.post("/api/test-combinations/result", json={**combination, "success": 1})
+
+    response = client.get("/api/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+
+    assert "# TYPE triangle_vision_http_request_duration_seconds histogram" in body
+    assert 'route="/api/test-combinations/next/{test_id}"' in body
+    assert f'/api/test-combinations/next/{test_id}"' not in body
+    for stage in ("state_load", "next_combination", "sync", "commit"):
+        assert (
+            f'triangle_vision_stage_duration_seconds_count{{stage="{stage}"}}' in body
+        )
+    assert 'triangle_vision_trial_results_total{success="True"}' in body
@@ -0,0 +1,67 @@
+import os
+
+from fastapi.testclient import TestClient
+
+
+def _create_test(client: TestClient):
+    response = client.post(
+        "/api/tests/",
+        json={
+            "title": "Profiling test",
+            "description": "Testing profiling",
+            "min_triangle_size": 50.0,
+            "max_triangle_size": 300.0,
+            "min_saturation": 0.5,
+            "max_saturation": 1.0,
+        },
+    )
+    return response.json()["id"]
+
+
+def test_profile_requires_admin_token(client: TestClient, tmp_path, monkeypatch):
+    """Without a configured token the X-Profile header is ignored"""
+    monkeypatch.delenv("TRIANGLE_VISION_ADMIN_TOKEN", raising=False)
+    monkeypatch.delenv("TRIANGLE_VISION_PROFILE", raising=False)
+    monkeypatch.setenv("TRIANGLE_VISION_PROFILE_DIR", str(tmp_path))
+
+    response = client.get("/api/tests/", headers={"X-Profile": "anything"})
+    assert response.status_code == 200
+    assert "X-Profile-File" not in response.headers
+    assert os.listdir(tmp_path) == []
+
+
+def test_profiled_request_writes_profiles(client: TestClient, tmp_path, monkeypatch):
+    """
+    Test profiling of a trial request
+    This test verifies that:
+    1. Sampling profiles are collapsed stacks that include the handler
+    2. cProfile profiles are written as .pstats files
+    3. Only the newest profiles are kept
+    """
+    monkeypatch.setenv("TRIANGLE_VISION_ADMIN_TOKEN", "secret")
+    monkeypatch.setenv("TRIANGLE_VISION_PROFILE_DIR", str(tmp_path))
+    monkeypatch.setenv("TRIANGLE_VISION_PROFILE_INTERVAL", "0.0001")
+    monkeypatch.setenv("TRIANGLE_VISION_PROFILE_MAX_FILES", "2")
+    test_id = _create_test(client)
+
+    response = client.get(
+        f"/api/test-combinations/next/{test_id}", headers={"X-Profile": "secret"}
+    )
+    assert response.status_code == 200
+    name = response.headers["X-Profile-File"]
+    assert name.endswith(".collapsed")
+    with open(tmp_path / name) as f:
+        lines = f.read().splitlines()
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+    assert any("get_next_test_combination" in line for line in lines)
+
+    response = client.get(
+        f"/api/test-combinations/next/{test_id}",
+        headers={"X-Profile": "secret", "X-Profile-Mode": "cprofile"},
+    )
+    assert response.headers["X-Profile-File"].endswith(".pstats")
+
+    client.get("/api/tests/", headers={"X-Profile": "secret"})
+    assert len(os.listdir(tmp_path)) == 2
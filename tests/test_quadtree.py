@@ -0,0 +1,132 @@
+import random
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+
+from algorithm_to_find_combinations.algorithm import AlgorithmState, split_rectangle
+from algorithm_to_find_combinations.quadtree import (
+    cell_bounds,
+    child_code,
+    deinterleave,
+    interleave,
+    locate,
+    parent,
+    point_code,
+)
+from crud.test import backfill_rectangle_cells
+from db.database import Base, add_missing_columns, add_missing_indexes
+
+triangle_size_bounds = (50.0, 300.0)
+saturation_bounds = (0.5, 1.0)
+
+
+def test_interleave_round_trip():
+    rng = random.Random(0)
+    for _ in range(1000):
+        column, row = rng.getrandbits(31), rng.getrandbits(31)
+        assert deinterleave(interleave(column, row)) == (column, row)
+    assert interleave(0b11, 0b00) == 0b0101
+    assert interleave(0b00, 0b11) == 0b1010
+
+
+def test_children_share_parent_and_tile_it():
+    depth, morton = 3, interleave(5, 2)
+    bounds = cell_bounds(depth, morton, triangle_size_bounds, saturation_bounds)
+    children = [child_code(morton, i, j) for i in range(2) for j in range(2)]
+    assert {parent(depth + 1, c) for c in children} == {(depth, morton)}
+    edges = [
+        cell_bounds(depth + 1, c, triangle_size_bounds, saturation_bounds)
+        for c in children
+    ]
+    assert min(e["triangle_size"][0] for e in edges) == bounds["triangle_size"][0]
+    assert max(e["triangle_size"][1] for e in edges) == bounds["triangle_size"][1]
+    assert min(e["saturation"][0] for e in edges) == bounds["saturation"][0]
+    assert max(e["saturation"][1] for e in edges) == bounds["saturation"][1]
+
+
+def test_split_rectangle_matches_cell_bounds():
+    state = AlgorithmState(triangle_size_bounds, saturation_bounds)
+    rects = state.rectangles
+    for _ in range(4):
+        rects = split_rectangle(rects[-1]) + rects[:-1]
+    for rect in rects:
+        assert rect["bounds"] == cell_bounds(
+            rect["depth"], rect["morton"], triangle_size_bounds, saturation_bounds
+        )
+
+
+def test_locate_finds_cells_at_any_depth():
+    state = AlgorithmState(triangle_size_bounds, saturation_bounds)
+    rects = split_rectangle(state.rectangles[0])
+    rects = split_rectangle(rects[0]) + rects[1:]
+    cells = {(r["depth"], r["morton"]): r for r in rects}
+
+    rng = random.Random(1)
+    for _ in range(500):
+        t = rng.uniform(*triangle_size_bounds)
+        s = rng.uniform(*saturation_bounds)
+        found = locate(cells, t, s, triangle_size_bounds, saturation_bounds)
+        t_min, t_max = found["bounds"]["triangle_size"]
+        s_min, s_max = found["bounds"]["saturation"]
+        assert t_min <= t <= t_max and s_min <= s <= s_max
+
+    # The upper bounds belong to the last cells; points outside to none
+    corner = locate(cells, 300.0, 1.0, triangle_size_bounds, saturation_bounds)
+    assert corner["morton"] == interleave(1, 1)
+    assert locate(cells, 301.0, 0.7, triangle_size_bounds, saturation_bounds) is None
+    assert point_code(49.0, 0.7, 2, triangle_size_bounds, saturation_bounds) is None
+
+
+def test_backfill_cells_of_float_rectangles(tmp_path):
+    """Rectangles stored with float bounds get their cell on startup"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE rectangles (id INTEGER PRIMARY KEY, test_id INTEGER, "
+                "min_triangle_size FLOAT, max_triangle_size FLOAT, "
+                "min_saturation FLOAT, max_saturation FLOAT, area FLOAT, "
+                "true_samples INTEGER, false_samples INTEGER)"
+            )
+        )
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine, Base.metadata)
+
+    state = AlgorithmState(triangle_size_bounds, saturation_bounds)
+    rects = split_rectangle(state.rectangles[0])
+    rects = split_rectangle(rects[3]) + rects[:3]
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "INSERT INTO tests (id, min_triangle_size, max_triangle_size, "
+                "min_saturation, max_saturation) VALUES (1, 50, 300, 0.5, 1)"
+            )
+        )
+        for i, rect in enumerate(rects):
+            connection.execute(
+                text(
+                    "INSERT INTO rectangles (id, test_id, min_triangle_size, "
+                    "max_triangle_size, min_saturation, max_saturation, area) "
+                    "VALUES (:id, 1, :t0, :t1, :s0, :s1, :area)"
+                ),
+                {
+                    "id": i + 1,
+                    "t0": rect["bounds"]["triangle_size"][0],
+                    "t1": rect["bounds"]["triangle_size"][1],
+                    "s0": rect["bounds"]["saturation"][0],
+                    "s1": rect["bounds"]["saturation"][1],
+                    "area": rect["area"],
+                },
+            )
+
+    with sessionmaker(bind=engine)() as db:
+        backfill_rectangle_cells(db)
+    add_missing_indexes(engine, Base.metadata)
+
+    with engine.connect() as connection:
+        cells = connection.execute(
+            text("SELECT depth, morton FROM rectangles ORDER BY id")
+        ).all()
+    assert cells == [(r["depth"], r["morton"]) for r in rects]
+    indexes = {i["name"] for i in inspect(engine).get_indexes("rectangles")}
+    assert "ix_rectangles_test_cell" in indexes
@@ -0,0 +1,105 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import models.test as models
+from algorithm_to_find_combinations.quadtree import point_code
+from observability.queries import (
+    QUERIES_PER_REQUEST,
+    QueryBudgetExceeded,
+    QueryCounter,
+    check_query_budget,
+    query_budget,
+)
+from tests.conftest import TestingSessionLocal
+
+
+def _create_test(client: TestClient):
+    response = client.post(
+        "/api/tests/",
+        json={
+            "title": "Query test",
+            "description": "Testing query counts",
+            "min_triangle_size": 50.0,
+            "max_triangle_size": 300.0,
+            "min_saturation": 0.5,
+            "max_saturation": 1.0,
+        },
+    )
+    return response.json()["id"]
+
+
+def test_trial_loop_query_counts(client: TestClient, monkeypatch):
+    """
+    Test the statement counts of the trial loop
+    This test verifies that:
+    1. Every response carries an X-Query-Count debug header
+    2. The counts stay constant as the history grows, including across splits
+    3. Combinations of split rectangles move to the cell that now contains them
+    """
+    monkeypatch.setenv("TRIANGLE_VISION_DEBUG_HEADERS", "1")
+    # Served from the trial queue, next costs one query (see test_trial_queue)
+    monkeypatch.setenv("TRIANGLE_VISION_TRIAL_QUEUE_DEPTH", "0")
+    test_id = _create_test(client)
+    results_before = QUERIES_PER_REQUEST.count(route="/api/test-combinations/result")
+
+    next_counts, result_counts = set(), set()
+    for _ in range(40):
+        response = client.get(f"/api/test-combinations/next/{test_id}")
+        next_counts.add(int(response.headers["X-Query-Count"]))
+        response = client.post(
+            "/api/test-combinations/result", json={**response.json(), "success": 0}
+        )
+        assert response.status_code == 200
+        result_counts.add(int(response.headers["X-Query-Count"]))
+
+    # Once the first request has created the root rectangle and the state
+    # snapshot, the state and trial count are read with the test row; results
+    # that split a rectangle insert its children
+    assert next_counts == {1, 4}
+    assert result_counts == {5, 12}
+
+    db = TestingSessionLocal()
+    try:
+        rectangles = {
+            r.id: r
+            for r in db.query(models.Rectangle).filter(
+                models.Rectangle.test_id == test_id
+            )
+        }
+        assert len(rectangles) > 1
+        for c in db.query(models.TestCombination).filter(
+            models.TestCombination.test_id == test_id
+        ):
+            cell = rectangles[c.rectangle_id]
+            assert cell.morton == point_code(
+                c.triangle_size, c.saturation, cell.depth, (50.0, 300.0), (0.5, 1.0)
+            )
+    finally:
+        db.close()
+
+    assert (
+        QUERIES_PER_REQUEST.count(route="/api/test-combinations/result")
+        - results_before
+        == 40
+    )
+
+
+def test_query_budget_is_enforced(monkeypatch):
+    """Exceeding a declared budget fails in strict mode and only logs otherwise"""
+
+    @query_budget(2)
+    def endpoint():
+        pass
+
+    counter = QueryCounter()
+    counter.count = 3
+    monkeypatch.setenv("TRIANGLE_VISION_QUERY_BUDGET_STRICT", "1")
+    with pytest.raises(QueryBudgetExceeded):
+        check_query_budget(endpoint, "/endpoint", counter)
+
+    monkeypatch.setenv("TRIANGLE_VISION_QUERY_BUDGET_STRICT", "0")
+    check_query_budget(endpoint, "/endpoint", counter)
+
+    counter.count = 2
+    monkeypatch.setenv("TRIANGLE_VISION_QUERY_BUDGET_STRICT", "1")
+    check_query_budget(endpoint, "/endpoint", counter)
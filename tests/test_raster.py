@@ -0,0 +1,137 @@
+import base64
+import io
+import random
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from algorithm_to_find_combinations import raster
+from algorithm_to_find_combinations.algorithm import run_base_algorithm
+from algorithm_to_find_combinations.plotting import (
+    compute_soft_brush_smooth,
+    sample_arrays,
+)
+from observability.memory import cache_stats
+
+triangle_size_bounds = (50, 300)
+saturation_bounds = (0.5, 1.0)
+
+
+def _surface():
+    random.seed(0)
+    combinations, rectangles = run_base_algorithm(
+        triangle_size_bounds, saturation_bounds, None, iterations=300
+    )
+    samples = sample_arrays(combinations)
+    X, Y, Z = compute_soft_brush_smooth(
+        samples, triangle_size_bounds, saturation_bounds, {}
+    )
+    return samples, rectangles, X, Y, Z
+
+
+def test_surface_colours_follow_the_lookup_table():
+    Z = np.full((100, 100), 0.8)
+    Z[:50] = 1.0  # low saturation rows
+    Z[:, :10] = np.nan
+    Z[:, 90:] = 0.2
+    rgba = raster.surface_rgba(Z, (200, 100))
+    assert rgba.shape == (100, 200, 4) and rgba.dtype == np.uint8
+
+    # Saturation grows upwards, so the first rows of Z end up at the bottom
+    assert (rgba[-1, 50] == raster.LUT[raster.COLORS - 1]).all()
+    assert (rgba[0, 50] == raster.LUT[raster.color_index(0.8)]).all()
+    # Unreached points and points below the lowest contour level are empty
+    assert rgba[50, 5, 3] == 0
+    assert rgba[50, 195, 3] == 0
+
+
+def test_render_surface_formats_and_overlays():
+    samples, rectangles, X, Y, Z = _surface()
+    bare = raster.render_surface(
+        X, Y, Z, triangle_size_bounds, saturation_bounds, framed=False
+    )
+    image = Image.open(io.BytesIO(bare))
+    assert image.format == "PNG" and image.size == raster.RASTER_SIZE
+
+    with_overlays = raster.render_surface(
+        X,
+        Y,
+        Z,
+        triangle_size_bounds,
+        saturation_bounds,
+        framed=False,
+        rectangles=[{"bounds": r["bounds"]} for r in rectangles],
+        samples=samples,
+        threshold=0.75,
+    )
+    assert with_overlays != bare
+
+    framed = raster.render_surface(
+        X, Y, Z, triangle_size_bounds, saturation_bounds, image_format="webp"
+    )
+    image = Image.open(io.BytesIO(framed))
+    assert image.format == "WEBP"
+    assert image.size == raster.figure_template().canvas.get_width_height()
+
+    # The frame is drawn once and accounted for with the other caches
+    hits = cache_stats()["figure-frames"]["hits"]
+    raster.render_surface(X, Y, Z, triangle_size_bounds, saturation_bounds)
+    frames = cache_stats()["figure-frames"]
+    assert frames["hits"] == hits + 1
+    assert frames["bytes"] >= image.size[0] * image.size[1] * 4
+
+
+def test_threshold_lines_match_matplotlib():
+    import matplotlib.pyplot as plt
+
+    _, _, X, Y, Z = _surface()
+    fig, ax = plt.subplots()
+    try:
+        expected = ax.contour(X, Y, Z, levels=[0.75]).allsegs[0]
+    finally:
+        plt.close(fig)
+    lines = raster.threshold_lines(X, Y, Z, 0.75)
+    assert sum(len(line) for line in lines) == sum(len(seg) for seg in expected)
+    assert np.allclose(
+        np.sort(np.concatenate(lines), axis=0),
+        np.sort(np.concatenate(expected), axis=0),
+    )
+
+
+def test_raster_plot_endpoint(client: TestClient):
+    test_id = client.post(
+        "/api/tests/",
+        json={
+            "title": "Raster test",
+            "description": "Testing the raster renderer",
+            "min_triangle_size": 50.0,
+            "max_triangle_size": 300.0,
+            "min_saturation": 0.5,
+            "max_saturation": 1.0,
+        },
+    ).json()["id"]
+    url = f"/api/tests/{test_id}/plot"
+    assert client.get(url, params={"renderer": "raster"}).status_code == 422
+    for i in range(40):
+        combination = client.get(f"/api/test-combinations/next/{test_id}").json()
+        client.post(
+            "/api/test-combinations/result", json={**combination, "success": i % 3 > 0}
+        )
+
+    params = {"step": 10, "show_rectangles": True, "show_threshold": True}
+    slow = client.get(url, params=params).json()
+    fast = client.get(url, params={**params, "renderer": "raster"}).json()
+    assert fast["media_type"] == slow["media_type"] == "image/png"
+    assert Image.open(io.BytesIO(base64.b64decode(fast["image"]))).format == "PNG"
+    # Both renderers find the same threshold line
+    assert len(fast["plot_data"]) == len(slow["plot_data"]) > 0
+    for a, b in zip(fast["plot_data"], slow["plot_data"]):
+        assert a == pytest.approx(b)
+
+    webp = client.get(
+        url, params={"renderer": "raster", "image_format": "webp", "framed": False}
+    ).json()
+    assert webp["media_type"] == "image/webp"
+    assert client.get(url, params={"renderer": "svg"}).status_code == 422
@@ -0,0 +1,140 @@
+import random
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from algorithm_to_find_combinations.algorithm import run_base_algorithm
+from algorithm_to_find_combinations.plotting import (
+    compute_rectangle_aggregate_smooth,
+    compute_soft_brush_smooth,
+    create_single_smooth_plot,
+)
+from algorithm_to_find_combinations.quadtree import child_code
+from algorithm_to_find_combinations.rectangle_aggregate import (
+    neighbour_pairs,
+    posterior_means,
+)
+
+triangle_size_bounds = (50.0, 300.0)
+saturation_bounds = (0.5, 1.0)
+
+
+def _rect(depth, morton, true_samples=0, false_samples=0):
+    return {
+        "depth": depth,
+        "morton": morton,
+        "true_samples": true_samples,
+        "false_samples": false_samples,
+    }
+
+
+def test_neighbours_across_depths():
+    # The root's children, the upper right one split again
+    rectangles = [_rect(1, child_code(0, i, j)) for i, j in ((0, 0), (1, 0), (0, 1))]
+    upper_right = child_code(0, 1, 1)
+    rectangles += [
+        _rect(2, child_code(upper_right, i, j)) for j in range(2) for i in range(2)
+    ]
+    receivers, givers, shares = neighbour_pairs(rectangles)
+    pairs = dict(zip(zip(receivers.tolist(), givers.tolist()), shares.tolist()))
+
+    # Lower left touches the lower right and upper left, not diagonally
+    assert {j for i, j in pairs if i == 0} == {1, 2}
+    # The lower right shares half a side with each of the two grandchildren
+    # above it, which each share a whole side with it
+    assert pairs[1, 3] == pairs[1, 4] == 0.5
+    assert pairs[3, 1] == pairs[4, 1] == 1.0
+    assert (1, 5) not in pairs and (1, 6) not in pairs
+    # Grandchildren are neighbours of their siblings
+    assert pairs[3, 4] == pairs[3, 5] == 1.0
+    assert all((j, i) in pairs for i, j in pairs)
+
+
+def test_posteriors_pool_neighbour_counts():
+    rectangles = [
+        _rect(1, child_code(0, 0, 0), true_samples=10),
+        _rect(1, child_code(0, 1, 0), false_samples=10),
+        _rect(1, child_code(0, 0, 1)),
+        _rect(1, child_code(0, 1, 1)),
+    ]
+    means = posterior_means(rectangles)
+    assert means[0] > 0.5 > means[1]
+    # The empty upper left leans towards the successful rectangle below it,
+    # the upper right towards the failing one
+    assert means[2] > 0.5 > means[3]
+
+    means = posterior_means(rectangles, {"neighbour_weight": 0})
+    assert np.isnan(means[2:]).all()
+
+
+def test_aggregate_surface_follows_the_soft_brush():
+    random.seed(0)
+    combinations, rectangles = run_base_algorithm(
+        triangle_size_bounds, saturation_bounds, None, iterations=600
+    )
+    X, Y, Z = compute_rectangle_aggregate_smooth(
+        rectangles, triangle_size_bounds, saturation_bounds
+    )
+    _, _, Z_brush = compute_soft_brush_smooth(
+        combinations, triangle_size_bounds, saturation_bounds, {}
+    )
+    assert X.shape == Y.shape == Z.shape == Z_brush.shape
+    both = ~np.isnan(Z) & ~np.isnan(Z_brush)
+    assert both.mean() > 0.9
+    assert np.abs(Z - Z_brush)[both].mean() < 0.1
+
+    fig, ax = plt.subplots()
+    try:
+        X_plot, Y_plot, Z_plot = create_single_smooth_plot(
+            None,
+            triangle_size_bounds,
+            saturation_bounds,
+            smoothing_method="rectangle_aggregate",
+            ax=ax,
+            rectangles=rectangles,
+            show_rectangles=False,
+        )
+        assert not ax.patches
+        with pytest.raises(ValueError):
+            create_single_smooth_plot(
+                combinations,
+                triangle_size_bounds,
+                saturation_bounds,
+                smoothing_method="rectangle_aggregate",
+                ax=ax,
+            )
+    finally:
+        plt.close(fig)
+    assert np.array_equal(Z_plot, Z, equal_nan=True)
+
+
+def test_aggregate_plot_endpoint(client: TestClient):
+    test_id = client.post(
+        "/api/tests/",
+        json={
+            "title": "Aggregate test",
+            "description": "Testing the rectangle-aggregate estimator",
+            "min_triangle_size": 50.0,
+            "max_triangle_size": 300.0,
+            "min_saturation": 0.5,
+            "max_saturation": 1.0,
+        },
+    ).json()["id"]
+    url = f"/api/tests/{test_id}/plot"
+    params = {"smoothing_method": "rectangle_aggregate", "renderer": "raster"}
+    assert client.get(url, params=params).status_code == 422
+    for i in range(40):
+        combination = client.get(f"/api/test-combinations/next/{test_id}").json()
+        client.post(
+            "/api/test-combinations/result", json={**combination, "success": i % 3 > 0}
+        )
+
+    for renderer in ("raster", "matplotlib"):
+        response = client.get(
+            url, params={**params, "renderer": renderer, "show_rectangles": True}
+        )
+        assert response.status_code == 200
+        assert response.json()["media_type"] == "image/png"
+    assert client.get(url, params={"smoothing_method": "knn"}).status_code == 422
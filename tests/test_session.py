@@ -0,0 +1,162 @@
+import random
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.orm.exc import StaleDataError
+from starlette.websockets import WebSocketDisconnect
+
+import models.test as models
+import routers.test_combination_router as router_module
+from algorithm_to_find_combinations.quadtree import point_code
+from algorithm_to_find_combinations.state_snapshot import decode_state
+from tests.conftest import TestingSessionLocal
+
+test_payload = {
+    "title": "Session test",
+    "description": "Testing trial sessions",
+    "min_triangle_size": 50.0,
+    "max_triangle_size": 300.0,
+    "min_saturation": 0.5,
+    "max_saturation": 1.0,
+}
+
+
+def _play(websocket, trials, rng):
+    played = []
+    for _ in range(trials):
+        combination = websocket.receive_json()
+        assert combination["type"] == "combination"
+        success = int(rng.random() < 0.6)
+        websocket.send_json(
+            {"type": "result", "trial": combination["trial"], "success": success}
+        )
+        assert websocket.receive_json() == {
+            "type": "ack",
+            "trial": combination["trial"],
+        }
+        played.append((combination, success))
+    return played
+
+
+def test_session_persists_every_result(client: TestClient, monkeypatch):
+    """
+    Test the /api/test-combinations/session/{test_id} WebSocket
+    This test verifies that:
+    1. Each result is acknowledged and followed by the next combination
+    2. Batched results are stored with the rectangle containing them
+    3. The stored state matches the rectangles and counts every result once
+    """
+    monkeypatch.setenv("TRIANGLE_VISION_SESSION_BATCH", "7")
+    test_id = client.post("/api/tests/", json=test_payload).json()["id"]
+
+    rng = random.Random(0)
+    with client.websocket_connect(
+        f"/api/test-combinations/session/{test_id}"
+    ) as websocket:
+        played = _play(websocket, 40, rng)
+        assert websocket.receive_json()["type"] == "combination"
+        websocket.send_json({"type": "end"})
+        assert websocket.receive_json() == {"type": "end", "trial_count": 40}
+    assert [c["total_samples"] for c, _ in played] == list(range(40))
+
+    db = TestingSessionLocal()
+    try:
+        test = db.get(models.Test, test_id)
+        combinations = (
+            db.query(models.TestCombination)
+            .filter(models.TestCombination.test_id == test_id)
+            .order_by(models.TestCombination.id)
+            .all()
+        )
+        assert [
+            (c.triangle_size, c.saturation, c.orientation, c.success)
+            for c in combinations
+        ] == [
+            (c["triangle_size"], c["saturation"], c["orientation"], success)
+            for c, success in played
+        ]
+
+        rectangles = {
+            r.id: r
+            for r in db.query(models.Rectangle).filter(
+                models.Rectangle.test_id == test_id
+            )
+        }
+        assert len(rectangles) > 1
+        for c in combinations:
+            cell = rectangles[c.rectangle_id]
+            assert cell.morton == point_code(
+                c.triangle_size, c.saturation, cell.depth, (50.0, 300.0), (0.5, 1.0)
+            )
+
+        state = decode_state(test.state_snapshot, (50.0, 300.0), (0.5, 1.0))
+        assert state.trial_count == 40
+        assert sorted(
+            (r["id"], r["true_samples"], r["false_samples"]) for r in state.rectangles
+        ) == sorted(
+            (r.id, r.true_samples, r.false_samples) for r in rectangles.values()
+        )
+    finally:
+        db.close()
+
+    # Trials over HTTP continue from the session's state
+    response = client.get(f"/api/test-combinations/next/{test_id}")
+    assert response.json()["total_samples"] == 40
+
+
+def test_session_rejects_unexpected_messages(client: TestClient):
+    test_id = client.post("/api/tests/", json=test_payload).json()["id"]
+    with client.websocket_connect(
+        f"/api/test-combinations/session/{test_id}"
+    ) as websocket:
+        combination = websocket.receive_json()
+        websocket.send_json({"type": "result", "trial": 5, "success": 1})
+        assert websocket.receive_json()["type"] == "error"
+        # The same combination is offered again
+        assert websocket.receive_json() == combination
+
+
+def test_session_unknown_test(client: TestClient):
+    with client.websocket_connect("/api/test-combinations/session/99999") as websocket:
+        assert websocket.receive_json() == {"type": "error", "detail": "Test not found"}
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+    assert closed.value.code == 4404
+
+
+def test_session_stops_acknowledging_when_storing_fails(
+    client: TestClient, monkeypatch
+):
+    monkeypatch.setenv("TRIANGLE_VISION_SESSION_BATCH", "3")
+    persist = router_module._persist_session_results
+
+    def failing_persist(test_id, results, db):
+        if results:
+            raise StaleDataError("state kept changing")
+        return persist(test_id, results, db)
+
+    monkeypatch.setattr(router_module, "_persist_session_results", failing_persist)
+    test_id = client.post("/api/tests/", json=test_payload).json()["id"]
+    acknowledged = 0
+    with client.websocket_connect(
+        f"/api/test-combinations/session/{test_id}"
+    ) as websocket:
+        for _ in range(20):
+            message = websocket.receive_json()
+            if message["type"] == "error":
+                break
+            websocket.send_json(
+                {"type": "result", "trial": message["trial"], "success": 1}
+            )
+            message = websocket.receive_json()
+            if message["type"] == "error":
+                break
+            assert message == {"type": "ack", "trial": message["trial"]}
+            acknowledged += 1
+        assert message == {"type": "error", "detail": "Results could not be stored"}
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+    assert closed.value.code == 1011
+    # The failed batch is the first one; at most the results sent while it
+    # was being written were acknowledged as well
+    assert 3 <= acknowledged < 20
@@ -0,0 +1,80 @@
+import random
+
+import numpy as np
+import pandas as pd
+
+from algorithm_to_find_combinations.algorithm import run_base_algorithm
+from algorithm_to_find_combinations.plotting import (
+    compute_knn_smooth,
+    compute_knn_smooth_multi,
+    compute_soft_brush_smooth,
+)
+
+triangle_size_bounds = (50, 300)
+saturation_bounds = (0.5, 1.0)
+
+
+def _samples(iterations=300):
+    random.seed(0)
+    combinations, rectangles = run_base_algorithm(
+        triangle_size_bounds, saturation_bounds, None, iterations=iterations
+    )
+    df = pd.DataFrame(combinations)
+    df["success_float"] = df["success"].astype(float)
+    return df, rectangles
+
+
+def test_knn_multi_matches_single_k():
+    """Every surface of a k sweep equals the single-k smoothing"""
+    df, _ = _samples()
+    ks = [1, 5, 40, 200]
+    X, Y, surfaces = compute_knn_smooth_multi(
+        df, triangle_size_bounds, saturation_bounds, ks
+    )
+    assert sorted(surfaces) == ks
+    for k in ks:
+        X_k, Y_k, Z_k, _ = compute_knn_smooth(
+            df, triangle_size_bounds, saturation_bounds, k=k
+        )
+        assert np.array_equal(X, X_k) and np.array_equal(Y, Y_k)
+        assert np.allclose(surfaces[k], Z_k)
+
+    X, Y, surfaces = compute_knn_smooth_multi(
+        df, triangle_size_bounds, saturation_bounds, [5, 40], resolution=30
+    )
+    X_k, Y_k, Z_k, _ = compute_knn_smooth(
+        df, triangle_size_bounds, saturation_bounds, k=40, resolution=30
+    )
+    assert X.shape == surfaces[40].shape == (30, 30)
+    assert np.array_equal(X, X_k) and np.allclose(surfaces[40], Z_k)
+
+
+def test_knn_smooth_leaves_dataframe_untouched():
+    df, _ = _samples()
+    columns = list(df.columns)
+    compute_knn_smooth(df, triangle_size_bounds, saturation_bounds, k=10)
+    compute_knn_smooth_multi(df, triangle_size_bounds, saturation_bounds, [10, 20])
+    assert list(df.columns) == columns
+
+
+def test_smoothing_accepts_sample_arrays():
+    """(points, success) arrays smooth exactly like the DataFrame"""
+    df, _ = _samples()
+    arrays = (
+        df[["triangle_size", "saturation"]].to_numpy(),
+        df["success_float"].to_numpy(),
+    )
+    params = {"inner_radius": 10.0, "outer_radius": 40.0}
+    _, _, Z_df = compute_soft_brush_smooth(
+        df, triangle_size_bounds, saturation_bounds, params
+    )
+    _, _, Z_arrays = compute_soft_brush_smooth(
+        arrays, triangle_size_bounds, saturation_bounds, params
+    )
+    assert np.array_equal(Z_df, Z_arrays, equal_nan=True)
+
+    _, _, Z_df, _ = compute_knn_smooth(df, triangle_size_bounds, saturation_bounds)
+    _, _, Z_arrays, _ = compute_knn_smooth(
+        arrays, triangle_size_bounds, saturation_bounds
+    )
+    assert np.array_equal(Z_df, Z_arrays)
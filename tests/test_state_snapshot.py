@@ -0,0 +1,131 @@
+import random
+
+import numpy as np
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, inspect, text
+
+from algorithm_to_find_combinations.algorithm import (
+    AlgorithmState,
+    split_rectangle,
+)
+from algorithm_to_find_combinations.state_snapshot import (
+    HEADER,
+    decode_cells,
+    decode_state,
+    encode_state,
+)
+from db.database import Base, add_missing_columns
+import models.test as models
+from tests.conftest import TestingSessionLocal
+
+triangle_size_bounds = (50, 300)
+saturation_bounds = (0.5, 1.0)
+
+
+def test_snapshot_round_trip():
+    """Decoding a snapshot restores every cell and views the blob directly"""
+    state = AlgorithmState(triangle_size_bounds, saturation_bounds)
+    rectangles = split_rectangle(state.rectangles[0])
+    rectangles = split_rectangle(rectangles[0]) + rectangles[1:]
+    for i, rect in enumerate(rectangles):
+        rect["id"] = 100 + i
+        rect["true_samples"], rect["false_samples"] = i, 2 * i
+    state = AlgorithmState(triangle_size_bounds, saturation_bounds, rectangles)
+
+    blob = encode_state(state)
+    decoded = decode_state(blob, triangle_size_bounds, saturation_bounds)
+    assert decoded.rectangles == rectangles
+    assert not decoded.new_rectangles
+
+    cells = decode_cells(blob)
+    assert not cells.flags.owndata
+    assert np.shares_memory(cells, np.frombuffer(blob, dtype=np.uint8))
+
+    # Unknown formats fall back to the rectangle rows
+    newer = HEADER.pack(b"TVSS", 99, 0, 0) + blob[HEADER.size :]
+    assert decode_state(newer, triangle_size_bounds, saturation_bounds) is None
+    assert decode_state(None, triangle_size_bounds, saturation_bounds) is None
+
+
+def test_snapshot_tracks_rectangle_rows(client: TestClient):
+    """
+    Test the state snapshot written by the trial loop
+    This test verifies that:
+    1. The snapshot matches the rectangle rows after every kind of update
+    2. Each result is counted once in its rectangle
+    """
+    test_id = client.post(
+        "/api/tests/",
+        json={
+            "title": "Snapshot test",
+            "description": "Testing state snapshots",
+            "min_triangle_size": 50.0,
+            "max_triangle_size": 300.0,
+            "min_saturation": 0.5,
+            "max_saturation": 1.0,
+        },
+    ).json()["id"]
+
+    random.seed(0)
+    for i in range(30):
+        combination = client.get(f"/api/test-combinations/next/{test_id}").json()
+        response = client.post(
+            "/api/test-combinations/result",
+            json={**combination, "success": int(random.random() < 0.7)},
+        )
+        assert response.status_code == 200
+
+        if i == 0:
+            # A single result cannot split the root rectangle
+            db = TestingSessionLocal()
+            root = (
+                db.query(models.Rectangle)
+                .filter(models.Rectangle.test_id == test_id)
+                .one()
+            )
+            assert root.true_samples + root.false_samples == 1
+            db.close()
+
+    db = TestingSessionLocal()
+    try:
+        test = db.get(models.Test, test_id)
+        cells = decode_cells(test.state_snapshot)
+        rows = (
+            db.query(models.Rectangle)
+            .filter(models.Rectangle.test_id == test_id)
+            .order_by(models.Rectangle.id)
+            .all()
+        )
+        assert len(rows) > 1
+        cells = np.sort(cells, order="id")
+        assert cells["id"].tolist() == [r.id for r in rows]
+        assert cells["true_samples"].tolist() == [r.true_samples for r in rows]
+        assert cells["false_samples"].tolist() == [r.false_samples for r in rows]
+        assert cells["depth"].tolist() == [r.depth for r in rows]
+        assert cells["morton"].tolist() == [r.morton for r in rows]
+    finally:
+        db.close()
+
+
+def test_add_missing_columns(tmp_path):
+    """Columns added to a model are added to existing databases"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE tests (id INTEGER PRIMARY KEY, title VARCHAR, "
+                "description VARCHAR, min_triangle_size FLOAT, "
+                "max_triangle_size FLOAT, min_saturation FLOAT, "
+                "max_saturation FLOAT, created_at DATETIME)"
+            )
+        )
+        connection.execute(text("INSERT INTO tests (id, title) VALUES (1, 'old')"))
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine, Base.metadata)
+
+    columns = {c["name"] for c in inspect(engine).get_columns("tests")}
+    assert "state_snapshot" in columns
+    with engine.connect() as connection:
+        assert connection.execute(
+            text("SELECT title, state_snapshot FROM tests")
+        ).all() == [("old", None)]
@@ -0,0 +1,98 @@
+import numpy as np
+from fastapi.testclient import TestClient
+
+from algorithm_to_find_combinations.surface_payload import (
+    HEADER,
+    MEDIA_TYPE,
+    decode_surface,
+    encode_surface,
+)
+
+triangle_size_bounds = (50.0, 300.0)
+saturation_bounds = (0.5, 1.0)
+
+
+def _surface():
+    X, Y = np.meshgrid(
+        np.linspace(*triangle_size_bounds, 100), np.linspace(*saturation_bounds, 80)
+    )
+    Z = 0.5 + 0.5 * np.sin(X / 40) * np.cos(Y * 6) ** 2
+    Z[:5, :7] = np.nan
+    return X, Y, Z
+
+
+def test_round_trip():
+    X, Y, Z = _surface()
+    points = np.array([[50.0, 0.5], [175.0, 0.75], [300.0, 1.0]])
+    success = np.array([1.0, 0.0, 1.0])
+    rectangles = [
+        {"bounds": {"triangle_size": (50.0, 175.0), "saturation": (0.75, 1.0)}}
+    ]
+
+    for encoding, tolerance in (("u8", 0.5 / 255), ("f16", 1e-3)):
+        payload = encode_surface(
+            X,
+            Y,
+            Z,
+            triangle_size_bounds,
+            saturation_bounds,
+            samples=(points, success),
+            rectangles=rectangles,
+            encoding=encoding,
+        )
+        surface = decode_surface(payload)
+        assert surface["encoding"] == encoding
+        assert np.allclose(surface["x"], X[0]) and np.allclose(surface["y"], Y[:, 0])
+        assert np.array_equal(np.isnan(surface["Z"]), np.isnan(Z))
+        assert np.nanmax(np.abs(surface["Z"] - Z)) <= tolerance
+        decoded_points, decoded_success = surface["samples"]
+        assert np.allclose(decoded_points, points, rtol=0, atol=1e-4 * 250)
+        assert decoded_success.tolist() == [1.0, 0.0, 1.0]
+        assert np.allclose(
+            surface["rectangles"][0]["bounds"]["triangle_size"],
+            (50.0, 175.0),
+            rtol=0,
+            atol=250 / 65535,
+        )
+
+    # One byte per grid point plus a bit for its mask
+    compact = encode_surface(X, Y, Z, triangle_size_bounds, saturation_bounds)
+    assert len(compact) == HEADER.size + 180 * 4 + 8000 + 1000
+
+
+def test_surface_endpoint(client: TestClient):
+    test_id = client.post(
+        "/api/tests/",
+        json={
+            "title": "Surface test",
+            "description": "Testing the surface payload",
+            "min_triangle_size": 50.0,
+            "max_triangle_size": 300.0,
+            "min_saturation": 0.5,
+            "max_saturation": 1.0,
+        },
+    ).json()["id"]
+    assert client.get(f"/api/tests/{test_id}/surface").status_code == 422
+    for i in range(20):
+        combination = client.get(f"/api/test-combinations/next/{test_id}").json()
+        client.post(
+            "/api/test-combinations/result", json={**combination, "success": i % 2}
+        )
+
+    response = client.get(f"/api/tests/{test_id}/surface", params={"encoding": "f16"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == MEDIA_TYPE
+    surface = decode_surface(response.content)
+    assert surface["Z"].shape == (100, 100)
+    assert surface["samples"][0].shape == (20, 2)
+    assert surface["samples"][1].sum() == 10
+    assert len(surface["rectangles"]) >= 1
+
+    bare = client.get(
+        f"/api/tests/{test_id}/surface",
+        params={"include_samples": False, "include_rectangles": False},
+    )
+    surface = decode_surface(bare.content)
+    assert surface["encoding"] == "u8"
+    assert len(surface["samples"][0]) == 0 and surface["rectangles"] == []
+    assert client.get(f"/api/tests/{test_id + 1}/surface").status_code == 404
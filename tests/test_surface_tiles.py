@@ -0,0 +1,136 @@
+import random
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from algorithm_to_find_combinations.algorithm import run_base_algorithm
+from algorithm_to_find_combinations.plotting import (
+    normalized_points,
+    sample_arrays,
+    soft_brush_at,
+    soft_brush_radii,
+)
+from algorithm_to_find_combinations.surface_payload import decode_surface
+from algorithm_to_find_combinations.surface_tiles import (
+    compute_tile,
+    normalized_samples,
+    tile_bounds,
+)
+from observability.memory import cache_stats
+
+triangle_size_bounds = (50.0, 300.0)
+saturation_bounds = (0.5, 1.0)
+
+
+def _samples():
+    random.seed(0)
+    combinations, _ = run_base_algorithm(
+        triangle_size_bounds, saturation_bounds, None, iterations=400
+    )
+    return sample_arrays(combinations)
+
+
+def test_tiles_match_the_full_computation():
+    """Leaving out distant samples does not change a tile"""
+    samples = _samples()
+    for level, column, row in ((0, 0, 0), (2, 1, 3), (4, 9, 2)):
+        X, Y, Z = compute_tile(
+            samples, triangle_size_bounds, saturation_bounds, level, column, row
+        )
+        ts, sat = tile_bounds(
+            level, column, row, triangle_size_bounds, saturation_bounds
+        )
+        assert ts[0] < X.min() < X.max() < ts[1]
+        assert sat[0] < Y.min() < Y.max() < sat[1]
+        expected = soft_brush_at(
+            normalized_points(
+                np.column_stack([X.ravel(), Y.ravel()]),
+                triangle_size_bounds,
+                saturation_bounds,
+            ),
+            normalized_points(samples[0], triangle_size_bounds, saturation_bounds),
+            samples[1],
+            *soft_brush_radii(triangle_size_bounds, saturation_bounds, {}),
+        ).reshape(X.shape)
+        assert np.allclose(Z, expected, equal_nan=True)
+
+        # Prepared samples give the same tile
+        _, _, Z_prepared = compute_tile(
+            normalized_samples(samples, triangle_size_bounds, saturation_bounds),
+            triangle_size_bounds,
+            saturation_bounds,
+            level,
+            column,
+            row,
+        )
+        assert np.array_equal(Z_prepared, Z, equal_nan=True)
+
+
+def test_child_tiles_refine_their_parent():
+    """The four tiles below a tile cover it at twice the resolution"""
+    samples = _samples()
+    _, _, parent = compute_tile(
+        samples, triangle_size_bounds, saturation_bounds, 1, 1, 0, size=32
+    )
+    children = [
+        [
+            compute_tile(
+                samples, triangle_size_bounds, saturation_bounds, 2, 2 + i, j, size=16
+            )[2]
+            for i in range(2)
+        ]
+        for j in range(2)
+    ]
+    assert np.allclose(np.block(children), parent, equal_nan=True)
+
+    with pytest.raises(ValueError):
+        compute_tile(samples, triangle_size_bounds, saturation_bounds, 1, 2, 0)
+
+
+def test_tile_endpoint(client: TestClient, monkeypatch):
+    monkeypatch.setenv("TRIANGLE_VISION_DEBUG_HEADERS", "1")
+    test_id = client.post(
+        "/api/tests/",
+        json={
+            "title": "Tile test",
+            "description": "Testing surface tiles",
+            "min_triangle_size": 50.0,
+            "max_triangle_size": 300.0,
+            "min_saturation": 0.5,
+            "max_saturation": 1.0,
+        },
+    ).json()["id"]
+    for i in range(20):
+        combination = client.get(f"/api/test-combinations/next/{test_id}").json()
+        client.post(
+            "/api/test-combinations/result", json={**combination, "success": i % 2}
+        )
+
+    url = f"/api/tests/{test_id}/tiles/3/5/2"
+    misses = cache_stats()["surface-tiles"]["misses"]
+    response = client.get(url)
+    assert response.status_code == 200
+    tile = decode_surface(response.content)
+    assert tile["Z"].shape == (64, 64)
+    assert tile["triangle_size_bounds"] == (206.25, 237.5)
+    assert tile["saturation_bounds"] == (0.625, 0.6875)
+
+    # Served from the cache until the test's state changes; the tile and the
+    # samples it was computed from both missed
+    png = client.get(url, params={"encoding": "png"})
+    assert png.headers["content-type"] == "image/png"
+    stats = cache_stats()["surface-tiles"]
+    assert stats["misses"] == misses + 2 and stats["hits"] >= 1
+    # Other tiles of the same state reuse the samples without loading them
+    neighbour = client.get(f"/api/tests/{test_id}/tiles/3/5/3")
+    assert neighbour.headers["X-Query-Count"] == "1"
+    assert cache_stats()["surface-tiles"]["misses"] == misses + 3
+    combination = client.get(f"/api/test-combinations/next/{test_id}").json()
+    client.post("/api/test-combinations/result", json={**combination, "success": 1})
+    client.get(url)
+    assert cache_stats()["surface-tiles"]["misses"] == misses + 5
+
+    assert client.get(f"/api/tests/{test_id}/tiles/3/8/0").status_code == 404
+    assert client.get(f"/api/tests/{test_id}/tiles/9/0/0").status_code == 422
+    assert client.get(f"/api/tests/{test_id + 1}/tiles/0/0/0").status_code == 404
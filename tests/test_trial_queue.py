@@ -0,0 +1,143 @@
+import random
+
+from fastapi.testclient import TestClient
+
+import models.test as models
+from algorithm_to_find_combinations.algorithm import AlgorithmState, split_rectangle
+from algorithm_to_find_combinations.trial_queue import (
+    TrialQueues,
+    _queue_size,
+    _TestQueue,
+    trial_queues,
+)
+from observability.memory import cache_stats
+from tests.conftest import TestingSessionLocal
+
+triangle_size_bounds = (50.0, 300.0)
+saturation_bounds = (0.5, 1.0)
+
+
+def _state():
+    state = AlgorithmState(triangle_size_bounds, saturation_bounds)
+    rectangles = split_rectangle(state.rectangles[0])
+    for i, rect in enumerate(rectangles):
+        rect["id"] = i + 1
+    return AlgorithmState(
+        triangle_size_bounds, saturation_bounds, rectangles, trial_count=7
+    )
+
+
+def test_queue_serves_combinations_of_its_version():
+    queues = TrialQueues("test-trial-queues")
+    state = _state()
+    queues.refresh(1, state, version=3)
+    queues.join()
+
+    entry = queues.pop(1, 3)
+    rect = next(r for r in state.rectangles if r["id"] == entry["rectangle_id"])
+    assert rect["bounds"]["triangle_size"][0] <= entry["triangle_size"]
+    assert entry["triangle_size"] <= rect["bounds"]["triangle_size"][1]
+    assert entry["total_samples"] == 7
+
+    # Another writer moved the state on: the queue is discarded
+    assert queues.pop(1, 4) is None
+    assert queues.pop(1, 3) is None
+
+
+def test_split_drops_only_entries_of_removed_rectangles(monkeypatch):
+    monkeypatch.setenv("TRIANGLE_VISION_TRIAL_QUEUE_DEPTH", "200")
+    queues = TrialQueues("test-trial-queues")
+    state = _state()
+    queues.refresh(1, state, version=1)
+    queues.join()
+    before = list(queues._queues.peek(1).entries)
+    assert {e["rectangle_id"] for e in before} == {1, 2, 3, 4}
+
+    # Rectangle 2 splits; the new state is only handed over after commit
+    new_state = _state()
+    new_state.rectangles = [r for r in new_state.rectangles if r["id"] != 2]
+    queues.refresh(1, new_state, version=2, removed_ids=[2])
+    queues.join()
+    kept = [e for e in before if e["rectangle_id"] != 2]
+    after = list(queues._queues.peek(1).entries)
+    assert after[: len(kept)] == kept
+    assert all(e["rectangle_id"] != 2 for e in after)
+
+
+def test_queues_are_bounded_by_bytes():
+    state = _state()
+    one_test = _queue_size(_TestQueue(state, 1))
+    queues = TrialQueues("test-trial-queues", max_bytes=2 * one_test)
+    for test_id in (1, 2, 3):
+        queues.refresh(test_id, state, version=1)
+    queues.join()
+    # The least recently refreshed test is dropped first
+    assert queues.pop(1, 1) is None
+    assert queues.pop(3, 1) is not None
+    assert cache_stats()["test-trial-queues"]["evictions"] == 1
+
+
+def test_next_pops_from_queue(client: TestClient, monkeypatch):
+    """
+    Test GET /api/test-combinations/next/{test_id} with a filled queue
+    This test verifies that:
+    1. After a result the next combination is served with a single query
+    2. Served combinations name stored rectangles and can be submitted
+    3. A bounds change discards the queue
+    """
+    monkeypatch.setenv("TRIANGLE_VISION_DEBUG_HEADERS", "1")
+    test_id = client.post(
+        "/api/tests/",
+        json={
+            "title": "Queue test",
+            "description": "Testing the trial queue",
+            "min_triangle_size": 50.0,
+            "max_triangle_size": 300.0,
+            "min_saturation": 0.5,
+            "max_saturation": 1.0,
+        },
+    ).json()["id"]
+
+    random.seed(2)
+    counts = []
+    for i in range(30):
+        trial_queues.join()
+        combination = client.get(f"/api/test-combinations/next/{test_id}")
+        counts.append(int(combination.headers["X-Query-Count"]))
+        assert combination.json()["total_samples"] == i
+        response = client.post(
+            "/api/test-combinations/result",
+            json={**combination.json(), "success": int(random.random() < 0.6)},
+        )
+        assert response.status_code == 200
+    assert counts[1:] == [1] * 29
+
+    db = TestingSessionLocal()
+    try:
+        rectangle_ids = {
+            r.id
+            for r in db.query(models.Rectangle).filter(
+                models.Rectangle.test_id == test_id
+            )
+        }
+    finally:
+        db.close()
+    trial_queues.join()
+    assert {e["rectangle_id"] for e in trial_queues._queues.peek(test_id).entries} <= (
+        rectangle_ids
+    )
+
+    client.put(
+        f"/api/tests/{test_id}",
+        json={
+            "title": "Queue test",
+            "description": "Testing the trial queue",
+            "min_triangle_size": 50.0,
+            "max_triangle_size": 200.0,
+            "min_saturation": 0.5,
+            "max_saturation": 1.0,
+        },
+    )
+    assert trial_queues._queues.peek(test_id) is None
+    combination = client.get(f"/api/test-combinations/next/{test_id}").json()
+    assert combination["triangle_size"] <= 200.0